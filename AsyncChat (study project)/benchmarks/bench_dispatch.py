@@ -0,0 +1,119 @@
+"""Бенчмарк разбора сообщений в MessageProcessor.process_client_message.
+
+Сравнивает таблицу обработчиков действий (MessageProcessor.actions)
+с прежней цепочкой elif на смеси PRESENCE/MESSAGE/GET_CONTACTS.
+Обработчики заменены пустыми функциями, поэтому измеряется только
+выбор обработчика и проверка сообщения: отдельно сам разбор и вызов
+вместе с декоратором LoginRequired.
+Отладочный журнал сервера на время замера отключается, чтобы
+запись в файл не заслоняла стоимость разбора.
+
+Запуск из каталога проекта: python -m benchmarks.bench_dispatch
+"""
+
+import os
+import sys
+import timeit
+import logging
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.decorators import LoginRequired
+from server.core import MessageProcessor, logger
+from server.database import ServerStorage
+from common.settings import *
+
+REPEAT = 20000
+# Число повторов замера, берётся лучший результат.
+ROUNDS = 5
+
+
+class FakeClient:
+    """ Заглушка соединения: реестру нужен только хешируемый объект. """
+
+    def getpeername(self) -> tuple:
+        return '127.0.0.1', 0
+
+
+def noop(processor: MessageProcessor, message: dict, client: FakeClient) -> None:
+    pass
+
+
+class BenchProcessor(MessageProcessor):
+    """ Обработчик с пустыми обработчиками действий. """
+
+    @LoginRequired()
+    def legacy_process_client_message(self, message: dict, client: FakeClient) -> None:
+        """ Прежняя цепочка проверок с пустыми ветками. """
+        logger.debug(f'Разбор сообщения от клиента : {message}')
+        if ACTION in message \
+                and message[ACTION] == PRESENCE \
+                and TIME in message \
+                and USER in message:
+            pass
+        elif ACTION in message \
+                and message[ACTION] == MESSAGE \
+                and DESTINATION in message \
+                and TIME in message \
+                and SENDER in message \
+                and MESSAGE_TEXT in message \
+                and self.names[message[SENDER]] == client:
+            pass
+        elif ACTION in message \
+                and message[ACTION] == EXIT \
+                and ACCOUNT_NAME in message \
+                and self.names[message[ACCOUNT_NAME]] == client:
+            pass
+        elif ACTION in message \
+                and message[ACTION] == GET_CONTACTS \
+                and USER in message \
+                and self.names[message[USER]] == client:
+            pass
+        else:
+            pass
+
+
+for bench_action in list(MessageProcessor.actions.values()):
+    BenchProcessor.register_action(bench_action.name, noop,
+                                   tuple(bench_action.required), bench_action.owner)
+
+
+def main():
+    logging.getLogger('server').setLevel(logging.INFO)
+    database = ServerStorage(os.path.join(tempfile.mkdtemp(), 'bench.db3'))
+    processor = BenchProcessor('127.0.0.1', 7777, database)
+    client = FakeClient()
+    processor.names['user0'] = client
+    processor.names['user1'] = FakeClient()
+    traffic = {
+        PRESENCE: {ACTION: PRESENCE, TIME: 1, USER: {ACCOUNT_NAME: 'user2', PUBLIC_KEY: ''}},
+        MESSAGE: {ACTION: MESSAGE, SENDER: 'user0', DESTINATION: 'user1', TIME: 1,
+                  MESSAGE_TEXT: 'Привет'},
+        GET_CONTACTS: {ACTION: GET_CONTACTS, TIME: 1, USER: 'user0'},
+    }
+    mix = [traffic[MESSAGE]] * 8 + [traffic[GET_CONTACTS], traffic[PRESENCE]]
+
+    table_dispatch = BenchProcessor.process_client_message.__wrapped__
+    legacy_dispatch = BenchProcessor.legacy_process_client_message.__wrapped__
+
+    print(f'{"":>14} {"разбор, мкс":>23} {"с LoginRequired, мкс":>23}')
+    print(f'{"сообщение":>14} {"таблица":>11} {"elif":>11} {"таблица":>11} {"elif":>11}')
+    for name, message in list(traffic.items()) + [('смесь 8:1:1', None)]:
+        messages = mix if message is None else [message]
+        number = REPEAT // len(messages)
+
+        def measure(dispatch) -> float:
+            def run():
+                for item in messages:
+                    dispatch(processor, item, client)
+            best = min(timeit.repeat(run, number=number, repeat=ROUNDS))
+            return best / (number * len(messages)) * 1e6
+
+        results = (measure(table_dispatch), measure(legacy_dispatch),
+                   measure(BenchProcessor.process_client_message),
+                   measure(BenchProcessor.legacy_process_client_message))
+        print(f'{name:>14}' + ''.join(f' {result:>11.3f}' for result in results))
+
+
+if __name__ == '__main__':
+    main()
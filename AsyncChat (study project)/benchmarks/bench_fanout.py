@@ -0,0 +1,73 @@
+"""Бенчмарк рассылки сообщения группе.
+
+Сравнивает MessageProcessor.fan_out, который кодирует сообщение один раз
+и ставит те же байты в буферы всех участников, с отправкой каждому
+участнику через send_to (кодирование JSON на каждого получателя).
+Исходящие буферы заменены bytearray без сокетов, поэтому измеряются
+кодирование и копирование в буфер. Половина участников передаёт
+сообщения кадрами, половина - в прежнем режиме.
+
+Запуск из каталога проекта: python -m benchmarks.bench_fanout [участников]
+"""
+
+import os
+import sys
+import base64
+import timeit
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.core import MessageProcessor
+from common.settings import *
+
+ROUNDS = 5
+
+
+class FakeClient:
+    """ Заглушка соединения с признаком передачи кадрами. """
+
+    def __init__(self, framed: bool):
+        self.framed = framed
+
+
+class BenchProcessor(MessageProcessor):
+    """ Обработчик с исходящими буферами в памяти. """
+
+    def is_framed(self, client: FakeClient) -> bool:
+        return client.framed
+
+    def enqueue(self, client: FakeClient, data: bytes) -> None:
+        self.outbound[client] += data
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    logging.getLogger('server').setLevel(logging.INFO)
+    processor = BenchProcessor('127.0.0.1', 7777, None)
+    recipients = [f'user{number}' for number in range(members)]
+    for number, username in enumerate(recipients):
+        client = FakeClient(number % 2 == 0)
+        processor.names[username] = client
+        processor.outbound[client] = bytearray()
+    # Текст размером с зашифрованное сообщение клиента (RSA 2048 в base64).
+    message = {ACTION: GROUP_MESSAGE, SENDER: 'user0', GROUP: 'room', TIME: 1,
+               MESSAGE_TEXT: base64.b64encode(os.urandom(256)).decode('ascii')}
+
+    def per_recipient():
+        for username in recipients:
+            processor.send_to(processor.names[username], message)
+
+    def fan_out():
+        processor.fan_out(message, recipients)
+
+    print(f'{"участников":>10} {"send_to, мс":>12} {"fan_out, мс":>12} {"ускорение":>10}')
+    results = []
+    for run in (per_recipient, fan_out):
+        results.append(min(timeit.repeat(run, number=10, repeat=ROUNDS)) / 10 * 1e3)
+        for buffer in processor.outbound.values():
+            buffer.clear()
+    print(f'{members:>10} {results[0]:>12.3f} {results[1]:>12.3f} {results[0] / results[1]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
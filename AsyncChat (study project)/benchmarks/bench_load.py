@@ -0,0 +1,107 @@
+"""Нагрузочный бенчмарк сервера для сравнения версий.
+
+Прогоняет сценарии SCENARIOS нагрузочным клиентом benchmarks.load_generator
+против локального сервера с временной базой и выводит таблицу:
+пропускная способность, задержка доставки p50/p99, процессор и память сервера.
+
+С ключом --save результаты записываются в JSON, с ключом --compare
+сравниваются с сохранёнными ранее: снижение пропускной способности
+или рост задержки доставки p99 больше чем на --tolerance считается
+регрессией (рост задержки меньше LATENCY_FLOOR не учитывается),
+и программа завершается с кодом 1. С кодом 1 программа завершается
+и если в каком-либо сценарии доставлено меньше сообщений, чем отправлено.
+
+Запуск из каталога проекта: python -m benchmarks.bench_load --save baseline.json
+"""
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.load_generator import prepare_users, run_load
+
+# Сценарии: название и параметры run_load.
+SCENARIOS = (
+    ('select, 200 польз.', dict(engine='select', users=200, rate=400)),
+    ('asyncio, 200 польз.', dict(engine='asyncio', users=200, rate=400)),
+    ('asyncio, 2000 польз.', dict(engine='asyncio', users=2000, rate=1000, contacts=5, sync_interval=30)),
+    ('2 обработчика, 2000 польз.', dict(engine='asyncio', workers=2, users=2000, rate=1000)),
+)
+# Длительность отправки в каждом сценарии, сек.
+DURATION = 10
+# Допустимое ухудшение относительно сохранённых результатов.
+TOLERANCE = 0.2
+# Рост задержки меньше этой величины, сек., не считается регрессией:
+# задержки в единицы миллисекунд зависят от планировщика ОС.
+LATENCY_FLOOR = 0.005
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """ Показатели сценария, ухудшившиеся больше допустимого.
+    :param result: Результат run_load.
+    :param baseline: Сохранённый результат того же сценария.
+    :param tolerance: Допустимое относительное ухудшение.
+    :return: Описания регрессий. """
+    found = []
+    if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+        found.append(f'пропускная способность {result["throughput"]:.0f} '
+                     f'вместо {baseline["throughput"]:.0f} сообщений/с')
+    if result['delivery_p99'] is not None and baseline['delivery_p99'] is not None \
+            and result['delivery_p99'] > max(baseline['delivery_p99'] * (1 + tolerance),
+                                             baseline['delivery_p99'] + LATENCY_FLOOR):
+        found.append(f'задержка доставки p99 {result["delivery_p99"] * 1000:.1f} '
+                     f'вместо {baseline["delivery_p99"] * 1000:.1f} мс')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк сервера.')
+    parser.add_argument('--duration', default=DURATION, type=float)
+    parser.add_argument('--save', default=None, help='записать результаты в файл JSON')
+    parser.add_argument('--compare', default=None, help='сравнить с результатами из файла JSON')
+    parser.add_argument('--tolerance', default=TOLERANCE, type=float)
+    parser.add_argument('--scenario', default=None, help='выполнить только сценарии с этой подстрокой')
+    namespace = parser.parse_args()
+
+    scenarios = [(name, params) for name, params in SCENARIOS
+                 if namespace.scenario is None or namespace.scenario in name]
+    baseline = dict()
+    if namespace.compare:
+        with open(namespace.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    # Хэши паролей вычисляются один раз для наибольшего сценария.
+    users = prepare_users(max(params['users'] for _, params in scenarios))
+    results = dict()
+    failed = []
+    print(f'{"сценарий":>28} {"польз.":>7} {"сообщ./с":>9} {"p50, мс":>8} {"p99, мс":>8} '
+          f'{"потеряно":>9} {"CPU, %":>7} {"RSS, МиБ":>9}')
+    for name, params in scenarios:
+        params = dict(params)
+        count = params.pop('users')
+        result = results[name] = run_load(users[:count], duration=namespace.duration, **params)
+        cpu = f'{result["server_cpu"]:.0f}' if result['server_cpu'] is not None else '-'
+        rss = f'{result["server_rss"] / 2 ** 20:.1f}' if result['server_rss'] is not None else '-'
+        p50 = f'{result["delivery_p50"] * 1000:.1f}' if result['delivery_p50'] is not None else '-'
+        p99 = f'{result["delivery_p99"] * 1000:.1f}' if result['delivery_p99'] is not None else '-'
+        print(f'{name:>28} {result["connected"]:>7} {result["throughput"]:>9.0f} {p50:>8} {p99:>8} '
+              f'{result["lost"]:>9} {cpu:>7} {rss:>9}')
+        if result['lost'] > 0:
+            failed.append(f'{name}: не доставлено {result["lost"]} из {result["sent"]} сообщений')
+        if name in baseline:
+            for text in regressions(result, baseline[name], namespace.tolerance):
+                failed.append(f'{name}: {text}')
+
+    if namespace.save:
+        with open(namespace.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    if failed:
+        print('Ошибки прогона:')
+        print('\n'.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
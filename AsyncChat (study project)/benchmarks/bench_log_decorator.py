@@ -0,0 +1,99 @@
+"""Бенчмарк декоратора Log на приёме и отправке сообщений.
+
+Измеряет обмен сообщением через пару сокетов: send_message и
+get_message в режиме кадров, по одному вызову каждой функции,
+с разными вариантами декоратора:
+- без декоратора;
+- прежний декоратор: два вызова inspect.currentframe и строка
+  с аргументами (repr сокетов) на каждый вызов, даже если отладочный
+  журнал выключен и запись отбрасывается;
+- Log с выключенным отладочным журналом - функция без обёртки;
+- Log с отладочным журналом и записью каждого N-го вызова;
+- Log с записью каждого вызова.
+Журнал пишется через очередь (log_pipeline) во временный файл.
+
+Запуск из каталога проекта: python -m benchmarks.bench_log_decorator
+"""
+
+import os
+import sys
+import socket
+import inspect
+import logging
+import tempfile
+import timeit
+
+from functools import wraps
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import utils
+from common.decorators import Log
+from logs.config_server_log import create_server_logger
+from logs.log_pipeline import pipelines
+from common.settings import *
+
+REPEAT = 20000
+# Число повторов замера, берётся лучший результат.
+ROUNDS = 5
+# Выборка для режима трассировки: записывается каждый SAMPLE-й вызов.
+SAMPLE = 100
+
+
+def legacy_log(logger: logging.Logger):
+    """ Прежний декоратор Log. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            parent_func_name = inspect.currentframe().f_back.f_code.co_name
+            module_name = inspect.currentframe().f_back.f_code.co_filename.split("/")[-1]
+            logger.debug(f'Функция {func.__name__} вызвана из функции {parent_func_name} '
+                         f'в модуле {module_name} с аргументами: {args}; {kwargs}')
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def main():
+    create_server_logger()
+    # Фоновый поток пишет во временный файл, а не в журнал сервера.
+    pipelines['server'][1].setStream(open(os.path.join(tempfile.mkdtemp(), 'bench.log'), 'a',
+                                          encoding='utf8'))
+    debug_logger = create_server_logger('bench')
+    debug_logger.setLevel(logging.DEBUG)
+    quiet_logger = logging.getLogger('bench_quiet')
+    quiet_logger.setLevel(logging.INFO)
+
+    send = inspect.unwrap(utils.send_message)
+    receive = inspect.unwrap(utils.get_message)
+    variants = [
+        ('без декоратора', lambda func: func),
+        ('прежний Log', legacy_log(quiet_logger)),
+        ('Log, DEBUG выключен', Log(quiet_logger)),
+        (f'Log, каждый {SAMPLE}-й', Log(debug_logger, SAMPLE)),
+        ('Log, каждый вызов', Log(debug_logger, 1)),
+    ]
+
+    sender, receiver = socket.socketpair()
+    reader = utils.MessageReader()
+    message = {ACTION: MESSAGE, SENDER: 'user0', DESTINATION: 'user1', TIME: 1,
+               MESSAGE_TEXT: 'x' * 344}
+    print(f'{"декоратор":>22} {"мкс/обмен":>10} {"накладные, мкс":>15}')
+    results = []
+    # Первый вариант замеряется дважды: первый замер прогревает
+    # интерпретатор и буферы сокетов и не учитывается.
+    for name, decorate in variants[:1] + variants:
+        send_message, get_message = decorate(send), decorate(receive)
+
+        def run():
+            send_message(sender, message, True)
+            get_message(receiver, reader)
+        best = min(timeit.repeat(run, number=REPEAT, repeat=ROUNDS)) / REPEAT * 1e6
+        results.append(best)
+        if len(results) > 1:
+            print(f'{name:>22} {best:>10.2f} {best - results[1]:>15.2f}')
+    sender.close()
+    receiver.close()
+
+
+if __name__ == '__main__':
+    main()
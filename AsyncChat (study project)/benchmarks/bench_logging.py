@@ -0,0 +1,100 @@
+"""Бенчмарк журнала на пути сообщения в MessageProcessor.
+
+Измеряет стоимость обработки MESSAGE пользователю в сети
+(process_client_message, выбор обработчика, ответ 200) при разных
+настройках журнала сервера:
+- журнал отключён (logging.disable) - базовое время без журнала;
+- уровень INFO: отладочные записи отбрасываются, аргументы не форматируются;
+- уровень DEBUG с очередью и фоновым потоком записи (log_pipeline);
+- уровень DEBUG с записью в файл в потоке сети одним обработчиком;
+- прежняя настройка: запись в потоке сети, обработчик добавлял каждый
+  из шести модулей сервера, и каждая запись выполнялась шесть раз.
+Сокеты и база заменены заглушками, журнал пишется во временный файл.
+
+Запуск из каталога проекта: python -m benchmarks.bench_logging
+"""
+
+import os
+import sys
+import timeit
+import logging
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.core import MessageProcessor
+from logs.config_server_log import create_server_logger
+from logs.log_pipeline import TEXT_FORMAT, pipelines, configure_logging
+from common.settings import *
+
+REPEAT = 20000
+# Число повторов замера, берётся лучший результат.
+ROUNDS = 5
+
+
+class FakeClient:
+    """ Заглушка соединения: реестру нужен только хешируемый объект. """
+
+    def getpeername(self) -> tuple:
+        return '127.0.0.1', 0
+
+
+class FakeDatabase:
+    """ Заглушка базы: статистика сообщений не ведётся. """
+
+    def process_message(self, sender: str, recipient: str) -> None:
+        pass
+
+
+class BenchProcessor(MessageProcessor):
+    """ Обработчик, отбрасывающий исходящие сообщения. """
+
+    def send_to(self, client: FakeClient, message: dict) -> None:
+        pass
+
+
+def main():
+    server_logger = create_server_logger()
+    log_file = open(os.path.join(tempfile.mkdtemp(), 'bench.log'), 'a', encoding='utf8')
+    # Фоновый поток пишет во временный файл, а не в журнал сервера.
+    pipelines['server'][1].setStream(log_file)
+
+    processor = BenchProcessor('127.0.0.1', 7777, FakeDatabase())
+    client = FakeClient()
+    processor.names['user0'] = client
+    processor.names['user1'] = FakeClient()
+    message = {ACTION: MESSAGE, SENDER: 'user0', DESTINATION: 'user1', TIME: 1,
+               MESSAGE_TEXT: 'x' * 344}
+
+    def measure() -> float:
+        def run():
+            processor.process_client_message(dict(message), client)
+        best = min(timeit.repeat(run, number=REPEAT, repeat=ROUNDS))
+        return best / REPEAT * 1e6
+
+    results = []
+    logging.disable(logging.CRITICAL)
+    # Первый замер прогревает кэши интерпретатора и не учитывается.
+    measure()
+    results.append(('журнал отключён', measure()))
+    logging.disable(logging.NOTSET)
+    configure_logging('INFO')
+    results.append(('INFO', measure()))
+    configure_logging('DEBUG')
+    results.append(('DEBUG, очередь', measure()))
+    queue_handlers = server_logger.handlers[:]
+    sync_handler = logging.StreamHandler(log_file)
+    sync_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    server_logger.handlers[:] = [sync_handler]
+    results.append(('DEBUG, запись в потоке', measure()))
+    server_logger.handlers[:] = [sync_handler] * 6
+    results.append(('DEBUG, прежняя настройка', measure()))
+    server_logger.handlers[:] = queue_handlers
+
+    baseline = results[0][1]
+    print(f'{"журнал":>24} {"мкс/сообщение":>14} {"накладные, мкс":>15}')
+    for name, result in results:
+        print(f'{name:>24} {result:>14.2f} {result - baseline:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Бенчмарк метрик сервера.
+
+Измеряет стоимость обновления метрик в потоке сервера:
+- увеличение счётчика со значениями по потокам (server.metrics.Counter)
+  и, для сравнения, счётчика под общей блокировкой threading.Lock;
+- наблюдение гистограммы;
+- обёртку timed над методом ServerStorage;
+- обработку MESSAGE пользователю в сети (process_client_message)
+  без метрик и со счётчиком действий и замером вызова базы.
+Сокеты и база заменены заглушками.
+
+Запуск из каталога проекта: python -m benchmarks.bench_metrics
+"""
+
+import os
+import sys
+import timeit
+import logging
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import server.core
+from server.core import MessageProcessor
+from server.metrics import MetricsRegistry, Counter, Histogram, timed, MESSAGES, DB_CALL_SECONDS
+from common.settings import *
+
+REPEAT = 100000
+# Число повторов замера, берётся лучший результат.
+ROUNDS = 5
+
+
+class LockedCounter:
+    """ Счётчик под общей блокировкой - вариант, от которого отказались. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict()
+
+    def inc(self, labels: tuple = (), amount: int = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class NullCounter:
+    """ Счётчик, который ничего не считает: обработка без метрик. """
+
+    def inc(self, labels: tuple = (), amount: int = 1) -> None:
+        pass
+
+
+class FakeClient:
+    """ Заглушка соединения: реестру нужен только хешируемый объект. """
+
+    def getpeername(self) -> tuple:
+        return '127.0.0.1', 0
+
+
+class FakeDatabase:
+    """ Заглушка базы: статистика сообщений не ведётся. """
+
+    def process_message(self, sender: str, recipient: str) -> None:
+        pass
+
+
+class TimedDatabase(FakeDatabase):
+    """ Заглушка базы с замером вызова, как у ServerStorage. """
+    process_message = timed(DB_CALL_SECONDS)(FakeDatabase.process_message)
+
+
+class BenchProcessor(MessageProcessor):
+    """ Обработчик, отбрасывающий исходящие сообщения. """
+
+    def send_to(self, client: FakeClient, message: dict) -> None:
+        pass
+
+
+def measure(function, repeat: int = REPEAT) -> float:
+    """ Лучшее время одного вызова function, мкс. """
+    return min(timeit.repeat(function, number=repeat, repeat=ROUNDS)) / repeat * 1e6
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    registry = MetricsRegistry()
+    counter = Counter('bench_total', 'Бенчмарк.', ('action',), registry=registry)
+    locked = LockedCounter()
+    histogram = Histogram('bench_seconds', 'Бенчмарк.', ('method',), registry=registry)
+    labels = (MESSAGE,)
+
+    def empty():
+        pass
+
+    timed_empty = timed(histogram)(empty)
+
+    print(f'{"операция":>32} {"мкс":>8}')
+    # Первый замер прогревает кэши интерпретатора и не учитывается.
+    measure(lambda: counter.inc(labels))
+    for name, function in (('Counter.inc, по потокам', lambda: counter.inc(labels)),
+                           ('счётчик под Lock', lambda: locked.inc(labels)),
+                           ('Histogram.observe', lambda: histogram.observe(0.0001, labels)),
+                           ('вызов функции', empty),
+                           ('вызов функции с timed', timed_empty)):
+        print(f'{name:>32} {measure(function):>8.3f}')
+
+    client = FakeClient()
+    message = {ACTION: MESSAGE, SENDER: 'user0', DESTINATION: 'user1', TIME: 1,
+               MESSAGE_TEXT: 'x' * 344}
+    results = []
+    for name, database, messages in (('MESSAGE без метрик', FakeDatabase(), NullCounter()),
+                                     ('MESSAGE с метриками', TimedDatabase(), MESSAGES)):
+        processor = BenchProcessor('127.0.0.1', 7777, database)
+        processor.names['user0'] = client
+        processor.names['user1'] = FakeClient()
+        server.core.MESSAGES = messages
+        result = measure(lambda: processor.process_client_message(dict(message), client), REPEAT // 5)
+        results.append(result)
+        print(f'{name:>32} {result:>8.3f}')
+    server.core.MESSAGES = MESSAGES
+    print(f'{"накладные на сообщение":>32} {results[1] - results[0]:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Бенчмарк реестра сессий сервера.
+
+Измеряет стоимость проверки авторизации (LoginRequired) и поиска
+пользователя по сокету при отключении в зависимости от числа
+подключённых пользователей. Для сравнения приводится прежний
+линейный поиск по словарю имя -> сокет.
+
+Запуск из каталога проекта: python -m benchmarks.bench_sessions
+"""
+
+import os
+import sys
+import timeit
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.decorators import LoginRequired
+from server.core import MessageProcessor
+from server.database import ServerStorage
+from common.settings import ACTION, MESSAGE
+
+USERS_COUNTS = (10, 100, 1000, 10000)
+REPEAT = 2000
+
+
+class FakeClient:
+    """ Заглушка соединения: реестру нужен только хешируемый объект. """
+
+    def getpeername(self) -> tuple:
+        return '127.0.0.1', 0
+
+
+class BenchProcessor(MessageProcessor):
+    """ Обработчик с пустым защищённым методом: измеряется только декоратор. """
+
+    @LoginRequired()
+    def protected(self, message: dict, client: FakeClient) -> None:
+        pass
+
+
+def linear_name_of(names: dict, client: FakeClient) -> str | None:
+    """ Прежний способ: перебор всех пользователей. """
+    for name in names:
+        if names[name] == client:
+            return name
+    return None
+
+
+def main():
+    database = ServerStorage(os.path.join(tempfile.mkdtemp(), 'bench.db3'))
+    message = {ACTION: MESSAGE}
+    print(f'{"users":>8} {"LoginRequired, мкс":>20} {"name_of, мкс":>14} {"линейный поиск, мкс":>21}')
+    for users in USERS_COUNTS:
+        processor = BenchProcessor('127.0.0.1', 7777, database)
+        clients = [FakeClient() for _ in range(users)]
+        plain_names = dict()
+        for number, client in enumerate(clients):
+            processor.names[f'user{number}'] = client
+            plain_names[f'user{number}'] = client
+        # Худший случай для линейного поиска - последний подключившийся.
+        client = clients[-1]
+        check = timeit.timeit(lambda: processor.protected(message, client), number=REPEAT)
+        lookup = timeit.timeit(lambda: processor.names.name_of(client), number=REPEAT)
+        linear = timeit.timeit(lambda: linear_name_of(plain_names, client), number=REPEAT)
+        print(f'{users:>8} {check / REPEAT * 1e6:>20.2f} {lookup / REPEAT * 1e6:>14.2f} '
+              f'{linear / REPEAT * 1e6:>21.2f}')
+
+
+if __name__ == '__main__':
+    main()
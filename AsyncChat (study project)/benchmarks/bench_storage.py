@@ -0,0 +1,104 @@
+"""Бенчмарк базы данных сервера.
+
+Заполняет User_contacts и Login_history заданным числом строк
+(по умолчанию по 1 000 000) и измеряет запросы контактов и истории
+входов пользователя через ServerStorage с индексами схемы версии 1
+и без них (как в базах прежних версий). Отдельно сравнивается скорость
+коротких транзакций записи с журналом по умолчанию и с WAL.
+
+Запуск из каталога проекта: python -m benchmarks.bench_storage [строк]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server.database import ServerStorage
+
+USERS = 10000
+QUERIES = 200
+WRITES = 2000
+
+
+def fill(path: str, rows: int) -> None:
+    """ Заполняет базу пользователями, контактами и историей входов. """
+    connection = sqlite3.connect(path)
+    now = datetime.now().isoformat(' ')
+    connection.executemany('INSERT INTO All_users (id, name, last_login, password_hash) VALUES (?, ?, ?, ?)',
+                           ((number, f'user{number}', now, b'hash') for number in range(1, USERS + 1)))
+    per_user = rows // USERS
+    connection.executemany('INSERT INTO User_contacts (user_id, contact) VALUES (?, ?)',
+                           ((user, (user + shift) % USERS + 1)
+                            for user in range(1, USERS + 1) for shift in range(per_user)))
+    connection.executemany('INSERT INTO Login_history (user_id, ip_address, port, date_time) '
+                           'VALUES (?, ?, ?, ?)',
+                           ((number % USERS + 1, '127.0.0.1', 7777, now) for number in range(rows)))
+    connection.commit()
+    connection.close()
+
+
+def measure(database: ServerStorage) -> tuple[float, float]:
+    """ Среднее время запроса контактов и истории входов, мс. """
+    start = time.perf_counter()
+    for number in range(QUERIES):
+        username = f'user{number * 37 % USERS + 1}'
+        # Запрос мимо кэша справочника.
+        database.forget_user(username)
+        database.get_contacts(username)
+    contacts = (time.perf_counter() - start) / QUERIES * 1e3
+    start = time.perf_counter()
+    for number in range(QUERIES):
+        database.get_login_history(f'user{number * 37 % USERS + 1}')
+    history = (time.perf_counter() - start) / QUERIES * 1e3
+    return contacts, history
+
+
+def write_rate(path: str, journal_mode: str, synchronous: str) -> float:
+    """ Количество транзакций записи в секунду, одна строка на транзакцию. """
+    connection = sqlite3.connect(path)
+    connection.execute(f'PRAGMA journal_mode = {journal_mode}')
+    connection.execute(f'PRAGMA synchronous = {synchronous}')
+    connection.execute('CREATE TABLE IF NOT EXISTS log (id INTEGER PRIMARY KEY, value TEXT)')
+    start = time.perf_counter()
+    for number in range(WRITES):
+        connection.execute('INSERT INTO log (value) VALUES (?)', (str(number),))
+        connection.commit()
+    rate = WRITES / (time.perf_counter() - start)
+    connection.close()
+    return rate
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db3')
+    database = ServerStorage(path)
+    print(f'Заполнение: {rows} контактов и {rows} входов...')
+    fill(path, rows)
+
+    indexed = measure(database)
+    connection = sqlite3.connect(path)
+    names = [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")]
+    for name in names:
+        connection.execute(f'DROP INDEX {name}')
+    connection.close()
+    plain = measure(database)
+    database.close()
+
+    print(f'{"запрос, мс":>18} {"с индексами":>12} {"без индексов":>13}')
+    print(f'{"get_contacts":>18} {indexed[0]:>12.3f} {plain[0]:>13.3f}')
+    print(f'{"get_login_history":>18} {indexed[1]:>12.3f} {plain[1]:>13.3f}')
+
+    print(f'{"запись, транз./с":>18} {"WAL, NORMAL":>12} {"DELETE, FULL":>13}')
+    wal = write_rate(os.path.join(directory, 'wal.db3'), 'WAL', 'NORMAL')
+    legacy = write_rate(os.path.join(directory, 'delete.db3'), 'DELETE', 'FULL')
+    print(f'{"":>18} {wal:>12.0f} {legacy:>13.0f}')
+
+
+if __name__ == '__main__':
+    main()
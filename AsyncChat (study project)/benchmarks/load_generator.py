@@ -0,0 +1,607 @@
+"""Нагрузочный клиент сервера без GUI.
+
+Имитирует тысячи пользователей в цикле asyncio: каждый проходит
+авторизацию (presence и ответ на запрос 511), синхронизирует списки
+пользователей и контактов по версиям и обменивается сообщениями
+со случайными пользователями с заданной суммарной частотой.
+Протокол тот же, что у ClientTransport: сообщения авторизации
+формируют функции client.transport, ответы сопоставляются запросам
+по REQUEST_ID, сообщение 205 запускает обновление списков.
+
+Отчёт: пропускная способность, задержки доставки и ответа сервера
+(p50/p99), задержка авторизации, процессорное время и память сервера.
+
+По умолчанию запускает локальный сервер с временной базой и регистрирует
+в ней пользователей load1..loadN с паролем 123456. С ключом --connect
+нагружает уже запущенный сервер: пользователей нужно заранее записать
+в его базу ключом --prepare, пока сервер остановлен. Загрузку сервера
+в этом случае можно получить, указав его процессы в --server_pid.
+
+Задержка доставки считается по времени отправки, записанному в текст
+сообщения, поэтому процессы нагрузки должны работать на одной машине.
+Если доставлено меньше сообщений, чем отправлено, программа завершается
+с кодом 1.
+
+Запуск из каталога проекта: python -m benchmarks.load_generator --users 1000 --rate 500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.settings import *
+from common.exceptions import ServerError, IncorrectDataRecivedError
+from common.utils import encode_message, decode_message, MessageReader
+from client.transport import ClientTransport, password_hash, presence_message, auth_answer
+from logs.log_pipeline import configure_logging
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Имена пользователей нагрузки: префикс и номер, пароль общий.
+USER_PREFIX = 'load'
+PASSWORD = '123456'
+# Публичный ключ-заглушка: нагрузка не шифрует сообщения и не создаёт ключи RSA.
+PUBKEY = 'load-test'
+# Сколько пользователей одного процесса подключаются одновременно.
+CONNECT_CONCURRENCY = 100
+# Попытки подключения и пауза между ними, сек.
+CONNECT_ATTEMPTS = 50
+CONNECT_RETRY_DELAY = 0.2
+# Сколько секунд после окончания отправки ждать доставки сообщений.
+DRAIN_TIME = 2
+# Сколько секунд ждать готовности сервера и процессов нагрузки.
+START_TIMEOUT = 600
+
+
+class LoadStats:
+    """ Результаты одного процесса нагрузки. Задержки в секундах. """
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.auth = []
+        self.sent = 0
+        self.delivered = []
+        self.acked = []
+        self.errors = 0
+        self.syncs = 0
+
+    def merge(self, other: 'LoadStats') -> None:
+        """ Добавляет результаты другого процесса. """
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+class LoadClient:
+    """ Пользователь нагрузки: протокол ClientTransport на потоках asyncio.
+    Один цикл событий обслуживает тысячи таких клиентов, тогда как
+    ClientTransport занимает поток и окно GUI на каждого пользователя. """
+
+    def __init__(self, username: str, passwd_hash: bytes, stats: LoadStats):
+        """
+        :param username: Уникальный логин пользователя.
+        :param passwd_hash: Хэш пароля из password_hash.
+        :param stats: Результаты процесса нагрузки.
+        """
+        self.username = username
+        self.passwd_hash = passwd_hash
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.frames = MessageReader()
+        # Запросы, ожидающие ответа: номер запроса -> Future.
+        self.pending = dict()
+        self.request_ids = itertools.count(1)
+        # Версии списков, полученных с сервера.
+        self.versions = {USERS_REQUEST: None, GET_CONTACTS: None}
+        self.lists_version = None
+        self.receiver = None
+
+    async def connect(self, address: str, port: int) -> None:
+        """ Устанавливает соединение, повторяя попытки, пока сервер запускается. """
+        for _ in range(CONNECT_ATTEMPTS):
+            try:
+                self.reader, self.writer = await asyncio.open_connection(address, port)
+                return
+            except OSError:
+                await asyncio.sleep(CONNECT_RETRY_DELAY)
+        raise ServerError('Не удалось установить соединение с сервером')
+
+    async def login(self) -> None:
+        """ Авторизация: presence без кадра, ответ на 511 и дальнейший обмен кадрами. """
+        started = time.monotonic()
+        self.writer.write(encode_message(presence_message(self.username, PUBKEY)))
+        data = await asyncio.wait_for(self.reader.read(MAX_PACKAGE_LENGTH), CLIENT_REQUEST_TIMEOUT)
+        challenge = decode_message(data)
+        if challenge.get(RESPONSE) != 511:
+            raise ServerError(challenge.get(ERROR))
+        if challenge.get(FRAMING) != FRAMING_LENGTH:
+            raise ServerError('Сервер не поддерживает передачу кадрами.')
+        self.writer.write(encode_message(auth_answer(self.passwd_hash, challenge), True))
+        answer = await asyncio.wait_for(self.next_message(), CLIENT_REQUEST_TIMEOUT)
+        if answer is None or answer.get(RESPONSE) != 200:
+            raise ServerError(answer.get(ERROR) if answer else 'Соединение закрыто сервером.')
+        self.stats.auth.append(time.monotonic() - started)
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    async def next_message(self) -> dict | None:
+        """ Следующее сообщение сервера или None, если соединение закрыто. """
+        while not self.frames.has_message():
+            data = await self.reader.read(FRAMED_RECV_SIZE)
+            if not data:
+                return None
+            self.frames.feed(data)
+        return self.frames.pop()
+
+    async def receive(self) -> None:
+        """ Задача приёма: передаёт ответы ожидающим запросам,
+        сообщения пользователей учитывает в задержке доставки. """
+        try:
+            while True:
+                message = await self.next_message()
+                if message is None:
+                    break
+                self.dispatch(message)
+        except (OSError, ValueError, IncorrectDataRecivedError):
+            pass
+        pending, self.pending = self.pending, dict()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionResetError('Потеряно соединение с сервером.'))
+
+    def dispatch(self, message: dict) -> None:
+        """ Разбор сообщения сервера. """
+        if ClientTransport.is_response(message):
+            future = self.pending.pop(message.pop(REQUEST_ID, None), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        elif message.get(ACTION) == MESSAGE and message.get(DESTINATION) == self.username:
+            sent = float(message[MESSAGE_TEXT].split(' ', 1)[0])
+            self.stats.delivered.append(time.time() - sent)
+        elif message.get(RESPONSE) == 205:
+            version = message.get(VERSION)
+            if self.lists_version is None or not isinstance(version, int) or version > self.lists_version:
+                asyncio.ensure_future(self.lists_update(random.uniform(0, LISTS_UPDATE_JITTER)))
+
+    def submit(self, message: dict) -> asyncio.Future:
+        """ Отправляет запрос без ожидания ответа.
+        :return: Future с ответом сервера. """
+        message[REQUEST_ID] = request_id = next(self.request_ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(encode_message(message, True))
+        return future
+
+    async def lists_update(self, delay: float = 0) -> None:
+        """ Обновление списков пользователей и контактов: оба запроса
+        отправляются сразу, сервер отвечает изменениями после версий,
+        полученных ранее.
+        :param delay: Задержка перед запросом, сек. """
+        await asyncio.sleep(delay)
+        futures = {
+            USERS_REQUEST: self.submit({ACTION: USERS_REQUEST, TIME: time.time(), ACCOUNT_NAME: self.username,
+                                        VERSION: self.versions[USERS_REQUEST]}),
+            GET_CONTACTS: self.submit({ACTION: GET_CONTACTS, TIME: time.time(), USER: self.username,
+                                       VERSION: self.versions[GET_CONTACTS]}),
+        }
+        for name, future in futures.items():
+            answer = await asyncio.wait_for(future, CLIENT_REQUEST_TIMEOUT)
+            if answer.get(RESPONSE) == 202:
+                self.versions[name] = answer.get(VERSION)
+            else:
+                self.stats.errors += 1
+        if None not in self.versions.values():
+            self.lists_version = min(self.versions.values())
+        self.stats.syncs += 1
+
+    async def add_contacts(self, contacts: list[str]) -> None:
+        """ Добавляет контакты одним пакетом запросов. """
+        futures = [self.submit({ACTION: ADD_CONTACT, TIME: time.time(), USER: self.username,
+                                ACCOUNT_NAME: contact}) for contact in contacts]
+        for future in futures:
+            if (await asyncio.wait_for(future, CLIENT_REQUEST_TIMEOUT)).get(RESPONSE) != 200:
+                self.stats.errors += 1
+
+    def acknowledged(self, sent: float, future: asyncio.Future) -> None:
+        """ Ответ сервера на сообщение пользователю. """
+        if future.cancelled() or future.exception() is not None or future.result().get(RESPONSE) != 200:
+            self.stats.errors += 1
+        else:
+            self.stats.acked.append(time.monotonic() - sent)
+
+    async def chat(self, peers: list[str], rate: float, stop_at: float, size: int) -> None:
+        """ Отправляет сообщения случайным пользователям до момента stop_at.
+        Интервалы распределены экспоненциально (поток Пуассона), отправка
+        идёт по расписанию и не ждёт ответа на предыдущее сообщение:
+        медленный сервер не снижает нагрузку, а увеличивает задержки.
+        :param peers: Логины получателей.
+        :param rate: Сообщений в секунду от этого пользователя.
+        :param stop_at: Момент окончания отправки (time.monotonic).
+        :param size: Размер текста сообщения, символов. """
+        padding = 'x' * size
+        next_at = time.monotonic() + random.expovariate(rate)
+        while next_at < stop_at:
+            await asyncio.sleep(next_at - time.monotonic())
+            destination = random.choice(peers)
+            if destination == self.username:
+                continue
+            future = self.submit({ACTION: MESSAGE, SENDER: self.username, DESTINATION: destination,
+                                  TIME: time.time(), MESSAGE_TEXT: f'{time.time():.6f} {padding}'})
+            future.add_done_callback(partial(self.acknowledged, time.monotonic()))
+            self.stats.sent += 1
+            await self.writer.drain()
+            next_at += random.expovariate(rate)
+
+    async def sync(self, interval: float, stop_at: float) -> None:
+        """ Периодическое обновление списков по версиям до момента stop_at. """
+        next_at = time.monotonic() + random.uniform(0, interval)
+        while next_at < stop_at:
+            await asyncio.sleep(next_at - time.monotonic())
+            await self.lists_update()
+            next_at += interval
+
+    async def close(self) -> None:
+        """ Сообщение о выходе и закрытие соединения. """
+        try:
+            self.writer.write(encode_message({ACTION: EXIT, TIME: time.time(),
+                                              ACCOUNT_NAME: self.username}, True))
+            self.writer.close()
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        if self.receiver is not None:
+            self.receiver.cancel()
+
+
+async def load_users(users: list[tuple], address: str, port: int, peers: list[str], rate: float,
+                     duration: float, size: int, contacts: int, sync_interval: float,
+                     ready: multiprocessing.Queue, go: multiprocessing.Event) -> LoadStats:
+    """ Нагрузка пользователями одного процесса: вход всех пользователей,
+    затем по сигналу go обмен сообщениями в течение duration секунд.
+    :param users: Пары (логин, хэш пароля) пользователей процесса.
+    :param rate: Сообщений в секунду от каждого пользователя.
+    :return: Результаты процесса. """
+    stats = LoadStats()
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def start(client: LoadClient) -> LoadClient | None:
+        async with semaphore:
+            try:
+                await client.connect(address, port)
+                await client.login()
+                await client.lists_update()
+                if contacts:
+                    await client.add_contacts(random.sample(peers, contacts))
+            except (OSError, ValueError, asyncio.TimeoutError, ServerError, IncorrectDataRecivedError):
+                stats.failed += 1
+                if client.writer is not None:
+                    client.writer.close()
+                return None
+        stats.connected += 1
+        return client
+
+    clients = await asyncio.gather(*(start(LoadClient(name, passwd_hash, stats))
+                                     for name, passwd_hash in users))
+    clients = [client for client in clients if client is not None]
+    ready.put(len(clients))
+    await asyncio.get_running_loop().run_in_executor(None, go.wait)
+
+    stop_at = time.monotonic() + duration
+    tasks = [client.chat(peers, rate, stop_at, size) for client in clients]
+    if sync_interval:
+        tasks += [client.sync(sync_interval, stop_at) for client in clients]
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            stats.errors += 1
+    await asyncio.sleep(DRAIN_TIME)
+    await asyncio.gather(*(client.close() for client in clients))
+    return stats
+
+
+def run_clients(users: list[tuple], address: str, port: int, peers: list[str], rate: float,
+                duration: float, size: int, contacts: int, sync_interval: float,
+                ready: multiprocessing.Queue, go: multiprocessing.Event,
+                results: multiprocessing.Queue) -> None:
+    """ Точка входа процесса нагрузки. """
+    configure_logging('WARNING')
+    results.put(asyncio.run(load_users(users, address, port, peers, rate, duration, size,
+                                       contacts, sync_interval, ready, go)))
+
+
+def register_users(database, users: list[tuple]) -> None:
+    """ Регистрирует в базе сервера отсутствующих в ней пользователей.
+    :param database: Объект ServerStorage.
+    :param users: Пары (логин, хэш пароля). """
+    for name, passwd_hash in users:
+        if not database.check_user(name):
+            database.add_user(name, passwd_hash)
+
+
+def run_server(engine: str, workers: int, address: str, port: int, database_path: str,
+               users: list[tuple], log_levels: str, ready: multiprocessing.Queue,
+               stop_event: multiprocessing.Event) -> None:
+    """ Точка входа процесса локального сервера. После регистрации
+    пользователей передаёт в ready номера процессов, обслуживающих
+    клиентов, и работает до установки stop_event. """
+    from server.core import MessageProcessor
+    from server.async_core import AsyncMessageProcessor
+    from server.cluster import start_workers, stop_workers
+    from server.database import ServerStorage
+
+    configure_logging(log_levels)
+    database = ServerStorage(database_path)
+    register_users(database, users)
+    if workers > 1:
+        processes, workers_stop, run_dir = start_workers(workers, address, port, database_path,
+                                                         log_levels=log_levels)
+        ready.put([process.pid for process in processes])
+        stop_event.wait()
+        stop_workers(processes, workers_stop, run_dir)
+    else:
+        server_class = AsyncMessageProcessor if engine == 'asyncio' else MessageProcessor
+        server = server_class(address, port, database)
+        server.daemon = True
+        server.start()
+        ready.put([os.getpid()])
+        stop_event.wait()
+        server.running = False
+        server.join()
+    database.close()
+
+
+def process_usage(pids: list[int]) -> tuple | None:
+    """ Процессорное время и память процессов по данным /proc (Linux).
+    :param pids: Номера процессов.
+    :return: Кортеж из процессорного времени, сек., текущей и пиковой
+             памяти, байт, или None, если данных нет. """
+    if not hasattr(os, 'sysconf'):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = rss = peak = 0
+    try:
+        for pid in pids:
+            with open(f'/proc/{pid}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f'/proc/{pid}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        return None
+    return cpu, rss, peak
+
+
+def percentile(values: list[float], share: float) -> float | None:
+    """ Процентиль выборки методом ближайшего ранга.
+    :param values: Отсортированные значения.
+    :param share: Доля от 0 до 1. """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(share * len(values))) - 1))]
+
+
+def raise_file_limit() -> None:
+    """ Поднимает ограничение открытых файлов до максимума: каждому
+    пользователю нужен сокет в процессе нагрузки и в процессе сервера.
+    Процессы, запущенные после вызова, наследуют ограничение. """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def free_port(address: str) -> int:
+    """ Свободный порт для локального сервера. """
+    with socket.socket() as sock:
+        sock.bind((address, 0))
+        return sock.getsockname()[1]
+
+
+def prepare_users(count: int, processes: int = None) -> list[tuple]:
+    """ Имена и хэши паролей пользователей нагрузки. Хэш вычисляется
+    медленно (PBKDF2), поэтому - в пуле процессов.
+    :param count: Количество пользователей.
+    :param processes: Размер пула, None - по числу процессоров.
+    :return: Список пар (логин, хэш пароля). """
+    names = [f'{USER_PREFIX}{number}' for number in range(1, count + 1)]
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        hashes = pool.starmap(password_hash, [(name, PASSWORD) for name in names])
+    return list(zip(names, hashes))
+
+
+def run_load(users: list[tuple], rate: float = 100, duration: float = 10, size: int = 64,
+             contacts: int = 0, sync_interval: float = 0, processes: int = 1,
+             engine: str = 'asyncio', workers: int = 1, address: str = DEFAULT_IP_ADDRESS,
+             port: int = None, database_path: str = None, log_levels: str = 'WARNING',
+             server_pids: list[int] = None) -> dict:
+    """ Нагрузочный прогон. Если port не задан, запускает локальный сервер.
+    :param users: Пары (логин, хэш пароля) из prepare_users.
+    :param rate: Сообщений в секунду от всех пользователей.
+    :param duration: Длительность отправки сообщений, сек.
+    :param size: Размер текста сообщения, символов.
+    :param contacts: Сколько контактов добавляет каждый пользователь при входе.
+    :param sync_interval: Интервал обновления списков пользователем, сек., 0 - только при входе.
+    :param processes: Количество процессов нагрузки.
+    :param engine: Движок локального сервера.
+    :param workers: Количество процессов-обработчиков локального сервера.
+    :param address: IP-адрес сервера.
+    :param port: Порт запущенного сервера, None - запустить локальный.
+    :param database_path: База локального сервера, None - временная.
+    :param log_levels: Уровни журналов локального сервера.
+    :param server_pids: Процессы запущенного сервера для замера загрузки.
+    :return: Словарь результатов. """
+    raise_file_limit()
+    context = multiprocessing.get_context('spawn')
+    server = None
+    temp_dir = None
+    if port is None:
+        if database_path is None:
+            temp_dir = tempfile.TemporaryDirectory(prefix='load_')
+            database_path = os.path.join(temp_dir.name, 'server.db3')
+        port = free_port(address)
+        server_ready = context.Queue()
+        server_stop = context.Event()
+        server = context.Process(target=run_server, name='load-server',
+                                 args=(engine, workers, address, port, database_path, users,
+                                       log_levels, server_ready, server_stop))
+        server.start()
+        server_pids = server_ready.get(timeout=START_TIMEOUT)
+
+    peers = [name for name, _ in users]
+    ready = context.Queue()
+    results = context.Queue()
+    go = context.Event()
+    generators = []
+    for number in range(processes):
+        part = users[number::processes]
+        generators.append(context.Process(
+            target=run_clients, name=f'load-{number}',
+            args=(part, address, port, peers, rate / len(users), duration, size, contacts,
+                  sync_interval, ready, go, results)))
+    for generator in generators:
+        generator.start()
+    for _ in generators:
+        ready.get(timeout=START_TIMEOUT)
+
+    usage_start = process_usage(server_pids or [])
+    started = time.monotonic()
+    go.set()
+    time.sleep(duration)
+    usage_end = process_usage(server_pids or [])
+    elapsed = time.monotonic() - started
+
+    stats = LoadStats()
+    for _ in generators:
+        stats.merge(results.get(timeout=START_TIMEOUT))
+    for generator in generators:
+        generator.join()
+    if server is not None:
+        server_stop.set()
+        server.join(SHUTDOWN_TIMEOUT * 2)
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+    delivered = sorted(stats.delivered)
+    acked = sorted(stats.acked)
+    auth = sorted(stats.auth)
+    result = {
+        'users': len(users),
+        'connected': stats.connected,
+        'failed': stats.failed,
+        'rate': rate,
+        'duration': duration,
+        'sent': stats.sent,
+        'delivered': len(delivered),
+        'lost': stats.sent - len(delivered),
+        'errors': stats.errors,
+        'syncs': stats.syncs,
+        'throughput': len(delivered) / duration,
+        'delivery_p50': percentile(delivered, 0.5),
+        'delivery_p99': percentile(delivered, 0.99),
+        'delivery_max': delivered[-1] if delivered else None,
+        'response_p50': percentile(acked, 0.5),
+        'response_p99': percentile(acked, 0.99),
+        'auth_p50': percentile(auth, 0.5),
+        'auth_p99': percentile(auth, 0.99),
+        'server_cpu': None,
+        'server_rss': None,
+        'server_peak_rss': None,
+    }
+    if usage_start is not None and usage_end is not None:
+        result['server_cpu'] = (usage_end[0] - usage_start[0]) / elapsed * 100
+        result['server_rss'] = usage_end[1]
+        result['server_peak_rss'] = usage_end[2]
+    return result
+
+
+def format_report(result: dict) -> str:
+    """ Текстовый отчёт о прогоне. """
+    def ms(value):
+        return f'{value * 1000:.1f} мс' if value is not None else 'нет данных'
+
+    def mb(value):
+        return f'{value / 2 ** 20:.1f} МиБ' if value is not None else 'нет данных'
+
+    cpu = f'{result["server_cpu"]:.0f} %' if result['server_cpu'] is not None else 'нет данных'
+    return '\n'.join((
+        f'Пользователи: {result["connected"]} из {result["users"]}, ошибок входа: {result["failed"]}',
+        f'Авторизация: p50 {ms(result["auth_p50"])}, p99 {ms(result["auth_p99"])}',
+        f'Сообщений отправлено: {result["sent"]}, доставлено: {result["delivered"]}, '
+        f'не доставлено: {result["lost"]}, ошибок: {result["errors"]}',
+        f'Пропускная способность: {result["throughput"]:.0f} сообщений/с '
+        f'(задано {result["rate"]:.0f}), обновлений списков: {result["syncs"]}',
+        f'Доставка: p50 {ms(result["delivery_p50"])}, p99 {ms(result["delivery_p99"])}, '
+        f'макс. {ms(result["delivery_max"])}',
+        f'Ответ сервера: p50 {ms(result["response_p50"])}, p99 {ms(result["response_p99"])}',
+        f'Сервер: процессор {cpu}, память {mb(result["server_rss"])}, '
+        f'пик {mb(result["server_peak_rss"])}',
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный клиент сервера без GUI.')
+    parser.add_argument('--users', default=100, type=int)
+    parser.add_argument('--rate', default=100, type=float, help='сообщений в секунду от всех пользователей')
+    parser.add_argument('--duration', default=10, type=float, help='длительность отправки, сек.')
+    parser.add_argument('--size', default=64, type=int, help='размер текста сообщения')
+    parser.add_argument('--contacts', default=0, type=int, help='контактов у пользователя')
+    parser.add_argument('--sync_interval', default=0, type=float,
+                        help='интервал обновления списков, сек., 0 - только при входе')
+    parser.add_argument('--processes', default=1, type=int, help='процессов нагрузки')
+    parser.add_argument('--engine', default='asyncio', choices=SERVER_ENGINES)
+    parser.add_argument('--workers', default=1, type=int)
+    parser.add_argument('--log_level', default='WARNING', help='уровни журналов локального сервера')
+    parser.add_argument('-a', default=DEFAULT_IP_ADDRESS, help='адрес сервера')
+    parser.add_argument('-p', default=DEFAULT_PORT, type=int, help='порт запущенного сервера')
+    parser.add_argument('--connect', action='store_true', help='нагружать запущенный сервер')
+    parser.add_argument('--server_pid', default=[], type=int, nargs='*')
+    parser.add_argument('--database', default=None, help='база локального сервера')
+    parser.add_argument('--prepare', action='store_true',
+                        help='только зарегистрировать пользователей в базе --database')
+    parser.add_argument('--json', default=None, help='файл для результатов в JSON')
+    namespace = parser.parse_args()
+    if namespace.prepare and namespace.database is None:
+        parser.error('Для --prepare нужно указать --database.')
+    if namespace.contacts >= namespace.users:
+        parser.error('Контактов должно быть меньше, чем пользователей.')
+
+    print(f'Подготовка {namespace.users} пользователей...')
+    users = prepare_users(namespace.users)
+    if namespace.prepare:
+        from server.database import ServerStorage
+        database = ServerStorage(namespace.database, clear_active=False)
+        register_users(database, users)
+        database.close()
+        return
+
+    result = run_load(users, namespace.rate, namespace.duration, namespace.size, namespace.contacts,
+                      namespace.sync_interval, namespace.processes, namespace.engine, namespace.workers,
+                      namespace.a, namespace.p if namespace.connect else None, namespace.database,
+                      namespace.log_level, namespace.server_pid)
+    print(format_report(result))
+    if namespace.json:
+        with open(namespace.json, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    if result['lost'] > 0:
+        print(f'Ошибка: не доставлено {result["lost"]} из {result["sent"]} сообщений.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
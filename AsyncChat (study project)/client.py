@@ -12,7 +12,8 @@ from client.start_dialog import UserNameDialog
 from client.main_window import ClientMainWindow
 from PyQt5.QtWidgets import QApplication, QMessageBox
 from logs.config_client_log import create_client_logger
-from common.settings import DEFAULT_PORT, DEFAULT_IP_ADDRESS
+from logs.log_pipeline import configure_logging, parse_levels
+from common.settings import DEFAULT_PORT, DEFAULT_IP_ADDRESS, LOGGING_LEVELS, LOGGING_JSON
 
 
 # Инициализация клиентского логгера.
@@ -28,13 +29,21 @@ def get_arg_commandline() -> tuple:
     """ Функция создаёт парсер аргументов командной строки
     и читает параметры при запуске модуля.
     Выполняет проверку на корректность номера порта.
-    :return: Возвращаем кортеж из IP-адреса, порта, логина и пароля клиента. """
+    :return: Возвращаем кортеж из IP-адреса, порта, логина, пароля клиента,
+             уровней журналов и флага записи журнала в JSON. """
     parser = argparse.ArgumentParser()
     parser.add_argument('addr', default=DEFAULT_IP_ADDRESS, nargs='?')
     parser.add_argument('port', default=DEFAULT_PORT, type=int, nargs='?')
     parser.add_argument('-n', '--name', default=None, nargs='?')
     parser.add_argument('-p', '--password', default='', nargs='?')
+    # Уровни журналов, например INFO,client.transport=DEBUG.
+    parser.add_argument('--log_level', default=LOGGING_LEVELS)
+    parser.add_argument('--log_json', action='store_true', default=LOGGING_JSON)
     namespace = parser.parse_args(sys.argv[1:])
+    try:
+        parse_levels(namespace.log_level)
+    except ValueError as err:
+        parser.error(str(err))
     server_address = namespace.addr
     server_port = namespace.port
     client_name = namespace.name
@@ -43,16 +52,17 @@ def get_arg_commandline() -> tuple:
     # проверка подходящего номера порта.
     if not 1023 < server_port < 65536:
         CLIENT_LOGGER.critical(
-            f'Попытка запуска клиента с неподходящим номером порта: {server_port}. '
-            f'Допустимы адреса с 1024 до 65535. Клиент завершается.')
+            'Попытка запуска клиента с неподходящим номером порта: %s. '
+            'Допустимы адреса с 1024 до 65535. Клиент завершается.', server_port)
         sys.exit(1)
 
-    return server_address, server_port, client_name, client_passwd
+    return server_address, server_port, client_name, client_passwd, namespace.log_level, namespace.log_json
 
 
 def main():
     # Загружаем параметры командной строки и сообщаем о запуске в консоль.
-    server_address, server_port, client_name, client_password = get_arg_commandline()
+    server_address, server_port, client_name, client_password, log_levels, log_json = get_arg_commandline()
+    configure_logging(log_levels, log_json)
     CLIENT_LOGGER.debug('Args loaded')
     # Создаём клиентское приложение.
     client_app = QApplication(sys.argv)
@@ -66,14 +76,14 @@ def main():
         if start_dialog.ok_pressed:
             client_name = start_dialog.client_name.text()
             client_password = start_dialog.client_passwd.text()
-            CLIENT_LOGGER.debug(f'Using USERNAME = {client_name}, PASSWORD = {client_password}.')
+            CLIENT_LOGGER.debug('Using USERNAME = %s, PASSWORD = %s.', client_name, client_password)
         else:
             exit(0)
 
     # Записываем логи
     CLIENT_LOGGER.info(
-        f'Запущен клиент с параметрами: адрес сервера: {server_address} , порт: {server_port},'
-        f' имя пользователя: {client_name}')
+        'Запущен клиент с параметрами: адрес сервера: %s , порт: %s,'
+        ' имя пользователя: %s', server_address, server_port, client_name)
 
     # Загружаем ключи с файла, если же файла нет, то генерируем новую пару.
     dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -90,6 +100,8 @@ def main():
     CLIENT_LOGGER.debug("Keys successfully loaded.")
     # Создаём объект базы данных
     database = ClientDatabase(client_name)
+    # Индексируем для поиска сообщения, сохранённые прежними версиями клиента.
+    database.start_search_backfill()
     # Создаём объект - транспорт и запускаем транспортный поток
     try:
         transport = ClientTransport(client_name, server_address, server_port,
@@ -100,7 +112,6 @@ def main():
         message.critical(start_dialog, 'Ошибка сервера', error.text)
         exit(1)
     transport.daemon = True
-    transport.start()
 
     # Удалим объект диалога за ненадобностью
     del start_dialog
@@ -108,6 +119,9 @@ def main():
     # Создаём GUI
     main_window = ClientMainWindow(database, transport, keys)
     main_window.make_connection(transport)
+    # Транспорт запускаем после подключения сигналов, чтобы не потерять
+    # сообщения, полученные, пока клиент был не в сети.
+    transport.start()
     main_window.setWindowTitle(f'Чат Программа alpha release - {client_name}')
     client_app.exec_()
 
@@ -7,7 +7,7 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
 from logs.config_client_log import create_client_logger
 
-logger = create_client_logger()
+logger = create_client_logger('add_contact')
 
 
 class AddContactDialog(QDialog):
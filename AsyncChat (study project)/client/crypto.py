@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import base64
+import hashlib
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.PublicKey.RSA import RsaKey
+sys.path.append('../')
+from common.settings import SESSION_KEY_LIFETIME, SESSION_KEY_MAX_MESSAGES
+from client.database import ClientDatabase
+
+# Формат пакета сообщения (до упаковки в base64):
+# версия (1 байт) | номер ключа (8 байт) | [длина (2 байта) | ключ, зашифрованный RSA]
+# | nonce (12 байт) | tag (16 байт) | текст, зашифрованный AES-GCM.
+# Зашифрованный ключ передаётся только в первом сообщении сессии.
+PACKET_SESSION = 2
+PACKET_SESSION_KEY = 3
+KEY_ID_LENGTH = 8
+NONCE_LENGTH = 12
+TAG_LENGTH = 16
+
+
+class OutboundSession:
+    """ Сессионный ключ для отправки сообщений одному собеседнику. """
+    __slots__ = ('key_id', 'key', 'peer_key', 'created', 'announced', 'wrapped_key', 'messages')
+
+    def __init__(self, key_id: bytes, key: bytes, peer_key: str, created: float, announced: bool):
+        """
+        :param key_id: Номер ключа.
+        :param key: Ключ AES-256.
+        :param peer_key: Отпечаток открытого ключа собеседника.
+        :param created: Время создания ключа (time.time()).
+        :param announced: Собеседник уже получил ключ.
+        """
+        self.key_id = key_id
+        self.key = key
+        self.peer_key = peer_key
+        self.created = created
+        self.announced = announced
+        # Ключ, зашифрованный открытым ключом собеседника, пока он не передан.
+        self.wrapped_key = None
+        # Сообщений, зашифрованных ключом с момента запуска клиента.
+        self.messages = 0
+
+
+class MessageCipher:
+    """ Гибридное шифрование сообщений: RSA-OAEP используется один раз
+    на сессию для передачи собеседнику ключа AES-256, сами сообщения
+    шифруются AES-GCM. Ключи хранятся в базе клиента для каждого
+    собеседника и меняются по времени, количеству сообщений или при
+    смене открытого ключа собеседника. Сообщения прежнего формата
+    (весь текст зашифрован RSA-OAEP) по-прежнему расшифровываются. """
+
+    def __init__(self, username: str, keys: RsaKey, database: ClientDatabase):
+        """
+        :param username: Уникальный логин пользователя.
+        :param keys: Ключ RSA пользователя.
+        :param database: Объект базы данных клиента.
+        """
+        self.username = username
+        self.database = database
+        self.decrypter = PKCS1_OAEP.new(keys)
+        # Кэш ключей: собеседник -> OutboundSession, (собеседник, номер) -> ключ.
+        self.outbound = dict()
+        self.inbound = dict()
+
+    def outbound_session(self, contact: str, peer_key: str) -> OutboundSession:
+        """ Метод возвращает действующий ключ для собеседника,
+        при необходимости создаёт новый.
+        :param contact: Имя собеседника.
+        :param peer_key: Открытый ключ собеседника в формате PEM.
+        :return: Сессионный ключ. """
+        fingerprint = hashlib.sha256(peer_key.encode('ascii')).hexdigest()
+        session = self.outbound.get(contact)
+        if session is None:
+            row = self.database.get_session_key(contact)
+            if row is not None:
+                session = self.outbound[contact] = OutboundSession(*row)
+        if session is None or session.peer_key != fingerprint \
+                or time.time() - session.created > SESSION_KEY_LIFETIME \
+                or session.messages >= SESSION_KEY_MAX_MESSAGES:
+            session = OutboundSession(os.urandom(KEY_ID_LENGTH), os.urandom(32),
+                                      fingerprint, time.time(), False)
+            self.database.save_session_key(contact, session.key_id, session.key,
+                                           session.peer_key, session.created)
+            self.outbound[contact] = session
+        if not session.announced and session.wrapped_key is None:
+            session.wrapped_key = PKCS1_OAEP.new(RSA.import_key(peer_key)).encrypt(session.key)
+        return session
+
+    def encrypt(self, contact: str, peer_key: str, text: str) -> str:
+        """ Метод шифрования сообщения собеседнику.
+        :param contact: Имя собеседника.
+        :param peer_key: Открытый ключ собеседника в формате PEM.
+        :param text: Текст сообщения.
+        :return: Зашифрованный пакет в base64. """
+        session = self.outbound_session(contact, peer_key)
+        session.messages += 1
+        nonce = os.urandom(NONCE_LENGTH)
+        cipher = AES.new(session.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(f'{self.username}>{contact}'.encode('utf8'))
+        ciphertext, tag = cipher.encrypt_and_digest(text.encode('utf8'))
+        if session.announced:
+            header = bytes([PACKET_SESSION]) + session.key_id
+        else:
+            header = bytes([PACKET_SESSION_KEY]) + session.key_id \
+                     + len(session.wrapped_key).to_bytes(2, 'big') + session.wrapped_key
+        return base64.b64encode(header + nonce + tag + ciphertext).decode('ascii')
+
+    def confirm(self, contact: str) -> None:
+        """ Метод отмечает, что сообщение с ключом сессии доставлено на сервер,
+        и дальше ключ в сообщениях не передаётся.
+        :param contact: Имя собеседника. """
+        session = self.outbound.get(contact)
+        if session is not None and not session.announced:
+            session.announced = True
+            session.wrapped_key = None
+            self.database.confirm_session_key(contact, session.key_id)
+
+    def decrypt(self, sender: str, text: str) -> str:
+        """ Метод расшифровки сообщения собеседника.
+        :param sender: Имя отправителя.
+        :param text: Зашифрованный пакет в base64.
+        :return: Текст сообщения.
+        :raise ValueError: Если сообщение не удалось расшифровать. """
+        packet = base64.b64decode(text)
+        try:
+            return self.decrypt_session(sender, packet)
+        except (ValueError, KeyError, IndexError):
+            # Сообщение прежнего формата: весь текст зашифрован RSA-OAEP.
+            return self.decrypter.decrypt(packet).decode('utf8')
+
+    def decrypt_session(self, sender: str, packet: bytes) -> str:
+        """ Метод расшифровки пакета, зашифрованного сессионным ключом. """
+        version = packet[0]
+        key_id = packet[1:1 + KEY_ID_LENGTH]
+        position = 1 + KEY_ID_LENGTH
+        if version == PACKET_SESSION_KEY:
+            length = int.from_bytes(packet[position:position + 2], 'big')
+            position += 2
+            wrapped_key = packet[position:position + length]
+            position += length
+            key = self.inbound.get((sender, key_id))
+            if key is None:
+                key = self.decrypter.decrypt(wrapped_key)
+                self.database.save_inbound_key(sender, key_id, key)
+                self.inbound[(sender, key_id)] = key
+        elif version == PACKET_SESSION:
+            key = self.inbound.get((sender, key_id))
+            if key is None:
+                key = self.database.get_inbound_key(sender, key_id)
+                if key is None:
+                    raise KeyError(key_id)
+                self.inbound[(sender, key_id)] = key
+        else:
+            raise ValueError('Неизвестный формат сообщения.')
+        nonce = packet[position:position + NONCE_LENGTH]
+        tag = packet[position + NONCE_LENGTH:position + NONCE_LENGTH + TAG_LENGTH]
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(f'{sender}>{self.username}'.encode('utf8'))
+        return cipher.decrypt_and_verify(packet[position + NONCE_LENGTH + TAG_LENGTH:], tag).decode('utf8')
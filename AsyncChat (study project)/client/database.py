@@ -1,10 +1,21 @@
 import os
+import re
 import sys
+import time
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from sqlalchemy.orm import sessionmaker, registry
-from sqlalchemy import create_engine, Table, Column, \
-    Integer, String, Text, DateTime
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy import create_engine, Table, Column, Index, \
+    Integer, String, Text, DateTime, LargeBinary, Boolean, or_, text
 sys.path.append('..')
+from common.settings import SEARCH_RESULTS_LIMIT, SEARCH_BACKFILL_BATCH, SEARCH_BACKFILL_PAUSE
+
+# Метки начала и конца совпадения во фрагменте результата поиска.
+SEARCH_MATCH_START = '\x02'
+SEARCH_MATCH_END = '\x03'
 
 
 class ClientDatabase:
@@ -57,6 +68,37 @@ class ClientDatabase:
             self.id = None  # primary_key
             self.username = contact
 
+    class SessionKeys:
+        """ Класс - отображение для таблицы сессионных ключей шифрования. """
+
+        def __init__(self, contact: str, direction: str, key_id: bytes, key: bytes,
+                     peer_key: str = None, created: datetime = None):
+            """ Конструктор класса SessionKeys.
+            :param contact: Имя собеседника.
+            :param direction: 'out' - ключ для отправки, 'in' - для приёма.
+            :param key_id: Номер ключа.
+            :param key: Ключ AES.
+            :param peer_key: Отпечаток открытого ключа собеседника (для 'out').
+            :param created: Время создания ключа. """
+            self.id = None  # primary_key
+            self.contact = contact
+            self.direction = direction
+            self.key_id = key_id
+            self.key = key
+            self.peer_key = peer_key
+            self.created = created or datetime.now()
+            self.announced = False
+
+    class ListVersion:
+        """ Класс - отображение для таблицы версий списков, полученных с сервера. """
+
+        def __init__(self, name: str, version: int):
+            """ Конструктор класса ListVersion.
+            :param name: Название списка: 'users' или 'contacts'.
+            :param version: Версия списка на сервере. """
+            self.name = name  # primary_key
+            self.version = version
+
     def __init__(self, client_name: str):
         """ Конструктор класса ClientDatabase.
         Создаёт движок базы данных, все таблицы,
@@ -81,7 +123,8 @@ class ClientDatabase:
                         Column('contact', String),
                         Column('direction', String),
                         Column('message', Text),
-                        Column('date', DateTime)
+                        Column('date', DateTime),
+                        Index('ix_message_history_contact_date', 'contact', 'date', 'id')
                         )
 
         # Создаём таблицу контактов
@@ -90,6 +133,24 @@ class ClientDatabase:
                          Column('username', String, unique=True)
                          )
 
+        # Создаём таблицу сессионных ключей шифрования
+        session_keys_table = Table('Session_keys', self.mapper_registry.metadata,
+                             Column('id', Integer, primary_key=True),
+                             Column('contact', String, index=True),
+                             Column('direction', String),
+                             Column('key_id', LargeBinary),
+                             Column('key', LargeBinary),
+                             Column('peer_key', String),
+                             Column('created', DateTime),
+                             Column('announced', Boolean)
+                             )
+
+        # Создаём таблицу версий списков пользователей и контактов
+        list_versions_table = Table('List_versions', self.mapper_registry.metadata,
+                              Column('name', String, primary_key=True),
+                              Column('version', Integer)
+                              )
+
         # Поскольку клиент мультипоточный, то необходимо отключить проверки
         # на подключения с разных потоков, иначе sqlite3.ProgrammingError
         path = os.path.dirname(os.path.realpath(__file__))
@@ -98,60 +159,160 @@ class ClientDatabase:
                                              echo=False,
                                              pool_recycle=7200,
                                              connect_args={'check_same_thread': False})
-        # Создаём таблицы
+        # Создаём таблицы. create_all не добавляет индексы в таблицы,
+        # созданные прежними версиями клиента, создаём их отдельно.
         self.mapper_registry.metadata.create_all(self.database_engine)
+        for index in history_table.indexes:
+            index.create(self.database_engine, checkfirst=True)
+        # Полнотекстовый индекс истории, если SQLite собран с FTS5.
+        self.search_available = self.create_search_index()
 
         # Создаём отображения
         self.mapper_registry.map_imperatively(self.KnownUsers, users_table)
         self.mapper_registry.map_imperatively(self.MessageHistory, history_table)
         self.mapper_registry.map_imperatively(self.Contacts, contacts_table)
+        self.mapper_registry.map_imperatively(self.SessionKeys, session_keys_table)
+        self.mapper_registry.map_imperatively(self.ListVersion, list_versions_table)
 
         # Создаём сессию
         Session = sessionmaker(bind=self.database_engine)
         self.session = Session()
+        # Глубина вложенности batch: пока она больше нуля, изменения
+        # не фиксируются.
+        self.batch_depth = 0
 
-        # Необходимо очистить таблицу контактов, т.к. при запуске они подгружаются с сервера.
-        self.session.query(self.Contacts).delete()
-        self.session.commit()
+    def commit(self) -> None:
+        """ Метод фиксирует изменения, если они сделаны не внутри batch.
+        Внутри batch изменения фиксируются одной транзакцией при выходе. """
+        if not self.batch_depth:
+            self.session.commit()
+
+    def begin_batch(self) -> None:
+        """ Метод начинает группу записей, фиксируемых одной транзакцией.
+        Каждому вызову должен соответствовать вызов end_batch. """
+        self.batch_depth += 1
+
+    def end_batch(self) -> None:
+        """ Метод завершает группу записей, внешняя группа
+        фиксирует изменения всех вложенных. """
+        self.batch_depth -= 1
+        self.commit()
+
+    @contextmanager
+    def batch(self):
+        """ Контекстный менеджер группы записей: методы записи внутри
+        блока не фиксируют изменения по одному, а фиксация одной
+        транзакцией при выходе - одна синхронизация файла базы на диск
+        вместо одной на каждую запись. При исключении изменения
+        всей группы отменяются. """
+        self.begin_batch()
+        try:
+            yield self
+        except BaseException:
+            self.batch_depth -= 1
+            self.session.rollback()
+            raise
+        self.end_batch()
 
     def add_contact(self, contact: str) -> None:
         """ Метод добавления контактов в таблицу Contacts.
         :param contact: Имя контакта, которого нужно добавить. """
-        # Проверяем, нет ли дубля.
-        if not self.session.query(self.Contacts).filter_by(username=contact).count():
-            contact_row = self.Contacts(contact)
-            self.session.add(contact_row)
-            self.session.commit()
+        self.add_contacts([contact])
+
+    def add_contacts(self, contacts: list[str]) -> None:
+        """ Метод добавляет контакты одним запросом, уже
+        имеющиеся контакты пропускаются.
+        :param contacts: Имена контактов, которых нужно добавить. """
+        if contacts:
+            self.session.execute(insert(self.Contacts).on_conflict_do_nothing(),
+                                 [{'username': contact} for contact in contacts])
+            self.commit()
 
     def del_contact(self, contact: str):
         """ Метод удаления контакта из таблицы Contacts.
         :param contact: Имя контакта, которого нужно удалить. """
         self.session.query(self.Contacts).filter_by(username=contact).delete()
-        self.session.commit()
+        self.commit()
 
-    def add_users(self, users_list: list[str]) -> None:
+    def add_users(self, users_list: list[str], version: int = None) -> None:
         """ Метод добавления известных пользователей в таблицу Known_users.
         Пользователи получаются только с сервера, поэтому таблица очищается.
-        :param users_list: Список имён всех известных пользователей. """
+        :param users_list: Список имён всех известных пользователей.
+        :param version: Версия списка на сервере. """
         self.session.query(self.KnownUsers).delete()
-        for user in users_list:
-            user_row = self.KnownUsers(user)
-            self.session.add(user_row)
-        self.session.commit()
+        self.session.add_all([self.KnownUsers(user) for user in users_list])
+        self.set_list_version('users', version)
+        self.commit()
+
+    def update_users(self, added: list[str], removed: list[str], version: int) -> None:
+        """ Метод применяет к таблице Known_users изменения списка
+        пользователей, полученные с сервера.
+        :param added: Добавленные пользователи.
+        :param removed: Удалённые пользователи.
+        :param version: Версия списка на сервере после изменений. """
+        self.session.query(self.KnownUsers).filter(self.KnownUsers.username.in_(removed + added)). \
+            delete(synchronize_session=False)
+        self.session.add_all([self.KnownUsers(user) for user in added])
+        self.set_list_version('users', version)
+        self.commit()
+
+    def set_contacts(self, contacts: list[str], version: int) -> None:
+        """ Метод заменяет контакт-лист полученным с сервера.
+        :param contacts: Имена всех контактов.
+        :param version: Версия контакт-листа на сервере. """
+        self.session.query(self.Contacts).delete()
+        self.session.add_all([self.Contacts(contact) for contact in set(contacts)])
+        self.set_list_version('contacts', version)
+        self.commit()
+
+    def update_contacts(self, added: list[str], removed: list[str], version: int) -> None:
+        """ Метод применяет к таблице Contacts изменения контакт-листа.
+        :param added: Добавленные контакты.
+        :param removed: Удалённые контакты.
+        :param version: Версия контакт-листа на сервере после изменений. """
+        self.session.query(self.Contacts).filter(self.Contacts.username.in_(removed + added)). \
+            delete(synchronize_session=False)
+        self.session.add_all([self.Contacts(contact) for contact in added])
+        self.set_list_version('contacts', version)
+        self.commit()
+
+    def get_list_version(self, name: str) -> int | None:
+        """ Метод возвращает версию списка, полученного с сервера.
+        :param name: Название списка: 'users' или 'contacts'.
+        :return: Версия или None, если список ещё не получен с версией. """
+        return self.session.query(self.ListVersion.version).filter_by(name=name).scalar()
+
+    def set_list_version(self, name: str, version: int | None) -> None:
+        """ Метод сохраняет версию списка, изменения записываются
+        вызывающим методом вместе со списком.
+        :param name: Название списка: 'users' или 'contacts'.
+        :param version: Версия списка, None - версия неизвестна. """
+        self.session.merge(self.ListVersion(name, version))
 
     def contacts_clear(self):
         """ Метод очищает таблицу со списком контактов. """
         self.session.query(self.Contacts).delete()
-        self.session.commit()
+        self.commit()
 
     def save_message(self, contact: str, direction: str, message: str) -> None:
         """ Метод сохранения сообщений в таблицу Message_history.
+        Поисковый индекс обновляет триггер в той же транзакции.
         :param contact: Имя пользователя - от кого сообщение.
         :param direction: Отправленное или полученное.
         :param message: Текст сообщения. """
-        message_row = self.MessageHistory(contact, direction, message)
-        self.session.add(message_row)
-        self.session.commit()
+        self.save_messages([(contact, direction, message)])
+
+    def save_messages(self, messages: list[tuple]) -> None:
+        """ Метод сохраняет сообщения в таблицу Message_history
+        одним запросом, без создания объектов ORM.
+        :param messages: Список кортежей (собеседник, направление, текст). """
+        if messages:
+            now = datetime.now()
+            self.session.execute(insert(self.MessageHistory),
+                                 [{'contact': contact, 'direction': direction,
+                                   'message': message, 'date': now}
+                                  for contact, direction, message in messages])
+            self.commit()
 
     def get_contacts(self) -> list[str]:
         """ Метод возвращает все контакты.
@@ -185,17 +346,195 @@ class ClientDatabase:
         else:
             return False
 
-    def get_history(self, contact: str) -> list[tuple]:
-        """ Метод возвращает историю переписки.
+    def get_session_key(self, contact: str) -> tuple | None:
+        """ Метод возвращает последний ключ для отправки сообщений собеседнику.
+        :param contact: Имя собеседника.
+        :return: Кортеж (номер ключа, ключ, отпечаток открытого ключа собеседника,
+                 время создания в секундах, ключ передан собеседнику) или None. """
+        row = self.session.query(self.SessionKeys). \
+            filter_by(contact=contact, direction='out'). \
+            order_by(self.SessionKeys.id.desc()).first()
+        if row is None:
+            return None
+        return row.key_id, row.key, row.peer_key, row.created.timestamp(), bool(row.announced)
+
+    def save_session_key(self, contact: str, key_id: bytes, key: bytes,
+                         peer_key: str, created: float) -> None:
+        """ Метод сохраняет новый ключ для отправки сообщений собеседнику,
+        прежние ключи отправки этому собеседнику удаляются.
+        :param contact: Имя собеседника.
+        :param key_id: Номер ключа.
+        :param key: Ключ AES.
+        :param peer_key: Отпечаток открытого ключа собеседника.
+        :param created: Время создания в секундах. """
+        self.session.query(self.SessionKeys).filter_by(contact=contact, direction='out').delete()
+        self.session.add(self.SessionKeys(contact, 'out', key_id, key, peer_key,
+                                          datetime.fromtimestamp(created)))
+        self.commit()
+
+    def confirm_session_key(self, contact: str, key_id: bytes) -> None:
+        """ Метод отмечает, что ключ передан собеседнику.
+        :param contact: Имя собеседника.
+        :param key_id: Номер ключа. """
+        self.session.query(self.SessionKeys). \
+            filter_by(contact=contact, direction='out', key_id=key_id). \
+            update({self.SessionKeys.announced: True})
+        self.commit()
+
+    def save_inbound_key(self, contact: str, key_id: bytes, key: bytes) -> None:
+        """ Метод сохраняет ключ, полученный от собеседника.
+        :param contact: Имя собеседника.
+        :param key_id: Номер ключа.
+        :param key: Ключ AES. """
+        self.session.add(self.SessionKeys(contact, 'in', key_id, key))
+        self.commit()
+
+    def get_inbound_key(self, contact: str, key_id: bytes) -> bytes | None:
+        """ Метод возвращает ключ, полученный от собеседника.
+        :param contact: Имя собеседника.
+        :param key_id: Номер ключа.
+        :return: Ключ AES или None. """
+        return self.session.query(self.SessionKeys.key). \
+            filter_by(contact=contact, direction='in', key_id=key_id).scalar()
+
+    def create_search_index(self) -> bool:
+        """ Метод создаёт полнотекстовый индекс Message_search (FTS5) над
+        Message_history и триггер, добавляющий в него новые сообщения.
+        Сообщения, сохранённые до создания индекса, индексирует
+        backfill_search, её прогресс хранится в таблице Search_backfill.
+        :return: False, если SQLite собран без FTS5 и поиск недоступен. """
+        try:
+            with self.database_engine.begin() as connection:
+                if connection.execute(text("SELECT name FROM sqlite_master "
+                                           "WHERE name = 'Message_search'")).first():
+                    return True
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE Message_search USING fts5(message, "
+                    "content='Message_history', content_rowid='id', "
+                    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+                connection.execute(text(
+                    "CREATE TRIGGER message_history_search AFTER INSERT ON Message_history BEGIN "
+                    "INSERT INTO Message_search(rowid, message) VALUES (new.id, new.message); END"))
+                connection.execute(text(
+                    "CREATE TABLE Search_backfill (done INTEGER, upto INTEGER)"))
+                connection.execute(text(
+                    "INSERT INTO Search_backfill SELECT 0, coalesce(max(id), 0) FROM Message_history"))
+        except OperationalError:
+            return False
+        return True
+
+    def backfill_search(self, batch: int = SEARCH_BACKFILL_BATCH) -> bool:
+        """ Метод добавляет в поисковый индекс очередную порцию сообщений,
+        сохранённых до его создания. Порция и прогресс записываются
+        в одной транзакции, поэтому прерванная индексация продолжается
+        с того же места.
+        :param batch: Сколько сообщений проиндексировать.
+        :return: True, если остались непроиндексированные сообщения. """
+        if not self.search_available:
+            return False
+        with self.database_engine.begin() as connection:
+            done, upto = connection.execute(text("SELECT done, upto FROM Search_backfill")).one()
+            if done >= upto:
+                return False
+            last = min(done + batch, upto)
+            connection.execute(text(
+                "INSERT INTO Message_search(rowid, message) SELECT id, message "
+                "FROM Message_history WHERE id > :done AND id <= :last"), {'done': done, 'last': last})
+            connection.execute(text("UPDATE Search_backfill SET done = :last"), {'last': last})
+            return last < upto
+
+    def search_backfill_progress(self) -> tuple[int, int]:
+        """ Метод возвращает прогресс индексации старых сообщений.
+        :return: Кортеж (проиндексировано до номера, всего до номера). """
+        if not self.search_available:
+            return 0, 0
+        with self.database_engine.connect() as connection:
+            return tuple(connection.execute(text("SELECT done, upto FROM Search_backfill")).one())
+
+    def start_search_backfill(self) -> threading.Thread:
+        """ Метод запускает индексацию старых сообщений в фоновом потоке.
+        Поток пишет через своё соединение порциями с паузами, чтобы
+        не задерживать запись новых сообщений.
+        :return: Запущенный поток. """
+        def run():
+            while self.backfill_search():
+                time.sleep(SEARCH_BACKFILL_PAUSE)
+
+        thread = threading.Thread(target=run, name='search-backfill', daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def search_query(query: str) -> str | None:
+        """ Метод преобразует строку поиска в запрос FTS5: все слова
+        обязательны и ищутся как начала слов. Каждое слово берётся
+        в кавычки, поэтому синтаксис FTS5 во вводе не действует.
+        :param query: Строка, введённая пользователем.
+        :return: Запрос FTS5 или None, если в строке нет слов. """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def search_messages(self, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> list[tuple]:
+        """ Метод полнотекстового поиска по истории всех собеседников.
+        :param query: Строка, введённая пользователем.
+        :param limit: Максимальное количество результатов.
+        :return: Список кортежей из имён собеседников, направления, фрагмента
+                 текста с совпадениями между SEARCH_MATCH_START и SEARCH_MATCH_END,
+                 дат и номеров сообщений, самые новые - первыми.
+                 Сортировка по релевантности (rank) вычисляла бы её для всех
+                 совпадений: на частых словах это секунда на миллион сообщений,
+                 а по номеру FTS5 останавливается, найдя limit совпадений. """
+        match = self.search_query(query)
+        if match is None or not self.search_available:
+            return []
+        statement = text(
+            "SELECT Message_history.contact, Message_history.direction, "
+            "snippet(Message_search, 0, :start, :end, '…', 16) AS snippet, "
+            "Message_history.date, Message_history.id "
+            "FROM Message_search JOIN Message_history ON Message_history.id = Message_search.rowid "
+            "WHERE Message_search MATCH :match ORDER BY Message_search.rowid DESC LIMIT :limit"
+        ).columns(contact=String, direction=String, snippet=Text, date=DateTime, id=Integer)
+        with self.database_engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                statement, {'start': SEARCH_MATCH_START, 'end': SEARCH_MATCH_END,
+                            'match': match, 'limit': limit})]
+
+    def get_history(self, contact: str, limit: int = None,
+                    before: tuple = None, after: tuple = None) -> list[tuple]:
+        """ Метод возвращает историю переписки, отсортированную по дате.
+        Страницы выбираются по индексу (contact, date, id) относительно ключа
+        (дата, номер) уже загруженного сообщения, без OFFSET.
         :param contact: Имя контакта с кем нужно получить историю переписки.
-        :return: Список кортежей из имён отправителей, получателей,
-                 текста сообщений и дат отправки.
+        :param limit: Сколько сообщений вернуть, None - все: последние
+                      сообщения, а при указании after - первые после него.
+        :param before: Ключ самого старого загруженного сообщения:
+                       возвращаются сообщения до него.
+        :param after: Ключ самого нового загруженного сообщения:
+                      возвращаются сообщения после него.
+        :return: Список кортежей из имён собеседников, направления,
+                 текста сообщений, дат отправки и номеров сообщений.
         """
-        query = self.session.query(self.MessageHistory).filter_by(contact=contact)
-        history_message = [(history_row.contact, history_row.direction,
-                            history_row.message, history_row.date)
-                           for history_row in query.all()]
-        return history_message
+        history = self.MessageHistory
+        query = self.session.query(history.contact, history.direction,
+                                   history.message, history.date, history.id). \
+            filter(history.contact == contact)
+        # Условие по дате вынесено отдельно от OR: только так SQLite
+        # ограничивает по нему диапазон индекса, а не просматривает всю переписку.
+        if before is not None:
+            query = query.filter(history.date <= before[0],
+                                 or_(history.date < before[0], history.id < before[1]))
+        if after is not None:
+            query = query.filter(history.date >= after[0],
+                                 or_(history.date > after[0], history.id > after[1]))
+        if limit is None:
+            return [tuple(row) for row in query.order_by(history.date, history.id)]
+        if after is not None:
+            return [tuple(row) for row in query.order_by(history.date, history.id).limit(limit)]
+        # Последние limit сообщений выбираем с конца и разворачиваем.
+        rows = query.order_by(history.date.desc(), history.id.desc()).limit(limit).all()
+        return [tuple(row) for row in reversed(rows)]
 
 
 # отладка
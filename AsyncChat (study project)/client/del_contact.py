@@ -5,7 +5,7 @@ from PyQt5.QtWidgets import QDialog, QLabel, QComboBox, QPushButton, QApplicatio
 sys.path.append('../')
 from logs.config_client_log import create_client_logger
 from client.database import ClientDatabase
-logger = create_client_logger()
+logger = create_client_logger('del_contact')
 
 
 class DelContactDialog(QDialog):
@@ -0,0 +1,169 @@
+import sys
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QBrush, QColor, QFont
+from PyQt5.QtWidgets import QStyledItemDelegate
+sys.path.append('../')
+from client.database import ClientDatabase
+from common.settings import HISTORY_PAGE_SIZE, HISTORY_WINDOW_SIZE
+
+
+class HistoryModel(QAbstractListModel):
+    """ Модель окна истории переписки с одним собеседником.
+    Держит в памяти около window_size сообщений - окно над историей
+    в базе клиента. Страницы подгружаются по ключу (дата, номер)
+    с начала или конца окна, сообщения с другого края при этом
+    выгружаются, поэтому память не зависит от длины переписки.
+    Текст сообщений форматируется один раз при загрузке,
+    кисти и шрифт общие для всех строк, размер строки
+    запоминает HistoryDelegate. """
+
+    def __init__(self, database: ClientDatabase,
+                 page_size: int = HISTORY_PAGE_SIZE,
+                 window_size: int = HISTORY_WINDOW_SIZE,
+                 parent=None):
+        """
+        :param database: Объект базы данных клиента.
+        :param page_size: Сколько сообщений загружается за раз.
+        :param window_size: Сколько сообщений хранится в памяти.
+        :param parent: Родительский объект Qt.
+        """
+        super().__init__(parent)
+        self.database = database
+        self.page_size = page_size
+        self.window_size = max(window_size, page_size)
+        self.contact = None
+        # Строки окна: [текст, входящее, ключ (дата, номер), (ширина, размер)].
+        self.rows = []
+        # Более старых сообщений нет / окно доходит до последнего сообщения.
+        self.at_start = True
+        self.at_end = True
+        # Оформление входящих и исходящих сообщений.
+        self.in_background = QBrush(QColor(39, 43, 58))
+        self.out_background = QBrush(QColor(59, 133, 206))
+        self.foreground = QBrush(QColor(255, 255, 255))
+        self.font = QFont("Times", 8, QFont.Bold)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, incoming = self.rows[index.row()][:2]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.BackgroundRole:
+            return self.in_background if incoming else self.out_background
+        if role == Qt.ForegroundRole:
+            return self.foreground
+        if role == Qt.FontRole:
+            return self.font
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignLeft if incoming else Qt.AlignRight
+        return None
+
+    @staticmethod
+    def make_row(item: tuple) -> list:
+        """ Метод форматирует сообщение из ClientDatabase.get_history.
+        :return: Строка окна [текст, входящее, ключ, размер]. """
+        return [f'{item[3].replace(microsecond=0).strftime("%H:%M | %B %d")}\n\n{item[2]}\n',
+                item[1] == 'in', (item[3], item[4]), None]
+
+    def set_contact(self, contact: str | None, around: tuple = None) -> None:
+        """ Метод открывает переписку с собеседником:
+        загружает последнюю страницу сообщений или страницы вокруг
+        указанного сообщения.
+        :param contact: Имя собеседника, None - очистить окно.
+        :param around: Ключ (дата, номер) сообщения, которое нужно показать. """
+        self.beginResetModel()
+        self.contact = contact
+        self.rows = []
+        self.at_start = self.at_end = True
+        if contact is not None and around is None:
+            page = self.database.get_history(contact, self.page_size)
+            self.rows = [self.make_row(item) for item in page]
+            self.at_start = len(page) < self.page_size
+        elif contact is not None:
+            # Страница до сообщения включительно и страница после него.
+            older = self.database.get_history(contact, self.page_size, before=(around[0], around[1] + 1))
+            newer = self.database.get_history(contact, self.page_size, after=around)
+            self.rows = [self.make_row(item) for item in older + newer]
+            self.at_start = len(older) < self.page_size
+            self.at_end = len(newer) < self.page_size
+        self.endResetModel()
+
+    def row_of(self, key: tuple) -> int | None:
+        """ Метод возвращает номер строки сообщения в окне.
+        :param key: Ключ (дата, номер) сообщения.
+        :return: Номер строки или None, если сообщения нет в окне. """
+        for row, item in enumerate(self.rows):
+            if item[2] == key:
+                return row
+        return None
+
+    def fetch_older(self) -> int:
+        """ Метод загружает страницу сообщений перед первым в окне,
+        лишние сообщения в конце окна выгружаются.
+        :return: Количество добавленных в начало строк. """
+        if self.at_start or not self.rows:
+            return 0
+        page = self.database.get_history(self.contact, self.page_size, before=self.rows[0][2])
+        self.at_start = len(page) < self.page_size
+        if not page:
+            return 0
+        self.beginInsertRows(QModelIndex(), 0, len(page) - 1)
+        self.rows[0:0] = [self.make_row(item) for item in page]
+        self.endInsertRows()
+        excess = len(self.rows) - self.window_size
+        if excess > 0:
+            self.beginRemoveRows(QModelIndex(), len(self.rows) - excess, len(self.rows) - 1)
+            del self.rows[-excess:]
+            self.endRemoveRows()
+            self.at_end = False
+        return len(page)
+
+    def fetch_newer(self) -> int:
+        """ Метод загружает сообщения после последнего в окне: страницу
+        при прокрутке к концу или новые сообщения, если окно доходит до
+        последнего сообщения. Лишние сообщения в начале окна выгружаются.
+        :return: Количество строк, выгруженных из начала окна. """
+        if self.contact is None:
+            return 0
+        if not self.rows:
+            self.set_contact(self.contact)
+            return 0
+        limit = None if self.at_end else self.page_size
+        page = self.database.get_history(self.contact, limit, after=self.rows[-1][2])
+        if limit is not None:
+            self.at_end = len(page) < limit
+        if not page:
+            return 0
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(self.make_row(item) for item in page)
+        self.endInsertRows()
+        # Новые сообщения добавляются по одному: начало окна выгружается
+        # сразу страницей, чтобы представление не пересчитывало положение
+        # всех строк при каждом сообщении.
+        excess = len(self.rows) - self.window_size
+        if excess <= 0 or (self.at_end and limit is None and excess < self.page_size):
+            return 0
+        self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+        del self.rows[:excess]
+        self.endRemoveRows()
+        self.at_start = False
+        return excess
+
+
+class HistoryDelegate(QStyledItemDelegate):
+    """ Делегат окна истории, запоминающий размер строки HistoryModel.
+    QListView пересчитывает положение всех строк при каждом изменении
+    модели, а размер строки с переносом текста вычисляется долго. """
+
+    def sizeHint(self, option, index):
+        row = index.model().rows[index.row()]
+        width = option.rect.width()
+        if row[3] is None or row[3][0] != width:
+            row[3] = width, super().sizeHint(option, index)
+        return row[3][1]
@@ -1,24 +1,26 @@
 import sys
 import json
-import base64
+import random
 from Crypto.PublicKey.RSA import RsaKey
-from Crypto.Cipher import PKCS1_OAEP
-from Crypto.PublicKey import RSA
-from PyQt5.QtWidgets import QMainWindow, qApp, QMessageBox, QApplication, QListView, QLabel
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QBrush, QColor, QFont
-from PyQt5.QtCore import pyqtSlot, QEvent, Qt
+from PyQt5.QtWidgets import QMainWindow, qApp, QMessageBox, QApplication, QListView, QLabel, \
+    QAbstractItemView, QAction
+from PyQt5.QtGui import QStandardItemModel, QStandardItem, QKeySequence
+from PyQt5.QtCore import pyqtSlot, QEvent, Qt, QTimer
 sys.path.append('../')
 from client.main_window_conv import Ui_MainClientWindow
 from client.add_contact import AddContactDialog
 from client.del_contact import DelContactDialog
+from client.search_dialog import SearchDialog
 from client.database import ClientDatabase
+from client.crypto import MessageCipher
+from client.history_model import HistoryModel, HistoryDelegate
 from client.transport import ClientTransport
 from client.start_dialog import UserNameDialog
 from common.exceptions import ServerError
 from logs.config_client_log import create_client_logger
 from common.settings import *
 
-logger = create_client_logger()
+logger = create_client_logger('main_window')
 
 class ClientMainWindow(QMainWindow):
     """ GUI - класс основного окна пользователя.
@@ -34,22 +36,28 @@ class ClientMainWindow(QMainWindow):
         super().__init__()
         self.database = database
         self.transport = transport
-        # объект - дешифорвщик сообщений с предзагруженным ключём
-        self.decrypter = PKCS1_OAEP.new(keys)
+        # объект шифрования и дешифровки сообщений с сессионными ключами
+        self.cipher = MessageCipher(transport.username, keys, database)
 
         # Дополнительные требующиеся атрибуты.
         self.contacts_model = None
-        self.history_model = None
+        # Модель окна истории: страницы переписки с текущим собеседником.
+        self.history_model = HistoryModel(database)
         self.messages = QMessageBox()
         self.current_chat = None  # Текущий контакт с которым идёт обмен сообщениями.
         self.current_chat_key = None
-        self.encryptor = None
+        # Обновление списков по сообщению 205 уже запланировано.
+        self.lists_update_scheduled = False
+        # Записи в базу до конца итерации цикла событий объединены в одну транзакцию.
+        self.writes_coalesced = False
 
         # Загружаем конфигурацию окна из Qt Designer.
         self.ui = Ui_MainClientWindow()
         self.ui.setupUi(self)
         self.ui.list_messages.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.ui.list_messages.setWordWrap(True)
+        self.ui.list_messages.setModel(self.history_model)
+        self.ui.list_messages.setItemDelegate(HistoryDelegate(self.ui.list_messages))
 
         # Подключение обработчиков сигналов.
         self.connects()
@@ -63,6 +71,11 @@ class ClientMainWindow(QMainWindow):
         сигналов для кнопок на главном окне. """
         # Кнопка "Выход"
         self.ui.menu_exit.triggered.connect(qApp.exit)
+        # Поиск по сообщениям
+        self.ui.menu_search = QAction('Поиск по сообщениям', self)
+        self.ui.menu_search.setShortcut(QKeySequence.Find)
+        self.ui.menu.insertAction(self.ui.menu_exit, self.ui.menu_search)
+        self.ui.menu_search.triggered.connect(self.search_window)
         # Кнопка отправить сообщение
         self.ui.btn_send.clicked.connect(self.send_message)
         # "добавить контакт"
@@ -73,6 +86,8 @@ class ClientMainWindow(QMainWindow):
         self.ui.menu_del_contact.triggered.connect(self.delete_contact_window)
         # click по списку контактов отправляется в обработчик
         self.ui.list_contacts.clicked.connect(self.select_active_user)
+        # Прокрутка истории к началу подгружает более старые сообщения
+        self.ui.list_messages.verticalScrollBar().valueChanged.connect(self.history_scrolled)
 
     def set_disabled_input(self) -> None:
         """ Метод деактивирует поля ввода. """
@@ -80,58 +95,56 @@ class ClientMainWindow(QMainWindow):
         self.ui.label_new_message.setText('Для выбора получателя '
                                           ' кликните по нему в окне контактов.')
         self.ui.text_message.clear()
-        if self.history_model:
-            self.history_model.clear()
+        self.history_model.set_contact(None)
 
         # Поле ввода и кнопка отправки неактивны до выбора получателя.
         self.ui.btn_clear.setDisabled(True)
         self.ui.btn_send.setDisabled(True)
         self.ui.text_message.setDisabled(True)
 
-        self.encryptor = None
         self.current_chat = None
         self.current_chat_key = None
 
-    def history_list_update(self) -> None:
+    def history_list_update(self, around: tuple = None) -> None:
         """ Метод заполняет соответствующий QListView
-        историей переписки с текущим собеседником """
-        # Получаем историю, отсортированную по дате.
-        list_messages = sorted(self.database.get_history(self.current_chat),
-                               key=lambda item: item[3])
-        # Если модель не создана, создадим.
-        if not self.history_model:
-            self.history_model = QStandardItemModel()
-            self.ui.list_messages.setModel(self.history_model)
-        # Очистим от старых записей
-        self.history_model.clear()
-        # Берём не более 20 последних записей.
-        length = len(list_messages)
-        start_index = 0
-        if length > 20:
-            start_index = length - 20
-        # Заполнение модели записями, так же стоит разделить входящие и исходящие
-        # сообщения выравниванием и разным фоном.
-        # Записи в обратном порядке, поэтому выбираем их с конца и не более 20
-        for i in range(start_index, length):
-            item = list_messages[i]
-            if item[1] == 'in':
-                mess = QStandardItem(f'{item[3].replace(microsecond=0).strftime("%H:%M | %B %d")}\n\n{item[2]}\n')
-                mess.setEditable(False)
-                mess.setBackground(QBrush(QColor(39, 43, 58)))
-                mess.setForeground(QBrush(QColor(255, 255, 255)))
-                mess.setFont(QFont("Times", 8, QFont.Bold))
-                mess.setTextAlignment(Qt.AlignLeft)
-                self.history_model.appendRow(mess)
-            else:
-                mess = QStandardItem(f'{item[3].replace(microsecond=0).strftime("%H:%M | %B %d")}\n\n{item[2]}\n')
-                mess.setEditable(False)
-                mess.setTextAlignment(Qt.AlignRight)
-                mess.setBackground(QBrush(QColor(59, 133, 206)))
-                mess.setForeground(QBrush(QColor(255, 255, 255)))
-                mess.setFont(QFont("Times", 8, QFont.Bold))
-                mess.setTextAlignment(Qt.AlignRight)
-                self.history_model.appendRow(mess)
-        self.ui.list_messages.scrollToBottom()
+        последними сообщениями переписки с текущим собеседником.
+        Более старые сообщения загружаются при прокрутке к началу.
+        :param around: Ключ (дата, номер) сообщения, которое нужно
+                       показать вместо последних сообщений. """
+        self.history_model.set_contact(self.current_chat, around)
+        row = self.history_model.row_of(around) if around else None
+        if row is None:
+            self.ui.list_messages.scrollToBottom()
+            return
+        index = self.history_model.index(row, 0)
+        self.ui.list_messages.setCurrentIndex(index)
+        self.ui.list_messages.scrollTo(index, QAbstractItemView.PositionAtCenter)
+
+    def history_new_messages(self) -> None:
+        """ Метод добавляет в окно истории новые сообщения. Если окно
+        прокручено назад и не доходит до последнего сообщения, новые
+        сообщения появятся при прокрутке к концу. """
+        if self.history_model.at_end:
+            self.history_model.fetch_newer()
+            self.ui.list_messages.scrollToBottom()
+
+    @pyqtSlot(int)
+    def history_scrolled(self, value: int) -> None:
+        """ Слот прокрутки истории: у начала окна загружает предыдущую
+        страницу, у конца - следующую, сохраняя положение прокрутки. """
+        scroll_bar = self.ui.list_messages.verticalScrollBar()
+        if value == scroll_bar.minimum():
+            loaded = self.history_model.fetch_older()
+            if loaded:
+                # Сообщение, бывшее первым, остаётся вверху окна.
+                self.ui.list_messages.scrollTo(self.history_model.index(loaded, 0),
+                                               QAbstractItemView.PositionAtTop)
+        elif value == scroll_bar.maximum() and not self.history_model.at_end:
+            last = self.history_model.rowCount() - 1
+            removed = self.history_model.fetch_newer()
+            # Сообщение, бывшее последним, остаётся внизу окна.
+            self.ui.list_messages.scrollTo(self.history_model.index(last - removed, 0),
+                                           QAbstractItemView.PositionAtBottom)
 
     def select_active_user(self) -> None:
         """ Метод-обработчик события click по контакту из списка контактов. """
@@ -140,20 +153,17 @@ class ClientMainWindow(QMainWindow):
         # вызываем основную функцию
         self.set_active_user()
 
-    def set_active_user(self) -> None:
-        """ Метод, активирует в окне чат с выбранным собеседником. """
+    def set_active_user(self, around: tuple = None) -> None:
+        """ Метод, активирует в окне чат с выбранным собеседником.
+        :param around: Ключ сообщения, на котором открыть историю. """
         # Запрашиваем публичный ключ пользователя и создаём объект шифрования
         try:
             self.current_chat_key = self.transport.key_request(
                 self.current_chat)
-            logger.debug(f'Загружен открытый ключ для {self.current_chat}')
-            if self.current_chat_key:
-                self.encryptor = PKCS1_OAEP.new(
-                    RSA.import_key(self.current_chat_key))
+            logger.debug('Загружен открытый ключ для %s', self.current_chat)
         except (OSError, json.JSONDecodeError):
             self.current_chat_key = None
-            self.encryptor = None
-            logger.debug(f'Не удалось получить ключ для {self.current_chat}')
+            logger.debug('Не удалось получить ключ для %s', self.current_chat)
 
         # Если ключа нет то ошибка, что не удалось начать чат с пользователем
         if not self.current_chat_key:
@@ -168,7 +178,21 @@ class ClientMainWindow(QMainWindow):
         self.ui.text_message.setDisabled(False)
 
         # Заполняем окно историю сообщений по требуемому пользователю.
-        self.history_list_update()
+        self.history_list_update(around)
+
+    def search_window(self) -> None:
+        """ Метод открывает окно поиска по сообщениям. """
+        global search_dialog
+        search_dialog = SearchDialog(self.database)
+        search_dialog.message_selected.connect(self.open_search_result)
+        search_dialog.show()
+
+    @pyqtSlot(str, tuple)
+    def open_search_result(self, contact: str, key: tuple) -> None:
+        """ Слот выбора результата поиска: открывает переписку
+        с собеседником на найденном сообщении. """
+        self.current_chat = contact
+        self.set_active_user(key)
 
     def clients_list_update(self) -> None:
         """ Метод обновления контакт-листа"""
@@ -213,7 +237,7 @@ class ClientMainWindow(QMainWindow):
             new_contact = QStandardItem(new_contact)
             new_contact.setEditable(False)
             self.contacts_model.appendRow(new_contact)
-            logger.info(f'Успешно добавлен контакт {new_contact}')
+            logger.info('Успешно добавлен контакт %s', new_contact)
             self.messages.information(self, 'Уведомление!', 'Контакт успешно добавлен.')
 
     def delete_contact_window(self) -> None:
@@ -240,7 +264,7 @@ class ClientMainWindow(QMainWindow):
         else:
             self.database.del_contact(selected)
             self.clients_list_update()
-            logger.info(f'Успешно удалён контакт {selected}')
+            logger.info('Успешно удалён контакт %s', selected)
             self.messages.information(self, 'Успех', 'Контакт успешно удалён.')
             item.close()
             # Если удалён активный пользователь, то деактивируем поля ввода.
@@ -256,13 +280,12 @@ class ClientMainWindow(QMainWindow):
         self.ui.text_message.clear()
         if not message_text:
             return
-        # Шифруем сообщение ключом получателя и упаковываем в base64.
-        message_text_encrypted = self.encryptor.encrypt(
-            message_text.encode('utf8'))
-        message_text_encrypted_base64 = base64.b64encode(
-            message_text_encrypted)
+        self.coalesce_writes()
+        # Шифруем сообщение сессионным ключом собеседника, пакет уже в base64.
+        message_text_encrypted = self.cipher.encrypt(self.current_chat, self.current_chat_key,
+                                                     message_text)
         try:
-            self.transport.send_message(self.current_chat,  message_text_encrypted_base64.decode('ascii'))
+            self.transport.send_message(self.current_chat, message_text_encrypted)
         except ServerError as err:
             self.messages.critical(self, 'Ошибка', err.text)
         except OSError as err:
@@ -274,9 +297,15 @@ class ClientMainWindow(QMainWindow):
             self.messages.critical(self, 'Ошибка', 'Потеряно соединение с сервером!')
             self.close()
         else:
+            self.cipher.confirm(self.current_chat)
             self.database.save_message(self.current_chat, 'out', message_text)
-            logger.debug(f'Отправлено сообщение для {self.current_chat}: {message_text}')
-            self.history_list_update()
+            logger.debug('Отправлено сообщение для %s: %s', self.current_chat, message_text)
+            # Своё сообщение показываем всегда: окно, прокрученное назад,
+            # возвращается к последним сообщениям.
+            if self.history_model.at_end:
+                self.history_new_messages()
+            else:
+                self.history_list_update()
 
     # Слот приёма нового сообщений
     @pyqtSlot(dict)
@@ -286,11 +315,10 @@ class ClientMainWindow(QMainWindow):
         Запрашивает пользователя если пришло сообщение не от текущего
         собеседника. При необходимости меняет собеседника. """
 
-        # Получаем строку байтов
-        encrypted_message = base64.b64decode(message[MESSAGE_TEXT])
-        # Декодируем строку, при ошибке выдаём сообщение и завершаем функцию
+        self.coalesce_writes()
+        # Расшифровываем сообщение, при ошибке выдаём сообщение и завершаем функцию
         try:
-            decrypted_message = self.decrypter.decrypt(encrypted_message)
+            decrypted_message = self.cipher.decrypt(message[SENDER], message[MESSAGE_TEXT])
         except (ValueError, TypeError):
             self.messages.warning(
                 self, 'Ошибка', 'Не удалось декодировать сообщение.')
@@ -298,10 +326,10 @@ class ClientMainWindow(QMainWindow):
         # Сохраняем сообщение в базу и обновляем историю сообщений или
         # открываем новый чат.
         self.database.save_message(self.current_chat, 'in',
-                                   decrypted_message.decode('utf8'))
+                                   decrypted_message)
         sender = message[SENDER]
         if sender == self.current_chat:
-            self.history_list_update()
+            self.history_new_messages()
         else:
             # Проверим есть ли такой пользователь у нас в контактах:
             if self.database.check_contact(sender):
@@ -323,9 +351,48 @@ class ClientMainWindow(QMainWindow):
                     self.add_contact(sender)
                     self.current_chat = sender
                     self.database.save_message(self.current_chat, 'in',
-                                               decrypted_message.decode('utf8'))
+                                               decrypted_message)
                     self.set_active_user()
 
+    @pyqtSlot(list)
+    def offline_messages(self, messages: list) -> None:
+        """ Слот обработчик сообщений, полученных, пока клиент был не в сети.
+        Дешифрует и сохраняет сообщения в историю без диалогов для каждого
+        сообщения, затем обновляет историю текущего чата.
+        Страница сохраняется одной транзакцией. """
+        self.coalesce_writes()
+        received = []
+        for message in messages:
+            # Сообщения групп клиент пока не показывает.
+            if message.get(ACTION) != MESSAGE:
+                continue
+            try:
+                decrypted_message = self.cipher.decrypt(message[SENDER], message[MESSAGE_TEXT])
+            except (ValueError, TypeError, KeyError):
+                logger.error('Не удалось декодировать сообщение от %s.', message.get(SENDER))
+                continue
+            received.append((message[SENDER], 'in', decrypted_message))
+        self.database.save_messages(received)
+        logger.debug('Получено %s сообщений, пока клиент был не в сети.', len(messages))
+        if any(sender == self.current_chat for sender, _, _ in received):
+            self.history_new_messages()
+
+    def coalesce_writes(self) -> None:
+        """ Метод объединяет записи в базу до конца текущей итерации цикла
+        событий в одну транзакцию: сообщения, принятые пачкой, и ключи
+        шифрования, сохранённые при их расшифровке, фиксируются вместе.
+        Прочитанная из базы история уже содержит эти записи, в файл они
+        попадают, как только окно вернётся в цикл событий. """
+        if not self.writes_coalesced:
+            self.writes_coalesced = True
+            self.database.begin_batch()
+            QTimer.singleShot(0, self.commit_writes)
+
+    def commit_writes(self) -> None:
+        """ Метод фиксирует записи, объединённые coalesce_writes. """
+        self.writes_coalesced = False
+        self.database.end_batch()
+
     @pyqtSlot()
     def connection_lost(self) -> None:
         """ Метод-слот потери соединения. Выдаёт
@@ -335,7 +402,20 @@ class ClientMainWindow(QMainWindow):
 
     @pyqtSlot()
     def sig_205(self) -> None:
-        """ Слот выполняющий обновление баз данных по команде сервера. """
+        """ Слот сообщения 205. Обновление списков откладывается на случайное
+        время до LISTS_UPDATE_JITTER, чтобы клиенты не обращались к серверу
+        одновременно, сообщения 205 за это время объединяются в одно обновление. """
+        if not self.lists_update_scheduled:
+            self.lists_update_scheduled = True
+            QTimer.singleShot(int(random.uniform(0, LISTS_UPDATE_JITTER) * 1000), self.lists_update)
+
+    def lists_update(self) -> None:
+        """ Метод выполняющий обновление баз данных по команде сервера. """
+        self.lists_update_scheduled = False
+        try:
+            self.transport.lists_update()
+        except OSError:
+            logger.error('Не удалось обновить списки пользователей и контактов.')
         if self.current_chat and not self.database.check_user(self.current_chat):
             self.messages.warning(self, 'Сочувствую', 'К сожалению собеседник был удалён с сервера.')
             self.set_disabled_input()
@@ -345,6 +425,7 @@ class ClientMainWindow(QMainWindow):
     def make_connection(self, trans_obj: ClientTransport):
         """ Метод обеспечивающий соединение сигналов и слотов. """
         trans_obj.new_message.connect(self.message)
+        trans_obj.offline_messages.connect(self.offline_messages)
         trans_obj.connection_lost.connect(self.connection_lost)
         trans_obj.message_205.connect(self.sig_205)
 
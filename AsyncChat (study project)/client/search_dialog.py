@@ -0,0 +1,93 @@
+import sys
+import html
+from PyQt5.QtCore import Qt, QTimer, QUrl, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QLabel, QLineEdit, QTextBrowser, QApplication
+sys.path.append('../')
+from client.database import ClientDatabase, SEARCH_MATCH_START, SEARCH_MATCH_END
+from common.settings import SEARCH_INPUT_DELAY
+from logs.config_client_log import create_client_logger
+
+logger = create_client_logger('search')
+
+
+class SearchDialog(QDialog):
+    """ GUI - класс окна поиска по истории сообщений.
+    Ищет по мере ввода во всей переписке, показывает найденные
+    сообщения с выделенными совпадениями. Щелчок по результату
+    открывает переписку на этом сообщении. """
+    # Выбран результат: собеседник и ключ (дата, номер) сообщения.
+    message_selected = pyqtSignal(str, tuple)
+
+    def __init__(self, database: ClientDatabase):
+        """
+        :param database: Объект базы данных клиента.
+        """
+        super().__init__()
+        self.database = database
+        # Результаты последнего поиска: номер сообщения -> (собеседник, ключ).
+        self.results = dict()
+
+        self.setFixedSize(500, 420)
+        self.setWindowTitle('Поиск по сообщениям')
+        # Удаляем диалог, если окно было закрыто
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        self.query = QLineEdit(self)
+        self.query.setFixedSize(480, 30)
+        self.query.move(10, 10)
+        self.query.setPlaceholderText('Введите слова для поиска...')
+
+        self.status = QLabel(self)
+        self.status.setFixedSize(480, 20)
+        self.status.move(10, 45)
+
+        self.view = QTextBrowser(self)
+        self.view.setFixedSize(480, 345)
+        self.view.move(10, 68)
+        # Ссылки результатов обрабатываем сами, а не открываем в браузере.
+        self.view.setOpenLinks(False)
+        self.view.anchorClicked.connect(self.result_clicked)
+
+        # Поиск выполняется после паузы во вводе, а не на каждый символ.
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(int(SEARCH_INPUT_DELAY * 1000))
+        self.timer.timeout.connect(self.search)
+        self.query.textChanged.connect(self.timer.start)
+        self.query.returnPressed.connect(self.search)
+
+    def search(self) -> None:
+        """ Метод выполняет поиск и выводит результаты. """
+        self.timer.stop()
+        rows = self.database.search_messages(self.query.text())
+        self.results = dict((row[4], (row[0], (row[3], row[4]))) for row in rows)
+        blocks = []
+        for contact, direction, snippet, date, number in rows:
+            # Текст экранируем, затем заменяем метки совпадений выделением.
+            snippet = html.escape(snippet).replace(SEARCH_MATCH_START, '<b>').replace(SEARCH_MATCH_END, '</b>')
+            arrow = '←' if direction == 'in' else '→'
+            blocks.append(f'<p><a href="message:{number}">{arrow} {html.escape(contact)}</a> '
+                          f'<small>{date.replace(microsecond=0).strftime("%H:%M | %B %d %Y")}</small>'
+                          f'<br>{snippet}</p>')
+        self.view.setHtml(''.join(blocks))
+        status = f'Найдено: {len(rows)}' if self.query.text().strip() else ''
+        done, upto = self.database.search_backfill_progress()
+        if done < upto:
+            status += f' (индексация старых сообщений: {done * 100 // upto}%)'
+        self.status.setText(status)
+        logger.debug('Поиск "%s": %s результатов', self.query.text(), len(rows))
+
+    def result_clicked(self, url: QUrl) -> None:
+        """ Метод - обработчик щелчка по результату поиска. """
+        number = int(url.path())
+        if number in self.results:
+            self.message_selected.emit(*self.results[number])
+            self.close()
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    database = ClientDatabase('test1')
+    window = SearchDialog(database)
+    window.show()
+    app.exec_()
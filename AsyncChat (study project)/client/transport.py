@@ -2,32 +2,86 @@ import sys
 import time
 import hmac
 import json
+import errno
+import select
 import socket
 import hashlib
 import binascii
+import itertools
 import threading
 from datetime import datetime
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from Crypto.PublicKey.RSA import RsaKey
 from PyQt5.QtCore import pyqtSignal, QObject
 sys.path.append('../')
 from common.settings import *
-from common.exceptions import ServerError
+from common.exceptions import ServerError, IncorrectDataRecivedError
 from client.database import ClientDatabase
-from common.utils import get_message, send_message
+from common.utils import get_message, send_message, MessageReader
 from logs.config_client_log import create_client_logger
 
 # Инициализация логгера для клиента.
-logger = create_client_logger()
-# Объект блокировки для работы с сокетом.
+logger = create_client_logger('transport')
+# Объект блокировки для отправки в сокет: кадры разных запросов
+# не должны перемешиваться.
 socket_lock = threading.Lock()
 
 
+def password_hash(username: str, password: str) -> bytes:
+    """ Функция вычисляет хэш пароля, который хранит сервер:
+    PBKDF2 с логином в качестве соли, в hex представлении.
+    :param username: Уникальный логин пользователя.
+    :param password: Пароль пользователя.
+    :return: Хэш пароля. """
+    passwd_bytes = password.encode('utf-8')
+    salt = username.lower().encode('utf-8')
+    passwd_hash = hashlib.pbkdf2_hmac('sha512', passwd_bytes, salt, 10000)
+    return binascii.hexlify(passwd_hash)
+
+
+def presence_message(username: str, pubkey: str) -> dict:
+    """ Функция формирует сообщение о присутствии для авторизации
+    с предложением передачи кадрами.
+    :param username: Уникальный логин пользователя.
+    :param pubkey: Публичный ключ пользователя.
+    :return: Сообщение о присутствии по протоколу JIM. """
+    time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
+    return {
+        ACTION: PRESENCE,
+        TIME: time_now,
+        USER: {
+            ACCOUNT_NAME: username,
+            PUBLIC_KEY: pubkey
+        },
+        # Предлагаем серверу передачу кадрами с заголовком длины.
+        FRAMING: FRAMING_LENGTH
+    }
+
+
+def auth_answer(passwd_hash: bytes, challenge: dict) -> dict:
+    """ Функция формирует ответ на запрос 511 сервера:
+    HMAC случайной строки сервера с хэшем пароля.
+    :param passwd_hash: Хэш пароля из password_hash.
+    :param challenge: Запрос 511 сервера.
+    :return: Ответ 511 с дайджестом. """
+    digest = hmac.new(passwd_hash, challenge[DATA].encode('utf-8'), 'MD5').digest()
+    answer = dict(RESPONSE_511)
+    answer[DATA] = binascii.b2a_base64(digest).decode('ascii')
+    return answer
+
+
 class ClientTransport(threading.Thread, QObject):
     """ Класс реализующий транспортную подсистему клиентского
-    модуля. Отвечает за взаимодействие с сервером. """
+    модуля. Отвечает за взаимодействие с сервером.
+    После запуска потока сокет читает только он: ответы сервера
+    передаются ожидающим запросам по номеру запроса REQUEST_ID,
+    сообщения от сервера сразу передаются сигналами. Запросы можно
+    отправлять, не дожидаясь ответов на предыдущие (submit). """
 
     # Сигналы новое сообщение и потеря соединения
     new_message = pyqtSignal(dict)
+    # Страница сообщений, полученных сервером, пока клиент был не в сети.
+    offline_messages = pyqtSignal(list)
     message_205 = pyqtSignal()
     connection_lost = pyqtSignal()
 
@@ -50,22 +104,34 @@ class ClientTransport(threading.Thread, QObject):
         self.keys = keys
         # Сокет для работы с сервером.
         self.transport = None
+        # Буфер приёма кадров, если сервер согласовал передачу кадрами.
+        self.reader = None
+        self.framed = False
+        # Запросы, ожидающие ответа: номер запроса -> Future, в порядке отправки.
+        self.pending = dict()
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        # Поток приёма запущен, до этого ответы читает сам запрос.
+        self.receiving = False
+        # Сообщения от сервера, принятые до запуска потока приёма.
+        self.early_messages = []
+        # Флаг продолжения работы транспорта.
+        self.running = True
+        # Версия списков пользователей и контактов, полученных с сервера.
+        self.lists_version = None
         # Устанавливаем соединение с сервером.
         self.connection_init(ip_address, port)
         # Обновляем таблицы известных пользователей и контактов
         try:
-            self.user_list_update()
-            self.contacts_list_update()
+            self.lists_update()
         except OSError as err:
             if err.errno:
-                logger.critical(f'Потеряно соединение с сервером.')
+                logger.critical('Потеряно соединение с сервером.')
                 raise ServerError('Потеряно соединение с сервером!')
             logger.error('Timeout соединения при обновлении списков пользователей.')
         except json.JSONDecodeError:
-            logger.critical(f'Потеряно соединение с сервером.')
+            logger.critical('Потеряно соединение с сервером.')
             raise ServerError('Потеряно соединение с сервером!')
-        # Флаг продолжения работы транспорта.
-        self.running = True
 
     def connection_init(self, ip_address: str, port: int) -> None:
         """ Метод отвечающий за установку соединения с сервером.
@@ -80,7 +146,7 @@ class ClientTransport(threading.Thread, QObject):
         # Соединяемся, 5 попыток соединения, флаг успеха ставим в True если удалось
         connected = False
         for i in range(5):
-            logger.info(f'Попытка подключения №{i + 1}')
+            logger.info('Попытка подключения №%s', i + 1)
             try:
                 self.transport.connect((ip_address, port))
             # OSError, ConnectionRefusedError
@@ -101,49 +167,38 @@ class ClientTransport(threading.Thread, QObject):
         logger.debug('Установлено соединение с сервером')
 
         # Запускаем процедуру авторизации и получаем хэш пароля.
-        passwd_bytes = self.password.encode('utf-8')
-        salt = self.username.lower().encode('utf-8')
-        passwd_hash = hashlib.pbkdf2_hmac('sha512', passwd_bytes, salt, 10000)
-        passwd_hash_string = binascii.hexlify(passwd_hash)
+        passwd_hash_string = password_hash(self.username, self.password)
 
-        logger.debug(f'Passwd hash ready: {passwd_hash_string}')
+        logger.debug('Passwd hash ready: %s', passwd_hash_string)
 
         # Получаем публичный ключ и декодируем его из байтов
         pubkey = self.keys.publickey().export_key().decode('ascii')
 
         # Авторизируемся на сервере
         with socket_lock:
-            time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
-            presense = {
-                ACTION: PRESENCE,
-                TIME: time_now,
-                USER: {
-                    ACCOUNT_NAME: self.username,
-                    PUBLIC_KEY: pubkey
-                }
-            }
-            logger.debug(f"Presense message = {presense}")
+            presense = presence_message(self.username, pubkey)
+            logger.debug('Presense message = %s', presense)
             # Отправляем серверу приветственное сообщение.
             try:
-                send_message(self.transport, presense)
-                answer = get_message(self.transport)
-                logger.debug(f'Server response = {answer}.')
+                send_message(self.transport, presense, self.framed)
+                answer = get_message(self.transport, self.reader)
+                logger.debug('Server response = %s.', answer)
                 # Если сервер вернул ошибку, бросаем исключение.
                 if RESPONSE in answer:
                     if answer[RESPONSE] == 400:
                         raise ServerError(answer[ERROR])
                     elif answer[RESPONSE] == 511:
                         # Если всё нормально, то продолжаем процедуру авторизации.
-                        ans_data = answer[DATA]
-                        hash = hmac.new(passwd_hash_string,
-                                        ans_data.encode('utf-8'), 'MD5')
-                        digest = hash.digest()
-                        my_ans = RESPONSE_511
-                        my_ans[DATA] = binascii.b2a_base64(digest).decode('ascii')
-                        send_message(self.transport, my_ans)
-                        self.process_server_ans(get_message(self.transport))
+                        # Сервер, поддерживающий кадры, подтверждает их в ответе 511,
+                        # и дальше обе стороны передают сообщения кадрами.
+                        if answer.get(FRAMING) == FRAMING_LENGTH:
+                            self.reader = MessageReader()
+                            self.framed = True
+                        my_ans = auth_answer(passwd_hash_string, answer)
+                        send_message(self.transport, my_ans, self.framed)
+                        self.process_server_ans(get_message(self.transport, self.reader))
             except (OSError, json.JSONDecodeError) as err:
-                logger.debug(f'Connection error.', exc_info=err)
+                logger.debug('Connection error.', exc_info=err)
                 raise ServerError('Сбой соединения в процессе авторизации.')
     def create_presence(self) -> dict:
         """ Метод, генерирующий приветственное сообщение серверу
@@ -157,7 +212,7 @@ class ClientTransport(threading.Thread, QObject):
                 ACCOUNT_NAME: self.username
             }
         }
-        logger.debug(f'Сформировано {PRESENCE} сообщение для пользователя {self.username}')
+        logger.debug('Сформировано %s сообщение для пользователя %s', PRESENCE, self.username)
         return presence_message
 
     def process_server_ans(self, message: dict) -> None:
@@ -165,7 +220,7 @@ class ClientTransport(threading.Thread, QObject):
         Генерирует исключение при ошибке.
         :param message: Сообщение от сервера.
         :return: Полученный код от сервера в виде строки. """
-        logger.debug(f'Разбор сообщения от сервера: {message}')
+        logger.debug('Разбор сообщения от сервера: %s', message)
 
         # Если это подтверждение чего-либо
         if RESPONSE in message:
@@ -174,12 +229,16 @@ class ClientTransport(threading.Thread, QObject):
             elif message[RESPONSE] == 400:
                 raise ServerError(f'{message[ERROR]}')
             elif message[RESPONSE] == 205:
-                self.user_list_update()
-                self.contacts_list_update()
+                # Эта версия списков уже получена, обновлять нечего.
+                if self.lists_version is not None and isinstance(message.get(VERSION), int) \
+                        and message[VERSION] <= self.lists_version:
+                    return
+                # Списки обновляет слот в потоке GUI: запросы из потока
+                # приёма ждали бы ответа, который сам поток и должен принять.
                 self.message_205.emit()
             else:
                 logger.error(
-                    f'Принят неизвестный код подтверждения {message[RESPONSE]}')
+                    'Принят неизвестный код подтверждения %s', message[RESPONSE])
 
         # Если это сообщение от пользователя добавляем в базу, даём сигнал о новом сообщении
         elif ACTION in message \
@@ -188,69 +247,119 @@ class ClientTransport(threading.Thread, QObject):
                 and MESSAGE_TEXT in message \
                 and message[ACTION] == MESSAGE \
                 and message[DESTINATION] == self.username:
-            logger.debug(f'Получено сообщение от пользователя {message[SENDER]}:'
-                         f'{message[MESSAGE_TEXT]}')
+            logger.debug('Получено сообщение от пользователя %s:%s', message[SENDER], message[MESSAGE_TEXT])
             self.new_message.emit(message)
 
     def contacts_list_update(self) -> None:
         """ Метод, обновляющий контакт - лист с сервера"""
-        logger.debug(f'Запрос контакт листа для пользователя {self.name}')
+        logger.debug('Запрос контакт листа для пользователя %s', self.name)
         time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
         request = {
             ACTION: GET_CONTACTS,
             TIME: time_now,
-            USER: self.username
+            USER: self.username,
+            VERSION: self.database.get_list_version('contacts')
         }
-        logger.debug(f'Сформирован запрос {request}')
-        with socket_lock:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
-        logger.debug(f'Получен ответ {answer}')
+        logger.debug('Сформирован запрос %s', request)
+        self.contacts_answer(self.request(request))
+
+    def contacts_answer(self, answer: dict) -> None:
+        """ Метод обработки ответа на запрос контакт-листа: полный
+        список заменяет контакты, изменения применяются к имеющимся. """
+        logger.debug('Получен ответ %s', answer)
         if RESPONSE in answer and answer[RESPONSE] == 202:
-            for contact in answer[LIST_INFO]:
-                self.database.add_contact(contact)
+            if answer.get(LIST_INFO) is not None:
+                self.database.set_contacts(answer[LIST_INFO], answer.get(VERSION))
+            else:
+                self.database.update_contacts(answer[ADDED], answer[REMOVED], answer[VERSION])
         else:
             logger.error('Не удалось обновить список контактов.')
 
     def user_list_update(self) -> None:
         """ Метод обновления таблицы известных пользователей. """
-        logger.debug(f'Запрос списка известных пользователей {self.username}')
+        logger.debug('Запрос списка известных пользователей %s', self.username)
         time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
         request = {
             ACTION: USERS_REQUEST,
             TIME: time_now,
-            ACCOUNT_NAME: self.username
+            ACCOUNT_NAME: self.username,
+            VERSION: self.database.get_list_version('users')
         }
-        with socket_lock:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
+        self.users_answer(self.request(request))
+
+    def users_answer(self, answer: dict) -> None:
+        """ Метод обработки ответа на запрос известных пользователей:
+        полный список заменяет таблицу, изменения применяются к имеющейся. """
         if RESPONSE in answer and answer[RESPONSE] == 202:
-            self.database.add_users(answer[LIST_INFO])
+            if answer.get(LIST_INFO) is not None:
+                self.database.add_users(answer[LIST_INFO], answer.get(VERSION))
+            else:
+                self.database.update_users(answer[ADDED], answer[REMOVED], answer[VERSION])
         else:
             logger.error('Не удалось обновить список известных пользователей.')
 
+    def lists_update(self) -> None:
+        """ Метод обновления известных пользователей и контакт-листа.
+        Оба запроса отправляются сразу, без ожидания ответа на первый.
+        В запросах передаются версии списков, полученных ранее: сервер
+        отвечает только изменениями, а при неизвестной версии - полным списком. """
+        time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
+        users = self.submit({ACTION: USERS_REQUEST, TIME: time_now, ACCOUNT_NAME: self.username,
+                             VERSION: self.database.get_list_version('users')})
+        contacts = self.submit({ACTION: GET_CONTACTS, TIME: time_now, USER: self.username,
+                                VERSION: self.database.get_list_version('contacts')})
+        users = self.wait(users)
+        contacts = self.wait(contacts)
+        self.users_answer(users)
+        self.contacts_answer(contacts)
+        versions = [answer.get(VERSION) for answer in (users, contacts)]
+        if None not in versions:
+            self.lists_version = min(versions)
+
+    def offline_messages_update(self) -> None:
+        """ Метод забирает с сервера сообщения, пришедшие, пока клиент был
+        не в сети. Сообщения запрашиваются страницами, каждый следующий запрос
+        подтверждает получение предыдущей страницы, после чего сервер удаляет
+        её. Пустая страница означает, что сообщений больше нет. """
+        logger.debug('Запрос сообщений для %s, полученных не в сети', self.username)
+        ack = 0
+        while self.running:
+            time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
+            request = {
+                ACTION: GET_OFFLINE,
+                TIME: time_now,
+                ACCOUNT_NAME: self.username,
+                OFFLINE_ACK: ack
+            }
+            answer = self.request(request)
+            if RESPONSE not in answer or answer[RESPONSE] != 202:
+                logger.error('Не удалось получить сообщения, полученные не в сети.')
+                return
+            if not answer[LIST_INFO]:
+                return
+            self.offline_messages.emit(answer[LIST_INFO])
+            ack = max(message[OFFLINE_ID] for message in answer[LIST_INFO])
+
     def key_request(self, username: str) -> str:
         """ Метод запрашивающий с сервера публичный ключ пользователя.
         :param username: Уникальный логин пользователя.
         :return: Публичный ключ из базы данных сервера. """
-        logger.debug(f'Запрос публичного ключа для {username}')
+        logger.debug('Запрос публичного ключа для %s', username)
         time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
         request = {
             ACTION: PUBLIC_KEY_REQUEST,
             TIME: time_now,
             ACCOUNT_NAME: username
         }
-        with socket_lock:
-            send_message(self.transport, request)
-            ans = get_message(self.transport)
+        ans = self.request(request)
         if RESPONSE in ans and ans[RESPONSE] == 511:
             return ans[DATA]
         else:
-            logger.error(f'Не удалось получить ключ собеседника{username}.')
+            logger.error('Не удалось получить ключ собеседника%s.', username)
     def add_contact(self, new_contact: str) -> None:
         """ Метод сообщающий на сервер о добавлении нового контакта
         :param new_contact: Уникальный логин нового контакта. """
-        logger.debug(f'Создание контакта {new_contact}')
+        logger.debug('Создание контакта %s', new_contact)
         time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
         request = {
             ACTION: ADD_CONTACT,
@@ -258,16 +367,13 @@ class ClientTransport(threading.Thread, QObject):
             USER: self.username,
             ACCOUNT_NAME: new_contact
         }
-        with socket_lock:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
-            self.process_server_ans(answer)
+        self.process_server_ans(self.request(request))
 
     def remove_contact(self, old_contact: str) -> None:
         """ Метод удаления клиента на сервере
         :param old_contact: Уникальный логин старого контакта.
         """
-        logger.debug(f'Удаление контакта {old_contact}')
+        logger.debug('Удаление контакта %s', old_contact)
         time_now = datetime.now().strftime("%A | %H:%M:%S |%d %B %Yг ")
         request = {
             ACTION: REMOVE_CONTACT,
@@ -275,10 +381,7 @@ class ClientTransport(threading.Thread, QObject):
             USER: self.username,
             ACCOUNT_NAME: old_contact
         }
-        with socket_lock:
-            send_message(self.transport, request)
-            answer = get_message(self.transport)
-            self.process_server_ans(answer)
+        self.process_server_ans(self.request(request))
 
     def transport_shutdown(self) -> None:
         """Метод закрытия соединения, отправляет серверу сообщение о выходе. """
@@ -291,7 +394,7 @@ class ClientTransport(threading.Thread, QObject):
         }
         with socket_lock:
             try:
-                send_message(self.transport, message)
+                send_message(self.transport, message, self.framed)
             except OSError:
                 pass
         logger.debug('Транспорт завершает работу.')
@@ -309,45 +412,146 @@ class ClientTransport(threading.Thread, QObject):
             TIME: time_now,
             MESSAGE_TEXT: message
         }
-        logger.debug(f'Сформирован словарь сообщения: {message_dict}')
+        logger.debug('Сформирован словарь сообщения: %s', message_dict)
 
-        # Необходимо дождаться освобождения сокета для отправки сообщения
-        with socket_lock:
-            send_message(self.transport, message_dict)
-            answer = get_message(self.transport)
-            self.process_server_ans(answer)
-            logger.info(f'Отправлено сообщение для пользователя {to}')
+        self.process_server_ans(self.request(message_dict))
+        logger.debug('Отправлено сообщение для пользователя %s', to)
+
+    def submit(self, message: dict) -> Future:
+        """ Метод отправки запроса серверу без ожидания ответа.
+        Запросу присваивается номер REQUEST_ID, по нему поток приёма
+        находит запрос, к которому относится ответ.
+        До запуска потока приёма ответ читается здесь же.
+        :param message: Запрос в виде словаря.
+        :return: Future с ответом сервера. """
+        future = Future()
+        message[REQUEST_ID] = request_id = next(self.request_ids)
+        future.request_id = request_id
+        if not self.receiving:
+            with socket_lock:
+                send_message(self.transport, message, self.framed)
+                while True:
+                    answer = get_message(self.transport, self.reader)
+                    if self.is_response(answer):
+                        answer.pop(REQUEST_ID, None)
+                        future.set_result(answer)
+                        return future
+                    self.early_messages.append(answer)
+
+        with self.pending_lock:
+            self.pending[request_id] = future
+        try:
+            with socket_lock:
+                send_message(self.transport, message, self.framed)
+        except OSError:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            raise
+        return future
+
+    def wait(self, future: Future) -> dict:
+        """ Метод ожидания ответа на отправленный запрос.
+        :param future: Future, полученный от submit.
+        :return: Ответ сервера. """
+        try:
+            return future.result(CLIENT_REQUEST_TIMEOUT)
+        except FutureTimeout:
+            # Поздний ответ будет принят и отброшен как ответ без запроса.
+            with self.pending_lock:
+                self.pending.pop(future.request_id, None)
+            raise socket.timeout('Сервер не ответил на запрос.')
+
+    def request(self, message: dict) -> dict:
+        """ Метод отправки запроса серверу и ожидания ответа на него.
+        :param message: Запрос в виде словаря.
+        :return: Ответ сервера. """
+        return self.wait(self.submit(message))
+
+    @staticmethod
+    def is_response(message: dict) -> bool:
+        """ Является ли сообщение ответом на запрос клиента.
+        Ответ 205 сервер отправляет сам, это не ответ на запрос. """
+        return RESPONSE in message and message[RESPONSE] != 205
+
+    def receive(self) -> list[dict]:
+        """ Метод приёма сообщений из готового к чтению сокета.
+        :return: Список полностью принятых сообщений. """
+        if self.reader is None:
+            return [get_message(self.transport)]
+        data = self.transport.recv(FRAMED_RECV_SIZE)
+        if not data:
+            raise ConnectionResetError(errno.ECONNRESET, 'Соединение закрыто сервером.')
+        self.reader.feed(data)
+        messages = []
+        while self.reader.has_message():
+            messages.append(self.reader.pop())
+        return messages
+
+    def dispatch(self, message: dict) -> None:
+        """ Метод передаёт ответ первому ожидающему запросу,
+        остальные сообщения сервера - в process_server_ans.
+        :param message: Сообщение от сервера. """
+        if self.is_response(message):
+            request_id = message.pop(REQUEST_ID, None)
+            with self.pending_lock:
+                if request_id is None and self.pending:
+                    # Сервер без поддержки REQUEST_ID отвечает по порядку.
+                    request_id = next(iter(self.pending))
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                logger.error('Принят ответ сервера без запроса: %s', message)
+            else:
+                future.set_result(message)
+            return
+        try:
+            self.process_server_ans(message)
+        except ServerError as err:
+            logger.error('Ошибка сервера: %s', err)
+
+    def fail_pending(self) -> None:
+        """ Метод завершает ожидающие запросы после потери соединения. """
+        with self.pending_lock:
+            pending, self.pending = self.pending, dict()
+        for future in pending.values():
+            future.set_exception(ConnectionResetError(errno.ECONNRESET, 'Потеряно соединение с сервером.'))
+
+    def start(self) -> None:
+        """ Запуск потока приёма. С этого момента запросы ждут ответа
+        от потока приёма, а не читают сокет сами. """
+        self.receiving = True
+        super().start()
 
     def run(self):
-        """ Метод содержащий основной цикл работы транспортного потока. """
+        """ Метод содержащий основной цикл работы транспортного потока.
+        Поток ждёт данных в сокете и обрабатывает их сразу после приёма. """
         logger.debug('Запущен процесс - приёмник сообщений с сервера.')
+        for message in self.early_messages:
+            self.dispatch(message)
+        self.early_messages.clear()
+        # Сообщения, полученные не в сети, запрашиваются отдельным потоком:
+        # ответы на запросы принимает этот поток.
+        threading.Thread(target=self.offline_messages_receive, daemon=True).start()
         while self.running:
-            # Отдыхаем секунду и снова пробуем захватить сокет. Если не сделать тут задержку,
-            # то отправка может достаточно долго ждать освобождения сокета.
-            time.sleep(1)
-            message = None
-            with socket_lock:
-                try:
-                    self.transport.settimeout(0.5)
-                    message = get_message(self.transport)
-                except OSError as err:
-                    if err.errno:
-                        # выход по таймауту вернёт номер ошибки err.errno равный None
-                        # поэтому, при выходе по таймауту мы сюда попросту не попадём
-                        logger.critical(f'Потеряно соединение с сервером.')
-                        self.running = False
-                        self.connection_lost.emit()
-                # Проблемы с соединением
-                except (ConnectionError, ConnectionAbortedError,
-                        ConnectionResetError, json.JSONDecodeError,
-                        TypeError, ConnectionRefusedError):
-                    logger.debug(f'Потеряно соединение с сервером.')
+            try:
+                ready, _, _ = select.select([self.transport], [], [], CLIENT_POLL_INTERVAL)
+                if not ready:
+                    continue
+                messages = self.receive()
+            except (OSError, ValueError, IncorrectDataRecivedError) as err:
+                # ValueError включает json.JSONDecodeError и закрытый сокет.
+                if self.running:
+                    logger.critical('Потеряно соединение с сервером.', exc_info=err)
                     self.running = False
                     self.connection_lost.emit()
-                finally:
-                    self.transport.settimeout(5)
-            # Если сообщение получено, то вызываем функцию обработчик:
-            if message:
-                logger.debug(f'Принято сообщение с сервера: {message}')
-                self.process_server_ans(message)
+                break
+            for message in messages:
+                logger.debug('Принято сообщение с сервера: %s', message)
+                self.dispatch(message)
+        self.fail_pending()
 
+    def offline_messages_receive(self) -> None:
+        """ Получение сообщений, пришедших, пока клиент был не в сети. """
+        try:
+            self.offline_messages_update()
+        except (OSError, json.JSONDecodeError):
+            logger.error('Сбой соединения при получении сообщений, полученных не в сети.')
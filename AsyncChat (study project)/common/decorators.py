@@ -1,22 +1,26 @@
+import os
 import sys
-import socket
-import inspect
+import time
 import logging
+import itertools
 
 from functools import wraps
 
 sys.path.append('../../')
 import logs.config_client_log
 import logs.config_server_log
+from common.settings import LOGGING_TRACE_SAMPLE
 
 
 class Log:
     """ Декоратор, выполняющий логирование вызовов функций.
     Сохраняет события типа debug, содержащие
     информацию об имени вызываемой функции, параметры с которыми
-    вызывается функция, и модуль, вызывающий функцию. """
+    вызывается функция, модуль, вызывающий функцию, и время выполнения.
+    Если при декорировании отладочный журнал выключен, функция
+    возвращается без обёртки и вызывается без накладных расходов. """
 
-    def __init__(self, logger=None):
+    def __init__(self, logger: logging.Logger = None, sample: int = LOGGING_TRACE_SAMPLE):
         """ Декоратор с параметром - именем логгера. В client.py и server.py
         это будет:
         LOGGER = logging.getLogger('client')
@@ -24,25 +28,36 @@ class Log:
         def function():
             pass
         Но в модуле utils.py параметр LOGGER мы указать не можем, поэтому
-        по умолчанию, при вызове функции из utils.py, logger будет == None. """
+        по умолчанию используется логгер модуля функции (common.utils).
+        :param logger: Логгер, в который пишутся вызовы.
+        :param sample: Записывать каждый sample-й вызов, 1 - все вызовы. """
         self.logger = logger
+        self.sample = max(sample, 1)
 
     def __call__(self, func):
+        logger = self.logger or logging.getLogger(func.__module__)
+        # Уровень проверяется один раз: функции декорируются при импорте,
+        # и с выключенным отладочным журналом обёртка не нужна.
+        if not logger.isEnabledFor(logging.DEBUG):
+            return func
+        sample = self.sample
+        calls = itertools.count()
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            parent_func_name = inspect.currentframe().f_back.f_code.co_name
-            module_name = inspect.currentframe().f_back.f_code.co_filename.split("/")[-1]
-            if self.logger is None:
-                """
-                Если декоратор вызван из utils.py, то параметр logger не задан.
-                Значит, определяем (и связываем) наш логер по имени модуля module_name
-                """
-                logger_name = module_name.replace('.py', '')
-                self.logger = logging.getLogger(logger_name)
-            self.logger.debug(f'Функция {func.__name__} вызвана из функции {parent_func_name} '
-                              f'в модуле {module_name} с аргументами: {args}; {kwargs}')
-            result = func(*args, **kwargs)
-            return result
+            # Уровень, пониженный после импорта, и вызовы вне выборки
+            # обходятся без разбора стека и форматирования аргументов.
+            if next(calls) % sample or not logger.isEnabledFor(logging.DEBUG):
+                return func(*args, **kwargs)
+            caller = sys._getframe(1).f_code
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                logger.debug('Функция %s вызвана из функции %s в модуле %s с аргументами: %s; %s, '
+                             'выполнена за %.1f мкс', func.__name__, caller.co_name,
+                             os.path.basename(caller.co_filename), args, kwargs,
+                             (time.perf_counter() - start) * 1e6)
 
         return wrapper
 
@@ -55,6 +70,7 @@ class LoginRequired:
     на авторизацию. Если клиент не авторизован,
     генерирует исключение TypeError. """
     def __call__(self, func):
+        @wraps(func)
         def checker(*args, **kwargs):
             # проверяем, что первый аргумент - экземпляр MessageProcessor
             # Импортить необходимо тут, иначе ошибка рекурсивного импорта.
@@ -62,13 +78,11 @@ class LoginRequired:
             from common.settings import ACTION, PRESENCE
             if isinstance(args[0], MessageProcessor):
                 found = False
-                for arg in args:
-                    if isinstance(arg, socket.socket):
-                        # Проверяем, что данный сокет есть в словаре names класса
-                        # MessageProcessor
-                        for client in args[0].names:
-                            if args[0].names[client] == arg:
-                                found = True
+                for arg in args[1:]:
+                    # Проверяем, что данный сокет есть в реестре сессий
+                    # MessageProcessor (поиск по обратному индексу, O(1)).
+                    if not isinstance(arg, dict) and args[0].names.is_registered(arg):
+                        found = True
 
                 # Теперь надо проверить, что передаваемые аргументы не presence
                 # сообщение. Если presence, то разрешаем
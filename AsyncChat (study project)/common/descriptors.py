@@ -1,6 +1,6 @@
 from logs.config_server_log import create_server_logger
 
-SERVER_LOGGER = create_server_logger()
+SERVER_LOGGER = create_server_logger('config')
 
 
 class Port:
@@ -9,7 +9,7 @@ class Port:
     def __set__(self, instance, value):
         if not 1023 < value < 65536:
             SERVER_LOGGER.critical(
-                f'Попытка запуска сервера с указанием неподходящего порта {value}. Допустимы адреса с 1024 до 65535.')
+                'Попытка запуска сервера с указанием неподходящего порта %s. Допустимы адреса с 1024 до 65535.', value)
             exit(1)
         instance.__dict__[self.name] = value
 
@@ -32,6 +32,15 @@ class ReqFieldMissingError(Exception):
         return f'В принятом словаре отсутствует обязательное поле {self.missing_field}.'
 
 
+class OutboundOverflowError(ConnectionError):
+    """ Исключение - исходящий буфер клиента переполнен. Наследует
+    ConnectionError: вызывающий код отключает клиента так же,
+    как при потере связи, и сохраняет сообщение до подключения. """
+
+    def __str__(self):
+        return 'Исходящий буфер клиента переполнен.'
+
+
 class ServerError(Exception):
     """ Исключение - ошибка сервера """
 
@@ -11,14 +11,152 @@ DEFAULT_IP_ADDRESS = '127.0.0.1'
 # Максимальная очередь подключений
 MAX_CONNECTIONS = 5
 
+# Очередь подключений для asyncio-движка сервера
+ASYNC_BACKLOG = 1024
+
+# Лимит буфера чтения StreamReader для asyncio-движка
+ASYNC_STREAM_LIMIT = 2 ** 16
+
+# Таймаут ожидания ответа клиента на запрос 511 при авторизации, сек.
+AUTH_TIMEOUT = 5
+
+# Таймаут ожидания завершения соединений и процессов при остановке сервера, сек.
+SHUTDOWN_TIMEOUT = 5
+
+# Интервал проверки флага остановки asyncio-движка, сек.
+ASYNC_SHUTDOWN_CHECK_INTERVAL = 0.2
+
+# Движки сервера: select - поток с опросом сокетов, asyncio - цикл событий
+SERVER_ENGINES = ('select', 'asyncio')
+DEFAULT_SERVER_ENGINE = 'select'
+
+# Таймаут сокета клиента на сервере, сек.
+CLIENT_SOCKET_TIMEOUT = 5
+
+# Максимальное время ожидания select в цикле select-движка сервера, сек.:
+# с этим интервалом выполняются периодические проверки и остановка сервера.
+SERVER_POLL_INTERVAL = 0.5
+
+# Клиент: время ожидания ответа сервера на запрос и интервал, с которым
+# поток приёма проверяет флаг остановки транспорта, сек.
+CLIENT_REQUEST_TIMEOUT = 5
+CLIENT_POLL_INTERVAL = 0.5
+
+# Исходящие буферы клиентов на сервере, байт:
+# выше верхней границы клиент считается перегруженным и его запросы не читаются,
+# ниже нижней границы перегрузка снимается.
+OUTBOUND_HIGH_WATERMARK = 1024 * 1024
+OUTBOUND_LOW_WATERMARK = 256 * 1024
+# Предельный размер исходящего буфера, при превышении клиент отключается.
+OUTBOUND_MAX_BUFFER = 8 * 1024 * 1024
+# Сколько секунд клиент может оставаться перегруженным до отключения.
+OUTBOUND_STALL_TIMEOUT = 10
+
+# Многопроцессный режим: количество процессов-обработчиков по умолчанию
+DEFAULT_WORKERS = 1
+# Интервал повторного подключения к шине соседнего обработчика, сек.
+CLUSTER_RECONNECT_INTERVAL = 0.5
+# Сколько секунд обработчик придерживает сообщения для неизвестных ему
+# пользователей, пока не получит списки пользователей всех соседей по шине.
+CLUSTER_SYNC_TIMEOUT = 10
+
+# Отложенная запись счётчиков сообщений (User_history) в базу сервера:
+# накопленные счётчики сбрасываются одним пакетом UPDATE не реже, чем раз
+# в COUNTERS_FLUSH_INTERVAL сек., или после COUNTERS_FLUSH_SIZE сообщений.
+COUNTERS_FLUSH_INTERVAL = 1.0
+COUNTERS_FLUSH_SIZE = 1000
+
+# Настройки SQLite базы сервера (PRAGMA), применяются к каждому соединению по порядку.
+SERVER_DB_PRAGMAS = {
+    # Журнал WAL: чтение не блокирует запись и наоборот.
+    'journal_mode': 'WAL',
+    # В режиме WAL достаточно fsync при контрольной точке, база остаётся целой при сбое.
+    'synchronous': 'NORMAL',
+    # Кэш страниц соединения: отрицательное значение - размер в КиБ (16 МиБ).
+    'cache_size': -16384,
+    # Чтение файла базы через отображение в память (256 МиБ).
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    # Ожидание блокировки другим процессом-обработчиком, мс.
+    'busy_timeout': 5000,
+}
+
+# Максимальное количество команд потока записи базы сервера в одной транзакции.
+DB_WRITER_BATCH = 500
+
+# Сообщения для пользователей не в сети: сколько сообщений отдаётся за один
+# запрос GET_OFFLINE клиенту с передачей кадрами (без кадров - по одному).
+OFFLINE_PAGE_SIZE = 200
+
+# Смена сессионного ключа шифрования сообщений клиента: по возрасту (сек)
+# и по количеству зашифрованных сообщений.
+SESSION_KEY_LIFETIME = 24 * 60 * 60
+SESSION_KEY_MAX_MESSAGES = 10000
+
+# Клиент: сколько сообщений истории загружается за раз при открытии чата
+# и при прокрутке к началу переписки.
+HISTORY_PAGE_SIZE = 20
+# Сколько сообщений истории модель окна чата держит в памяти: при прокрутке
+# дальше сообщения с другого края окна выгружаются.
+HISTORY_WINDOW_SIZE = 200
+
+# Клиент: полнотекстовый поиск по истории сообщений. Количество результатов,
+# задержка поиска после ввода, сек., и индексация истории, сохранённой до
+# появления поиска: сообщений за раз и пауза между порциями, сек.
+SEARCH_RESULTS_LIMIT = 50
+SEARCH_INPUT_DELAY = 0.3
+SEARCH_BACKFILL_BATCH = 500
+SEARCH_BACKFILL_PAUSE = 0.05
+
+# Журнал изменений списков пользователей и контактов на сервере: сколько
+# последних изменений хранится для ответов клиентам разницей с их версией.
+# Клиент с более старой версией получает полный список.
+DIRECTORY_LOG_SIZE = 10000
+# Клиент: случайная задержка обновления списков после сообщения 205, сек.,
+# чтобы все клиенты не запрашивали изменения одновременно.
+LISTS_UPDATE_JITTER = 2.0
+
+# Максимальное количество пользователей в кэше справочника базы сервера.
+USER_CACHE_SIZE = 10000
+
+# Метрики сервера в текстовом формате Prometheus: адрес и порт HTTP,
+# по которым они отдаются (GET /metrics). Порт 0 - не отдавать.
+# В многопроцессном режиме обработчик N слушает порт METRICS_PORT + N.
+METRICS_ADDRESS = '127.0.0.1'
+METRICS_PORT = 0
+# Границы корзин гистограмм, сек.: авторизация (включает ответ клиента
+# по сети) и вызовы базы сервера.
+METRICS_AUTH_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+METRICS_DB_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                      0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
 # Максимальная длинна сообщения в байтах
 MAX_PACKAGE_LENGTH = 1024
 
+# Режим передачи с длиной кадра: заголовок из 4 байт (big-endian) и JSON.
+# Максимальный размер кадра в байтах
+MAX_FRAME_LENGTH = 16 * 1024 * 1024
+
+# Размер блока чтения из сокета в режиме кадров
+FRAMED_RECV_SIZE = 64 * 1024
+
 # Кодировка проекта
 ENCODING = 'utf-8'
 
 # Текущий уровень логирования
 LOGGING_LEVEL = logging.DEBUG
+# Уровни журналов подсистем поверх LOGGING_LEVEL, строка вида
+# 'INFO,server.core=DEBUG': server.core, server.writer, client.transport и т.д.
+LOGGING_LEVELS = ''
+# Запись журнала в файл в формате JSON, по одному объекту в строке.
+LOGGING_JSON = False
+# Декоратор Log записывает каждый N-й вызов функции (1 - все вызовы).
+# Функции модулей common (приём и отправка сообщений) записываются,
+# только если уровень их журнала задан в LOGGING_LEVELS: 'common.utils=DEBUG'.
+LOGGING_TRACE_SAMPLE = 1
+# Переменная окружения с каталогом файлов журналов (по умолчанию - каталог
+# logs проекта). Unit-тесты пишут журналы во временный каталог.
+LOG_DIR_ENV = 'CHAT_LOG_DIR'
 
 # База данных для хранения данных сервера:
 SERVER_CONFIG = 'server_config.ini'
@@ -33,6 +171,18 @@ SENDER = 'from'
 DESTINATION = 'to'
 DATA = 'bin'
 PUBLIC_KEY = 'pubkey'
+FRAMING = 'framing'
+# Номер сохранённого сообщения и подтверждение получения сообщений до этого номера.
+OFFLINE_ID = 'offline_id'
+OFFLINE_ACK = 'ack'
+# Имя группы (комнаты).
+GROUP = 'group'
+# Номер запроса клиента, сервер возвращает его в ответе на запрос.
+REQUEST_ID = 'request_id'
+# Версия списка пользователей или контактов, добавленные и удалённые имена.
+VERSION = 'version'
+ADDED = 'added'
+REMOVED = 'removed'
 
 # Прочие ключи, используемые в протоколе
 PRESENCE = 'presence'
@@ -47,6 +197,25 @@ REMOVE_CONTACT = 'remove'
 ADD_CONTACT = 'add'
 USERS_REQUEST = 'get_users'
 PUBLIC_KEY_REQUEST = 'pubkey_need'
+# Запрос страницы сообщений, сохранённых, пока пользователь был не в сети.
+GET_OFFLINE = 'get_offline'
+# Группы: создание, вход, выход, список групп пользователя и сообщение группе.
+CREATE_GROUP = 'create_group'
+JOIN_GROUP = 'join_group'
+LEAVE_GROUP = 'leave_group'
+GET_GROUPS = 'get_groups'
+GROUP_MESSAGE = 'group_message'
+# Шина маршрутизации между процессами-обработчиками
+BUS_EVENT = 'bus_event'
+WORKER_ID = 'worker'
+BUS_SYNC = 'sync'
+BUS_JOIN = 'join'
+BUS_LEAVE = 'leave'
+BUS_ROUTE = 'route'
+BUS_GROUP_ROUTE = 'group_route'
+BUS_GROUP_UPDATE = 'group_update'
+# Значение поля FRAMING: сообщения передаются кадрами с заголовком длины.
+FRAMING_LENGTH = 'length'
 
 # Словари - ответы:
 # 200
@@ -1,16 +1,19 @@
 import json
+import errno
 import socket
-from common.settings import MAX_PACKAGE_LENGTH, ENCODING
+import struct
+from collections import deque
+from common.settings import MAX_PACKAGE_LENGTH, ENCODING, MAX_FRAME_LENGTH, FRAMED_RECV_SIZE
 from common.exceptions import NonDictInputError, IncorrectDataRecivedError
 from common.decorators import Log
 
+# Заголовок кадра - длина JSON в байтах, 4 байта big-endian.
+FRAME_HEADER = struct.Struct('!I')
 
-@Log()
-def get_message(client: socket.socket) -> dict:
-    """ Утилита приёма и декодирования сообщения. Принимает байты и
-    выдаёт словарь, если принято что-то другое отдаёт ошибку значения """
 
-    encoded_response = client.recv(MAX_PACKAGE_LENGTH)
+def decode_message(encoded_response: bytes) -> dict:
+    """ Утилита декодирования сообщения. Принимает байты и
+    выдаёт словарь, если принято что-то другое отдаёт ошибку значения """
     if isinstance(encoded_response, bytes):
         json_response = encoded_response.decode(ENCODING)
         response = json.loads(json_response)
@@ -20,13 +23,96 @@ def get_message(client: socket.socket) -> dict:
     raise IncorrectDataRecivedError
 
 
-@Log()
-def send_message(sock: socket.socket, message: dict) -> None:
-    """ Утилита кодирования и отправки сообщения
-    принимает словарь и отправляет его """
-
+def encode_message(message: dict, framed: bool = False) -> bytes:
+    """ Утилита кодирования сообщения. Принимает словарь
+    и возвращает байты для отправки в сокет.
+    :param message: Словарь-сообщение.
+    :param framed: Добавить заголовок с длиной кадра. """
     if not isinstance(message, dict):
         raise NonDictInputError
     json_message = json.dumps(message)
     encoded_message = json_message.encode(ENCODING)
-    sock.send(encoded_message)
+    if framed:
+        return FRAME_HEADER.pack(len(encoded_message)) + encoded_message
+    return encoded_message
+
+
+class MessageReader:
+    """ Буферизованный инкрементальный разборщик кадров.
+    Принимает байты в том виде, в каком они пришли из сокета:
+    несколько сообщений за один recv, части кадров, кадры
+    любой длины до MAX_FRAME_LENGTH. Кадры разбираются прямо
+    из общего буфера через memoryview, без промежуточных копий. """
+
+    def __init__(self, max_length: int = MAX_FRAME_LENGTH):
+        """
+        :param max_length: Максимально допустимая длина кадра.
+        """
+        self.max_length = max_length
+        self.buffer = bytearray()
+        # Позиция начала неразобранных данных в буфере.
+        self.offset = 0
+        # Очередь разобранных, но ещё не выданных сообщений.
+        self.messages = deque()
+
+    def feed(self, data: bytes) -> None:
+        """ Добавляет принятые байты и разбирает все полные кадры.
+        :param data: Байты, принятые из сокета. """
+        self.buffer += data
+        buffer_length = len(self.buffer)
+        with memoryview(self.buffer) as view:
+            while buffer_length - self.offset >= FRAME_HEADER.size:
+                frame_length, = FRAME_HEADER.unpack_from(view, self.offset)
+                if frame_length > self.max_length:
+                    raise IncorrectDataRecivedError
+                frame_end = self.offset + FRAME_HEADER.size + frame_length
+                if frame_end > buffer_length:
+                    break
+                response = json.loads(str(view[self.offset + FRAME_HEADER.size:frame_end], ENCODING))
+                if not isinstance(response, dict):
+                    raise IncorrectDataRecivedError
+                self.messages.append(response)
+                self.offset = frame_end
+        # Сдвигаем буфер, только когда разобранная часть стала больше остатка,
+        # чтобы не копировать хвост после каждого кадра.
+        if self.offset and self.offset * 2 >= buffer_length:
+            del self.buffer[:self.offset]
+            self.offset = 0
+
+    def has_message(self) -> bool:
+        """ Есть ли полностью принятые сообщения. """
+        return bool(self.messages)
+
+    def pop(self) -> dict:
+        """ Возвращает первое полностью принятое сообщение. """
+        return self.messages.popleft()
+
+
+@Log()
+def get_message(client: socket.socket, reader: MessageReader = None) -> dict:
+    """ Утилита приёма и декодирования сообщения. Принимает байты и
+    выдаёт словарь, если принято что-то другое отдаёт ошибку значения.
+    Если передан reader, сообщения принимаются кадрами с заголовком длины. """
+    if reader is None:
+        encoded_response = client.recv(MAX_PACKAGE_LENGTH)
+        return decode_message(encoded_response)
+
+    while not reader.has_message():
+        data = client.recv(FRAMED_RECV_SIZE)
+        if not data:
+            raise ConnectionResetError(errno.ECONNRESET, 'Соединение закрыто удалённой стороной.')
+        reader.feed(data)
+    return reader.pop()
+
+
+@Log()
+def send_message(sock: socket.socket, message: dict, framed: bool = False) -> None:
+    """ Утилита кодирования и отправки сообщения
+    принимает словарь и отправляет его.
+    В режиме кадров кадр отправляется целиком через sendall. """
+
+    encoded_message = encode_message(message, framed)
+    if framed:
+        sock.sendall(encoded_message)
+    else:
+        sock.send(encoded_message)
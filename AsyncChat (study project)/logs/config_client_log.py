@@ -1,32 +1,23 @@
 """Кофнфиг клиентского логгера"""
 
-import sys
 import os
 import logging
-from common.settings import LOGGING_LEVEL
+from logs.log_pipeline import create_pipeline
+from common.settings import LOG_DIR_ENV
 
-def create_client_logger():
-    """ Функция создания и настройки клиентского логгера """
-
-    # создаём шаблон формирования логов (formatter):
-    CLIENT_FORMATTER = logging.Formatter('%(asctime)s %(levelname)s %(filename)s %(message)s')
 
+def create_client_logger(subsystem: str = None) -> logging.Logger:
+    """ Функция создания и настройки клиентского логгера.
+    Записи пишутся в файл фоновым потоком, обработчики
+    создаются при первом вызове.
+    :param subsystem: Имя подсистемы: логгер client.<subsystem>
+                      со своим уровнем, записи идут в журнал клиента.
+    :return: Логгер клиента или его подсистемы. """
     # Подготовка имени файла для логирования
-    PATH = os.path.dirname(os.path.abspath(__file__))
+    PATH = os.environ.get(LOG_DIR_ENV) or os.path.dirname(os.path.abspath(__file__))
     PATH = os.path.join(PATH, 'client.log')
 
-    # создаём потоки вывода логов
-    STREAM_HANDLER = logging.StreamHandler(sys.stderr)
-    STREAM_HANDLER.setFormatter(CLIENT_FORMATTER)
-    STREAM_HANDLER.setLevel(logging.ERROR)
-    LOG_FILE = logging.FileHandler(PATH, encoding='utf8')
-    LOG_FILE.setFormatter(CLIENT_FORMATTER)
-
     # создаём регистратор и настраиваем его
-    LOGGER = logging.getLogger('client')
-    LOGGER.addHandler(STREAM_HANDLER)
-    LOGGER.addHandler(LOG_FILE)
-    LOGGER.setLevel(LOGGING_LEVEL)
-
-    return LOGGER
+    LOGGER = create_pipeline('client', lambda: logging.FileHandler(PATH, encoding='utf8'))
 
+    return LOGGER.getChild(subsystem) if subsystem else LOGGER
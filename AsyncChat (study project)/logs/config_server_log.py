@@ -1,31 +1,25 @@
 """Кофнфиг серверного логгера"""
 
-import sys
 import os
 import logging
 import logging.handlers
-from common.settings import LOGGING_LEVEL
+from logs.log_pipeline import create_pipeline
+from common.settings import LOG_DIR_ENV
 
-def create_server_logger():
-    """ Функция создания и настройки клиентского логгера """
-    # создаём шаблон для логов (formatter):
-    SERVER_FORMATTER = logging.Formatter('%(asctime)s %(levelname)s %(filename)s %(message)s')
 
+def create_server_logger(subsystem: str = None) -> logging.Logger:
+    """ Функция создания и настройки серверного логгера.
+    Записи пишутся в файл фоновым потоком, обработчики
+    создаются при первом вызове.
+    :param subsystem: Имя подсистемы: логгер server.<subsystem>
+                      со своим уровнем, записи идут в журнал сервера.
+    :return: Логгер сервера или его подсистемы. """
     # Подготовка имени файла для логирования
-    PATH = os.path.dirname(os.path.abspath(__file__))
+    PATH = os.environ.get(LOG_DIR_ENV) or os.path.dirname(os.path.abspath(__file__))
     PATH = os.path.join(PATH, 'server.log')
 
-    # создаём потоки вывода логов
-    STREAM_HANDLER = logging.StreamHandler(sys.stderr)
-    STREAM_HANDLER.setFormatter(SERVER_FORMATTER)
-    STREAM_HANDLER.setLevel(logging.ERROR)
-    LOG_FILE = logging.handlers.TimedRotatingFileHandler(PATH, encoding='utf8', interval=1, when='D')
-    LOG_FILE.setFormatter(SERVER_FORMATTER)
-
     # создаём регистратор и настраиваем его
-    LOGGER = logging.getLogger('server')
-    LOGGER.addHandler(STREAM_HANDLER)
-    LOGGER.addHandler(LOG_FILE)
-    LOGGER.setLevel(LOGGING_LEVEL)
+    LOGGER = create_pipeline('server', lambda: logging.handlers.TimedRotatingFileHandler(
+        PATH, encoding='utf8', interval=1, when='D'))
 
-    return LOGGER
+    return LOGGER.getChild(subsystem) if subsystem else LOGGER
@@ -0,0 +1,148 @@
+"""Асинхронная запись журналов сервера и клиента"""
+
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from common.settings import LOGGING_LEVEL, LOGGING_LEVELS, LOGGING_JSON
+
+# Шаблон текстовой записи журнала.
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(filename)s %(message)s'
+
+# Запущенные конвейеры: имя логгера -> (QueueListener, обработчик файла).
+pipelines = {}
+# Текущий формат записи в файл: True - JSON.
+json_output = LOGGING_JSON
+
+
+class JsonFormatter(logging.Formatter):
+    """ Форматирует запись журнала в объект JSON в одну строку. """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ Обработчик, ставящий записи в очередь фонового потока записи.
+    В вызывающем потоке в сообщение только подставляются аргументы:
+    переданные логгеру объекты могут измениться после вызова.
+    Форматирование по шаблону и запись на диск выполняет QueueListener. """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        # Трассировку стека сохраняем текстом: кадры нельзя передавать в другой поток.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def file_formatter() -> logging.Formatter:
+    """ Функция возвращает форматтер записи в файл по текущей настройке. """
+    return JsonFormatter() if json_output else logging.Formatter(TEXT_FORMAT)
+
+
+def create_pipeline(name: str, make_file_handler) -> logging.Logger:
+    """ Функция настраивает логгер name: записи ставятся в очередь,
+    фоновый поток пишет их в файл и ошибки - в stderr. Повторный вызов
+    возвращает тот же логгер, не добавляя обработчиков.
+    :param name: Имя логгера: 'server' или 'client'.
+    :param make_file_handler: Функция, создающая обработчик файла журнала.
+    :return: Настроенный логгер. """
+    logger = logging.getLogger(name)
+    if name in pipelines:
+        return logger
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    stream_handler.setLevel(logging.ERROR)
+    file_handler = make_file_handler()
+    file_handler.setFormatter(file_formatter())
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    pipelines[name] = listener, file_handler
+
+    handler = DeferredQueueHandler(log_queue)
+    logger.addHandler(handler)
+    # Записи общих модулей (common.*) идут в журнал запущенной программы.
+    common_logger = logging.getLogger('common')
+    if not common_logger.handlers:
+        common_logger.addHandler(handler)
+    logger.setLevel(LOGGING_LEVEL)
+    apply_levels(parse_levels(LOGGING_LEVELS))
+    return logger
+
+
+@atexit.register
+def shutdown_logging() -> None:
+    """ Функция останавливает фоновые потоки записи, дописав оставшиеся
+    в очередях записи. Вызывается при завершении программы. """
+    while pipelines:
+        name, (listener, _) = pipelines.popitem()
+        logging.getLogger(name).handlers.clear()
+        listener.stop()
+    logging.getLogger('common').handlers.clear()
+
+
+def parse_levels(spec: str) -> dict:
+    """ Функция разбирает строку уровней журналов вида
+    'INFO,server.core=DEBUG,server.database=WARNING'.
+    Уровень без имени относится к логгерам server и client.
+    :param spec: Строка уровней через запятую.
+    :return: Словарь имя логгера -> уровень, '' - уровень без имени. """
+    levels = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.rpartition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f'Неизвестный уровень журнала: {item.strip()}')
+        levels[name.strip()] = level
+    return levels
+
+
+def apply_levels(levels: dict) -> None:
+    """ Функция устанавливает уровни логгеров.
+    :param levels: Словарь из parse_levels. """
+    for name, level in levels.items():
+        for logger_name in ([name] if name else pipelines):
+            logging.getLogger(logger_name).setLevel(level)
+
+
+# Уровни подсистем из settings действуют уже при импорте модулей:
+# по ним декоратор Log решает, оборачивать ли функцию.
+apply_levels(parse_levels(LOGGING_LEVELS))
+
+
+def configure_logging(levels: str = None, json_format: bool = None) -> None:
+    """ Функция меняет настройки журналов, заданные в settings.
+    :param levels: Строка уровней для parse_levels, None - не менять.
+    :param json_format: Писать файл журнала в JSON, None - не менять. """
+    global json_output
+    if levels:
+        apply_levels(parse_levels(levels))
+    if json_format is not None:
+        json_output = json_format
+        for _, file_handler in pipelines.values():
+            file_handler.setFormatter(file_formatter())
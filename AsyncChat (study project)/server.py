@@ -8,10 +8,16 @@ from PyQt5.QtCore import Qt
 from common.decorators import Log
 from server.core import MessageProcessor
 from PyQt5.QtWidgets import QApplication
-from common.settings import DEFAULT_PORT
+from server.async_core import AsyncMessageProcessor
+from server.cluster import start_workers, stop_workers
+from common.settings import DEFAULT_PORT, SERVER_ENGINES, DEFAULT_SERVER_ENGINE, \
+    OUTBOUND_HIGH_WATERMARK, OUTBOUND_LOW_WATERMARK, DEFAULT_WORKERS, LOGGING_LEVELS, LOGGING_JSON, \
+    METRICS_ADDRESS, METRICS_PORT
 from server.database import ServerStorage
+from server.metrics import start_metrics_server
 from server.main_window import MainWindow
 from logs.config_server_log import create_server_logger
+from logs.log_pipeline import configure_logging, parse_levels
 
 
 # Инициализация логгера для сервера.
@@ -19,24 +25,45 @@ SERVER_LOGGER = create_server_logger()
 
 
 @Log(SERVER_LOGGER)
-def get_arg_commandline(default_port: str, default_address: str) -> tuple:
+def get_arg_commandline(default_port: str, default_address: str, default_engine: str,
+                        default_workers: int) -> tuple:
     """ Создаём парсер аргументов командной строки
-    и читаем параметры, возвращаем 3 параметра.
+    и читаем параметры, возвращаем 8 параметров.
     :param default_port: Порты, с которых сервер принимает соединение.
     :param default_address: Ip-адрес сервера.
-    :return: Возвращается кортеж из IP-адреса, порта, флага для графического интерфейса. """
+    :param default_engine: Движок сервера из файла конфигурации.
+    :param default_workers: Количество процессов-обработчиков из файла конфигурации.
+    :return: Возвращается кортеж из IP-адреса, порта, флага для графического интерфейса,
+             названия движка сервера, количества процессов-обработчиков, уровней
+             журналов, флага записи журнала в JSON и порта метрик
+             (None - из файла конфигурации). """
     SERVER_LOGGER.debug(
-        f'Инициализация парсера аргументов коммандной строки: {sys.argv}')
+        'Инициализация парсера аргументов коммандной строки: %s', sys.argv)
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', default=default_port, type=int, nargs='?')
     parser.add_argument('-a', default=default_address, nargs='?')
     parser.add_argument('--no_gui', action='store_true')
+    parser.add_argument('--engine', default=default_engine, choices=SERVER_ENGINES)
+    parser.add_argument('--workers', default=default_workers, type=int)
+    # Уровни журналов, например INFO,server.core=DEBUG.
+    parser.add_argument('--log_level', default=None)
+    parser.add_argument('--log_json', action='store_true', default=None)
+    # Порт HTTP-сервера метрик, 0 - не запускать.
+    parser.add_argument('--metrics_port', default=None, type=int)
     namespace = parser.parse_args(sys.argv[1:])
+    if namespace.log_level:
+        try:
+            parse_levels(namespace.log_level)
+        except ValueError as err:
+            parser.error(str(err))
     listen_address = namespace.a
     listen_port = namespace.p
     gui_flag = namespace.no_gui
+    engine = namespace.engine
+    workers = namespace.workers
     SERVER_LOGGER.debug('Аргументы успешно загружены.')
-    return listen_address, listen_port, gui_flag
+    return listen_address, listen_port, gui_flag, engine, workers, namespace.log_level, \
+        namespace.log_json, namespace.metrics_port
 
 @Log(SERVER_LOGGER)
 def config_load() -> configparser.ConfigParser:
@@ -55,6 +82,12 @@ def config_load() -> configparser.ConfigParser:
         config.set('SETTINGS', 'Listen_Address', '')
         config.set('SETTINGS', 'Database_path', '')
         config.set('SETTINGS', 'Database_file', 'server_database.db3')
+        config.set('SETTINGS', 'Engine', DEFAULT_SERVER_ENGINE)
+        config.set('SETTINGS', 'Workers', str(DEFAULT_WORKERS))
+        config.set('SETTINGS', 'Outbound_high_watermark', str(OUTBOUND_HIGH_WATERMARK))
+        config.set('SETTINGS', 'Outbound_low_watermark', str(OUTBOUND_LOW_WATERMARK))
+        config.set('SETTINGS', 'Metrics_address', METRICS_ADDRESS)
+        config.set('SETTINGS', 'Metrics_port', str(METRICS_PORT))
         return config
 
 @Log(SERVER_LOGGER)
@@ -65,18 +98,60 @@ def main() -> None:
 
     # Загрузка параметров командной строки, если нет параметров,
     # то задаются значения по умоланию из файла конфигурации.
-    listen_address, listen_port, gui_flag = get_arg_commandline(config['SETTINGS']['Default_port'],
-                                                                config['SETTINGS']['Listen_Address'])
+    listen_address, listen_port, gui_flag, engine, workers, log_levels, log_json, metrics_port = get_arg_commandline(
+        config['SETTINGS']['Default_port'],
+        config['SETTINGS']['Listen_Address'],
+        config['SETTINGS'].get('Engine', DEFAULT_SERVER_ENGINE),
+        config['SETTINGS'].getint('Workers', DEFAULT_WORKERS))
+
+    # Уровни и формат журналов: командная строка, затем файл конфигурации.
+    if log_levels is None:
+        log_levels = config['SETTINGS'].get('Log_levels', LOGGING_LEVELS)
+    if log_json is None:
+        log_json = config['SETTINGS'].getboolean('Log_json', LOGGING_JSON)
+    configure_logging(log_levels, log_json)
+
+    # Адрес и порт HTTP-сервера метрик: командная строка, затем файл конфигурации.
+    metrics_address = config['SETTINGS'].get('Metrics_address', METRICS_ADDRESS)
+    if metrics_port is None:
+        metrics_port = config['SETTINGS'].getint('Metrics_port', METRICS_PORT)
 
     # Инициализация базы данных.
     path_to_database = os.path.join(config['SETTINGS']['Database_path'],
                                     config['SETTINGS']['Database_file'])
     database = ServerStorage(path_to_database)
 
-    # Создание экземпляра класса - сервера и его запуск:
-    server = MessageProcessor(listen_address, listen_port, database)
+    # Границы исходящих буферов клиентов.
+    high_watermark = config['SETTINGS'].getint('Outbound_high_watermark', OUTBOUND_HIGH_WATERMARK)
+    low_watermark = config['SETTINGS'].getint('Outbound_low_watermark', OUTBOUND_LOW_WATERMARK)
+
+    # Многопроцессный режим: процессы-обработчики на asyncio делят один порт,
+    # сообщения между ними передаются по шине. Работает без GUI,
+    # т.к. подключённые пользователи распределены по процессам.
+    if workers > 1:
+        processes, stop_event, run_dir = start_workers(workers, listen_address, listen_port,
+                                                       path_to_database, high_watermark, low_watermark,
+                                                       log_levels, log_json, metrics_address, metrics_port)
+        while True:
+            command = input('Введите exit для завершения работы сервера.')
+            if command == 'exit':
+                stop_workers(processes, stop_event, run_dir)
+                break
+        database.close()
+        return
+
+    # Создание экземпляра класса - сервера и его запуск.
+    # Движок asyncio обслуживает соединения задачами цикла событий,
+    # движок select - опросом сокетов в отдельном потоке.
+    if engine == 'asyncio':
+        server = AsyncMessageProcessor(listen_address, listen_port, database,
+                                       high_watermark, low_watermark)
+    else:
+        server = MessageProcessor(listen_address, listen_port, database,
+                                  high_watermark, low_watermark)
     server.daemon = True
     server.start()
+    metrics_server = start_metrics_server(metrics_address, metrics_port) if metrics_port else None
 
     # Если указан параметр без GUI, то запускаем простенький обработчик
     # консольного ввода
@@ -101,6 +176,12 @@ def main() -> None:
 
         # По закрытию окон останавливаем обработчик сообщений
         server.running = False
+        server.join()
+
+    if metrics_server is not None:
+        metrics_server.stop()
+    # Записываем накопленные счётчики сообщений и закрываем базу.
+    database.close()
 
 
 if __name__ == '__main__':
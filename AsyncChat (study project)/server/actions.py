@@ -0,0 +1,37 @@
+from common.settings import ACTION
+
+
+class Action:
+    """ Описание обработчика одного действия протокола JIM.
+    Набор обязательных полей собирается один раз при регистрации,
+    поэтому проверка сообщения - одно сравнение множеств ключей
+    и, если задано поле владельца, один поиск в реестре сессий. """
+    __slots__ = ('name', 'handler', 'required', 'owner')
+
+    def __init__(self, name: str, handler, required: tuple = (), owner: str = None):
+        """
+        :param name: Значение поля ACTION.
+        :param handler: Функция handler(processor, message, client).
+        :param required: Поля, которые должны быть в сообщении.
+        :param owner: Поле с именем пользователя, которое должно совпадать
+                      с пользователем, авторизованным на соединении.
+                      None - проверка не выполняется.
+        """
+        self.name = name
+        self.handler = handler
+        fields = {ACTION, *required}
+        if owner is not None:
+            fields.add(owner)
+        self.required = frozenset(fields)
+        self.owner = owner
+
+    def accepts(self, message: dict, client, names) -> bool:
+        """ Проверяет, что сообщение содержит все обязательные поля
+        и отправлено от имени пользователя этого соединения.
+        :param message: Сообщение от клиента.
+        :param client: Соединение клиента.
+        :param names: Реестр сессий сервера.
+        """
+        if not message.keys() >= self.required:
+            return False
+        return self.owner is None or names.name_of(client) == message[self.owner]
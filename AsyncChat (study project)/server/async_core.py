@@ -0,0 +1,325 @@
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.append('../')
+from server.core import MessageProcessor
+from server.database import ServerStorage
+from server.sessions import PendingAuth
+from server.metrics import MESSAGES, BYTES_RECEIVED, BYTES_SENT, AUTH_SECONDS
+from common.settings import *
+from common.utils import decode_message, FRAME_HEADER
+from logs.config_server_log import create_server_logger
+from common.exceptions import IncorrectDataRecivedError, NonDictInputError, OutboundOverflowError
+
+# Загрузка логгера.
+logger = create_server_logger('async_core')
+
+
+async def read_payload(reader: asyncio.StreamReader) -> bytes | None:
+    """ Читает один кадр: заголовок длины и JSON.
+    Буферизацию частичных и склеенных кадров выполняет StreamReader.
+    :param reader: Поток чтения соединения.
+    :return: JSON кадра без заголовка или None, если соединение закрыто. """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        frame_length, = FRAME_HEADER.unpack(header)
+        if frame_length > MAX_FRAME_LENGTH:
+            raise IncorrectDataRecivedError
+        return await reader.readexactly(frame_length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    """ Читает и декодирует один кадр.
+    :param reader: Поток чтения соединения.
+    :return: Словарь-сообщение или None, если соединение закрыто. """
+    payload = await read_payload(reader)
+    return None if payload is None else decode_message(payload)
+
+
+class StreamConnection:
+    """ Обёртка над парой StreamReader/StreamWriter, повторяющая
+    интерфейс сокета, которым пользуются MessageProcessor и
+    утилиты common.utils (send, getpeername, close). """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 loop: asyncio.AbstractEventLoop, loop_thread_id: int):
+        """
+        :param reader: Поток чтения соединения.
+        :param writer: Поток записи соединения.
+        :param loop: Цикл событий, которому принадлежит соединение.
+        :param loop_thread_id: Идентификатор потока, в котором работает цикл событий.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread_id = loop_thread_id
+        self.peername = writer.get_extra_info('peername')
+        self.closed = False
+        # Согласована ли передача кадрами с заголовком длины.
+        self.framed = False
+
+    def getpeername(self) -> tuple:
+        """ Адрес удалённой стороны, как у socket.getpeername(). """
+        return self.peername
+
+    def fileno(self) -> int:
+        """ Файловый дескриптор сокета соединения. """
+        sock = self.writer.get_extra_info('socket')
+        return sock.fileno() if sock is not None else -1
+
+    def send(self, data: bytes) -> int:
+        """ Ставит байты в буфер записи транспорта. Запись неблокирующая,
+        поэтому метод можно вызывать из обработчиков сообщений.
+        Вызов из другого потока (например, из GUI) передаётся в цикл событий.
+        :param data: Байты для отправки.
+        :return: Количество принятых к отправке байт. """
+        if self.closed or self.writer.is_closing():
+            raise ConnectionResetError('Соединение закрыто.')
+        if self.in_loop_thread():
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+        return len(data)
+
+    # Запись в транспорт всегда принимает данные целиком.
+    sendall = send
+
+    def close(self) -> None:
+        """ Закрывает соединение. Если в буфере записи осталось больше
+        нижней границы (клиент не забирает данные), соединение
+        разрывается сразу, не дожидаясь отправки буфера. """
+        if self.closed:
+            return
+        self.closed = True
+        if self.in_loop_thread():
+            self.shutdown()
+        else:
+            self.loop.call_soon_threadsafe(self.shutdown)
+
+    def shutdown(self) -> None:
+        """ Закрытие транспорта в потоке цикла событий. """
+        transport = self.writer.transport
+        low_watermark, _ = transport.get_write_buffer_limits()
+        if transport.get_write_buffer_size() > low_watermark:
+            transport.abort()
+        else:
+            self.writer.close()
+
+    def in_loop_thread(self) -> bool:
+        """ Проверяет, выполняется ли вызов в потоке цикла событий. """
+        return self.loop_thread_id == threading.get_ident()
+
+
+class AsyncMessageProcessor(MessageProcessor):
+    """ Серверный движок на asyncio. Каждое соединение обслуживается
+    собственной задачей-читателем, поэтому доставка сообщения зависит
+    только от сети, а не от интервала опроса сокетов.
+    Протокол JIM, обработчики сообщений и работа с ServerStorage
+    унаследованы от MessageProcessor без изменений. """
+    backlog = ASYNC_BACKLOG
+
+    def __init__(self, listen_address: str, listen_port: int, database: ServerStorage,
+                 high_watermark: int = OUTBOUND_HIGH_WATERMARK,
+                 low_watermark: int = OUTBOUND_LOW_WATERMARK):
+        """
+        :param listen_address: IP-адрес для прослушивания.
+        :param listen_port: Порты для прослушивания.
+        :param database: Объект базы данных сервера.
+        :param high_watermark: Верхняя граница исходящего буфера клиента в байтах.
+        :param low_watermark: Нижняя граница исходящего буфера клиента в байтах.
+        """
+        super().__init__(listen_address, listen_port, database, high_watermark, low_watermark)
+        self.loop = None
+        self.loop_thread_id = None
+        self.server = None
+        # Задачи-читатели подключённых клиентов.
+        self.reader_tasks = set()
+        # Для совместимости с process_message: при работе через asyncio
+        # в запись готовы все подключённые клиенты.
+        self.listen_sockets = self.clients
+
+    def run(self):
+        """ Запускает цикл событий в потоке сервера. """
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread_id = threading.get_ident()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    async def serve(self) -> None:
+        """ Основная корутина сервера: принимает соединения
+        и ожидает сброса флага running. """
+        self.init_socket()
+        self.sock.setblocking(False)
+        self.server = await asyncio.start_server(self.handle_connection, sock=self.sock,
+                                                 limit=ASYNC_STREAM_LIMIT)
+        async with self.server:
+            # Флаг running сбрасывается из другого потока (GUI или консоль),
+            # поэтому периодически проверяем его. На доставку сообщений
+            # этот интервал не влияет.
+            while self.running:
+                await asyncio.sleep(ASYNC_SHUTDOWN_CHECK_INTERVAL)
+                self.drop_slow_clients()
+                self.database.flush_counters_if_due()
+            for client in list(self.clients):
+                client.close()
+            # После закрытия соединений задачи-читатели получают EOF
+            # и завершаются сами, дожидаемся их.
+            if self.reader_tasks:
+                await asyncio.wait(list(self.reader_tasks), timeout=SHUTDOWN_TIMEOUT)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Задача-читатель одного соединения.
+        :param reader: Поток чтения соединения.
+        :param writer: Поток записи соединения. """
+        client = StreamConnection(reader, writer, self.loop, self.loop_thread_id)
+        writer.transport.set_write_buffer_limits(self.high_watermark, self.low_watermark)
+        logger.info('Установлено соединение с ПК %s', client.getpeername())
+        self.clients.add(client)
+        self.reader_tasks.add(asyncio.current_task())
+        try:
+            while self.running and not client.closed:
+                # Пока клиент не забрал ответы (буфер выше верхней границы),
+                # новые запросы от него не читаем.
+                await writer.drain()
+                message_from_client = await self.read_message(client)
+                if message_from_client is None:
+                    break
+                logger.debug('Получено сообщение от клиента: %s', message_from_client)
+                # Авторизация ждёт ответа клиента, поэтому выполняется
+                # корутиной, а не обработчиком из таблицы действий.
+                if message_from_client.get(ACTION) == PRESENCE \
+                        and self.actions[PRESENCE].accepts(message_from_client, client, self.names):
+                    MESSAGES.inc((PRESENCE,))
+                    await self.async_authorization(message_from_client, client)
+                else:
+                    self.process_client_message(message_from_client, client)
+        # ValueError включает ошибки JSON и UnicodeDecodeError при неверной кодировке.
+        except (OSError, ValueError, TypeError, KeyError,
+                asyncio.TimeoutError, IncorrectDataRecivedError, NonDictInputError) as err:
+            logger.debug('Getting data from client exception.', exc_info=err)
+        finally:
+            # Клиент удаляется при любом завершении задачи, в том числе
+            # при непредусмотренном исключении и отмене задачи.
+            if client in self.clients:
+                self.remove_client(client)
+            self.reader_tasks.discard(asyncio.current_task())
+
+    async def read_message(self, client: StreamConnection, timeout: float = None) -> dict | None:
+        """ Читает одно сообщение из соединения.
+        :param client: Соединение клиента.
+        :param timeout: Таймаут ожидания в секундах, None - без ограничения.
+        :return: Словарь-сообщение или None, если соединение закрыто. """
+        if client.framed:
+            data = await asyncio.wait_for(read_payload(client.reader), timeout)
+            if data is None:
+                return None
+            BYTES_RECEIVED.inc(amount=FRAME_HEADER.size + len(data))
+        else:
+            data = await asyncio.wait_for(client.reader.read(MAX_PACKAGE_LENGTH), timeout)
+            if not data:
+                return None
+            BYTES_RECEIVED.inc(amount=len(data))
+        return decode_message(data)
+
+    async def async_authorization(self, message: dict, client: StreamConnection) -> None:
+        """ Авторизация пользователя без блокировки цикла событий:
+        пока клиент отвечает на запрос 511, остальные соединения обслуживаются.
+        :param message: Сообщение о присутствии от клиента.
+        :param client: Соединение клиента. """
+        started = time.monotonic()
+        if not self.auth_precheck(message, client):
+            return
+        message_auth, digest = self.auth_challenge(message)
+        self.send_to(client, message_auth)
+        if message_auth.get(FRAMING) == FRAMING_LENGTH:
+            self.enable_framing(client)
+        # Пока ждём ответа, имя считается занятым этим соединением.
+        self.pending_auth[client] = PendingAuth(message, digest, started, started + AUTH_TIMEOUT)
+        try:
+            answer = await self.read_message(client, AUTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            AUTH_SECONDS.observe(time.monotonic() - started, ('timeout',))
+            raise
+        finally:
+            self.pending_auth.pop(client, None)
+        if answer is None:
+            client.close()
+            return
+        self.auth_complete(message, client, answer, digest)
+        self.auth_finished(message, client, started)
+
+    def enqueue(self, client: StreamConnection, data: bytes) -> None:
+        """ Добавление байтов в буфер записи транспорта. Транспорт сам
+        досылает данные, когда сокет готов к записи; здесь только
+        отслеживается перегрузка клиента.
+        :param client: Соединение клиента.
+        :param data: Байты для отправки.
+        :raises OutboundOverflowError: Буфер клиента превысил OUTBOUND_MAX_BUFFER. """
+        if not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.enqueue_or_remove, client, data)
+            return
+        if self.pending_bytes(client) + len(data) > OUTBOUND_MAX_BUFFER:
+            logger.error('Исходящий буфер клиента %s переполнен, соединение закрывается.',
+                         client.getpeername())
+            raise OutboundOverflowError
+        client.send(data)
+        BYTES_SENT.inc(amount=len(data))
+        self.update_congestion(client)
+
+    def enqueue_or_remove(self, client: StreamConnection, data: bytes) -> None:
+        """ Добавление байтов в буфер по вызову из другого потока.
+        Вызывающему ошибку уже не передать, поэтому при переполнении
+        буфера клиент отключается здесь же. """
+        try:
+            self.enqueue(client, data)
+        except OSError:
+            self.remove_client(client)
+
+    def pending_bytes(self, client: StreamConnection) -> int:
+        """ Количество неотправленных клиенту байтов в буфере транспорта. """
+        if client.closed:
+            return 0
+        return client.writer.transport.get_write_buffer_size()
+
+    def is_framed(self, client: StreamConnection) -> bool:
+        """ Проверяет, согласовал ли клиент передачу кадрами. """
+        return client.framed
+
+    def enable_framing(self, client: StreamConnection) -> None:
+        """ Переводит соединение клиента в режим передачи кадрами. """
+        client.framed = True
+
+    def call_soon(self, callback, *args) -> None:
+        """ Вызов из другого потока передаётся в цикл событий. """
+        if self.loop is None:
+            super().call_soon(callback, *args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def in_loop_thread(self) -> bool:
+        """ Проверяет, что вызов выполняется в потоке цикла событий,
+        либо что цикл событий уже остановлен. """
+        return self.loop is None or not self.loop.is_running() \
+            or self.loop_thread_id == threading.get_ident()
+
+    def remove_client(self, client: StreamConnection) -> None:
+        """ Удаление клиента. Вызов из потока GUI передаётся в цикл событий. """
+        if not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.remove_client, client)
+            return
+        if client in self.clients:
+            super().remove_client(client)
+
+    def service_update_lists(self) -> None:
+        """ Рассылка сообщения 205, вызов из потока GUI передаётся в цикл событий. """
+        if not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.service_update_lists)
+            return
+        super().service_update_lists()
@@ -0,0 +1,450 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import asyncio
+import tempfile
+import multiprocessing
+
+sys.path.append('../')
+from server.async_core import AsyncMessageProcessor, StreamConnection, read_frame
+from server.database import ServerStorage
+from common.settings import *
+from common.utils import encode_message
+from logs.config_server_log import create_server_logger
+from logs.log_pipeline import configure_logging
+from server.metrics import start_metrics_server
+from common.exceptions import IncorrectDataRecivedError
+
+# Загрузка логгера.
+logger = create_server_logger('cluster')
+
+
+class ClusterBus:
+    """ Шина маршрутизации между процессами-обработчиками.
+    Каждый обработчик слушает свой Unix-сокет в общем каталоге
+    и держит исходящие соединения ко всем остальным обработчикам.
+    По шине передаются события присутствия пользователей и сообщения
+    для пользователей, подключённых к другому обработчику.
+    Сообщения шины передаются кадрами, как в режиме FRAMING_LENGTH. """
+
+    def __init__(self, worker_id: int, workers: int, run_dir: str, processor: 'ClusterMessageProcessor'):
+        """
+        :param worker_id: Номер текущего обработчика.
+        :param workers: Общее количество обработчиков.
+        :param run_dir: Каталог для Unix-сокетов шины.
+        :param processor: Обработчик сообщений текущего процесса.
+        """
+        self.worker_id = worker_id
+        self.workers = workers
+        self.run_dir = run_dir
+        self.processor = processor
+        self.server = None
+        # Исходящие соединения: номер обработчика -> StreamWriter.
+        self.peers = dict()
+        self.connect_tasks = dict()
+        # Входящие соединения от соседей: задача-читатель -> StreamWriter.
+        self.inbound = dict()
+        # Соседи, приславшие список своих пользователей (BUS_SYNC)
+        # по текущему входящему соединению.
+        self.synced_peers = set()
+
+    def socket_path(self, worker_id: int) -> str:
+        """ Путь до Unix-сокета обработчика. """
+        return os.path.join(self.run_dir, f'worker_{worker_id}.sock')
+
+    async def start(self) -> None:
+        """ Запускает приём соединений от соседей и подключение к ним. """
+        path = self.socket_path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.handle_peer, path=path)
+        for peer in range(self.workers):
+            if peer != self.worker_id:
+                self.schedule_connect(peer)
+
+    async def close(self) -> None:
+        """ Останавливает шину. """
+        for task in self.connect_tasks.values():
+            task.cancel()
+        for writer in self.peers.values():
+            writer.close()
+        self.peers.clear()
+        for writer in self.inbound.values():
+            writer.close()
+        if self.inbound:
+            await asyncio.wait(list(self.inbound), timeout=SHUTDOWN_TIMEOUT)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def synced(self) -> bool:
+        """ Шина синхронизирована: есть исходящие соединения ко всем соседям
+        и от каждого получен список его пользователей. До этого обработчик
+        не знает, кто подключён к соседям. """
+        return len(self.peers) == len(self.synced_peers) == self.workers - 1
+
+    def schedule_connect(self, peer: int) -> None:
+        """ Запускает (пере)подключение к соседу, если оно ещё не идёт. """
+        task = self.connect_tasks.get(peer)
+        if task is None or task.done():
+            self.connect_tasks[peer] = asyncio.ensure_future(self.connect(peer))
+
+    async def connect(self, peer: int) -> None:
+        """ Подключается к соседу, повторяя попытки, пока тот не запустится.
+        После подключения отправляет ему список своих пользователей.
+        :param peer: Номер обработчика. """
+        while self.processor.running:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path(peer))
+            except OSError:
+                await asyncio.sleep(CLUSTER_RECONNECT_INTERVAL)
+                continue
+            self.peers[peer] = writer
+            logger.info('Обработчик %s подключён к обработчику %s.', self.worker_id, peer)
+            self.send(peer, {BUS_EVENT: BUS_SYNC,
+                             WORKER_ID: self.worker_id,
+                             LIST_INFO: list(self.processor.names)})
+            self.processor.release_held()
+            return
+
+    def send(self, peer: int, message: dict) -> bool:
+        """ Отправляет сообщение шины соседу.
+        :param peer: Номер обработчика.
+        :param message: Сообщение шины.
+        :return: True, если сообщение поставлено в буфер отправки. """
+        writer = self.peers.get(peer)
+        if writer is None:
+            return False
+        if writer.is_closing():
+            del self.peers[peer]
+            self.schedule_connect(peer)
+            return False
+        writer.write(encode_message(message, True))
+        return True
+
+    def broadcast(self, message: dict) -> None:
+        """ Отправляет сообщение шины всем соседям. """
+        for peer in list(self.peers):
+            self.send(peer, message)
+
+    async def handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Читает сообщения шины от одного соседа.
+        Если сосед отключился, его пользователи считаются отключёнными. """
+        peer = None
+        self.inbound[asyncio.current_task()] = writer
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                peer = message.get(WORKER_ID, peer)
+                self.processor.handle_bus_message(message)
+        except (OSError, ValueError, KeyError, IncorrectDataRecivedError) as err:
+            logger.error('Ошибка шины обработчика %s.', self.worker_id, exc_info=err)
+        writer.close()
+        del self.inbound[asyncio.current_task()]
+        if peer is not None:
+            self.synced_peers.discard(peer)
+            self.processor.forget_worker(peer)
+
+
+class ClusterMessageProcessor(AsyncMessageProcessor):
+    """ Обработчик сообщений одного процесса в многопроцессном режиме.
+    Все процессы принимают подключения на одном порту (SO_REUSEPORT),
+    ядро распределяет между ними соединения. Сообщения для пользователей
+    другого процесса и изменения присутствия передаются через ClusterBus. """
+    reuse_port = True
+
+    def __init__(self, listen_address: str, listen_port: int, database: ServerStorage,
+                 worker_id: int, workers: int, run_dir: str,
+                 high_watermark: int = OUTBOUND_HIGH_WATERMARK,
+                 low_watermark: int = OUTBOUND_LOW_WATERMARK):
+        """
+        :param listen_address: IP-адрес для прослушивания.
+        :param listen_port: Порты для прослушивания.
+        :param database: Объект базы данных сервера.
+        :param worker_id: Номер текущего обработчика.
+        :param workers: Общее количество обработчиков.
+        :param run_dir: Каталог для Unix-сокетов шины.
+        :param high_watermark: Верхняя граница исходящего буфера клиента в байтах.
+        :param low_watermark: Нижняя граница исходящего буфера клиента в байтах.
+        """
+        super().__init__(listen_address, listen_port, database, high_watermark, low_watermark)
+        self.worker_id = worker_id
+        # Пользователи других обработчиков: имя -> номер обработчика.
+        self.remote_names = dict()
+        self.bus = ClusterBus(worker_id, workers, run_dir, self)
+        # Сообщения для пользователей, не найденных ни здесь, ни у соседей,
+        # пока шина не синхронизирована: (срок, сообщение, участники группы).
+        # Для сообщения пользователю список участников - None.
+        self.held = []
+        self.held_timer = None
+
+    async def serve(self) -> None:
+        """ Запускает шину, затем основной цикл asyncio-движка. """
+        await self.bus.start()
+        try:
+            await super().serve()
+        finally:
+            self.store_held()
+            await self.bus.close()
+
+    def is_online(self, username: str) -> bool:
+        """ Пользователь подключён к этому или другому обработчику. """
+        return username in self.names or username in self.remote_names
+
+    def forward(self, message: dict) -> bool:
+        """ Передаёт сообщение обработчику, к которому подключён получатель. """
+        worker = self.remote_names.get(message[DESTINATION])
+        if worker is None:
+            return False
+        return self.bus.send(worker, {BUS_EVENT: BUS_ROUTE,
+                                      WORKER_ID: self.worker_id,
+                                      MESSAGE: message})
+
+    def forward_group(self, message: dict, recipients: list[str]) -> list[str]:
+        """ Передаёт сообщение группе обработчикам, к которым подключены
+        участники. Участников, не найденных у соседей, до синхронизации
+        шины не считаем отключёнными: сообщение для них придерживается. """
+        missed = self.route_group(message, recipients)
+        if missed and not self.bus.synced():
+            self.hold(message, missed)
+            return []
+        return missed
+
+    def route_group(self, message: dict, recipients: list[str]) -> list[str]:
+        """ Передаёт сообщение группе обработчикам, к которым подключены
+        участники: одно сообщение шины на обработчик со списком участников.
+        :return: Логины участников, которым сообщение не передано. """
+        by_worker = dict()
+        missed = []
+        for username in recipients:
+            worker = self.remote_names.get(username)
+            if worker is None:
+                missed.append(username)
+            else:
+                by_worker.setdefault(worker, []).append(username)
+        for worker, usernames in by_worker.items():
+            if not self.bus.send(worker, {BUS_EVENT: BUS_GROUP_ROUTE,
+                                          WORKER_ID: self.worker_id,
+                                          MESSAGE: message,
+                                          LIST_INFO: usernames}):
+                missed.extend(usernames)
+        return missed
+
+    def store_offline(self, message: dict) -> bool:
+        """ Сохраняет сообщение для получателя не в сети. Пока шина
+        не синхронизирована, получатель может быть подключён к соседу,
+        о котором ещё нет сведений, поэтому сообщение придерживается. """
+        if self.bus.synced():
+            return super().store_offline(message)
+        if not self.database.check_user(message[DESTINATION]):
+            return False
+        self.hold(message)
+        return True
+
+    def hold(self, message: dict, recipients: list[str] = None) -> None:
+        """ Придерживает сообщение до синхронизации шины,
+        но не дольше CLUSTER_SYNC_TIMEOUT секунд.
+        :param message: Сообщение пользователю или группе.
+        :param recipients: Участники группы, None - сообщение пользователю. """
+        self.held.append((time.monotonic() + CLUSTER_SYNC_TIMEOUT, message, recipients))
+        if self.held_timer is None:
+            self.held_timer = self.loop.call_later(CLUSTER_SYNC_TIMEOUT, self.release_held)
+
+    def release_held(self) -> None:
+        """ Доставляет придержанные сообщения, если шина синхронизирована,
+        а сообщения с истёкшим сроком - в любом случае: получателям,
+        которых так и не нашли, сообщения сохраняются до подключения. """
+        if self.held_timer is not None:
+            self.held_timer.cancel()
+            self.held_timer = None
+        if not self.held:
+            return
+        synced = self.bus.synced()
+        now = time.monotonic()
+        held, self.held = self.held, []
+        for entry in held:
+            deadline, message, recipients = entry
+            if synced or deadline <= now:
+                self.deliver_held(message, recipients)
+            else:
+                self.held.append(entry)
+        if self.held:
+            self.held_timer = self.loop.call_later(self.held[0][0] - now, self.release_held)
+
+    def deliver_held(self, message: dict, recipients: list[str] | None) -> None:
+        """ Доставка придержанного сообщения по текущим сведениям шины. """
+        if recipients is not None:
+            offline = self.route_group(message, self.fan_out(message, recipients))
+            if offline:
+                self.database.store_group_message(offline, message)
+        elif message[DESTINATION] in self.names:
+            self.process_message(message)
+        elif not self.forward(message):
+            super().store_offline(message)
+
+    def store_held(self) -> None:
+        """ При остановке обработчика сохраняет придержанные сообщения до подключения получателей. """
+        if self.held_timer is not None:
+            self.held_timer.cancel()
+            self.held_timer = None
+        held, self.held = self.held, []
+        for _, message, recipients in held:
+            if recipients is not None:
+                self.database.store_group_message(recipients, message)
+            else:
+                super().store_offline(message)
+
+    def group_changed(self, name: str) -> None:
+        """ Сообщает соседям, что участники группы изменились. Соседи
+        перечитают группу из базы, поэтому сообщение отправляется после
+        записи изменений. Вызов из потока записи передаётся в цикл событий. """
+        if not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.group_changed, name)
+            return
+        future = self.database.pending_group_write(name)
+        if future is not None:
+            future.add_done_callback(lambda done: self.group_changed(name))
+            return
+        self.bus.broadcast({BUS_EVENT: BUS_GROUP_UPDATE,
+                            WORKER_ID: self.worker_id,
+                            GROUP: name})
+
+    def auth_complete(self, message: dict, sock: StreamConnection, answer: dict, digest: bytes) -> None:
+        """ После успешной авторизации сообщает соседям о новом пользователе. """
+        super().auth_complete(message, sock, answer, digest)
+        username = message[USER][ACCOUNT_NAME]
+        if self.names.get(username) is sock:
+            self.bus.broadcast({BUS_EVENT: BUS_JOIN,
+                                WORKER_ID: self.worker_id,
+                                ACCOUNT_NAME: username})
+
+    def remove_client(self, client: StreamConnection) -> None:
+        """ После отключения клиента сообщает соседям об уходе пользователя. """
+        if not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.remove_client, client)
+            return
+        username = self.names.name_of(client)
+        super().remove_client(client)
+        if username is not None and username not in self.names:
+            self.bus.broadcast({BUS_EVENT: BUS_LEAVE,
+                                WORKER_ID: self.worker_id,
+                                ACCOUNT_NAME: username})
+
+    def handle_bus_message(self, message: dict) -> None:
+        """ Обработка сообщения шины от соседнего обработчика.
+        :param message: Сообщение шины. """
+        event = message[BUS_EVENT]
+        worker = message[WORKER_ID]
+        # Пользователь, вошедший через другой обработчик, мог сменить ключ
+        # и контакты, поэтому его запись в справочнике базы устарела.
+        if event == BUS_SYNC:
+            for username in message[LIST_INFO]:
+                self.remote_names[username] = worker
+                self.database.forget_user(username)
+            self.bus.synced_peers.add(worker)
+            self.release_held()
+        elif event == BUS_JOIN:
+            self.remote_names[message[ACCOUNT_NAME]] = worker
+            self.database.forget_user(message[ACCOUNT_NAME])
+        elif event == BUS_LEAVE:
+            if self.remote_names.get(message[ACCOUNT_NAME]) == worker:
+                del self.remote_names[message[ACCOUNT_NAME]]
+        elif event == BUS_ROUTE:
+            routed = message[MESSAGE]
+            if routed[DESTINATION] in self.names:
+                self.process_message(routed)
+            elif not self.store_offline(routed):
+                logger.error('Пользователь %s не подключён к обработчику '
+                             '%s, доставка невозможна.', routed[DESTINATION], self.worker_id)
+        elif event == BUS_GROUP_ROUTE:
+            offline = self.fan_out(message[MESSAGE], message[LIST_INFO])
+            if offline:
+                self.database.store_group_message(offline, message[MESSAGE])
+        elif event == BUS_GROUP_UPDATE:
+            self.database.forget_group(message[GROUP])
+
+    def forget_worker(self, worker: int) -> None:
+        """ Удаляет пользователей отключившегося обработчика. """
+        for username in [name for name, owner in self.remote_names.items() if owner == worker]:
+            del self.remote_names[username]
+
+
+def run_worker(worker_id: int, workers: int, run_dir: str, listen_address: str, listen_port: int,
+               database_path: str, high_watermark: int, low_watermark: int,
+               log_levels: str, log_json: bool, metrics_address: str, metrics_port: int,
+               stop_event: multiprocessing.Event) -> None:
+    """ Точка входа процесса-обработчика.
+    Работает до установки stop_event родительским процессом. """
+    # Процесс запущен заново (spawn): настройки журналов родителя не унаследованы.
+    configure_logging(log_levels, log_json)
+    # Активных пользователей очистил родительский процесс до запуска обработчиков,
+    # обработчик, запущенный позже соседей, не должен удалять их записи.
+    database = ServerStorage(database_path, clear_active=False)
+    server = ClusterMessageProcessor(listen_address, listen_port, database,
+                                     worker_id, workers, run_dir,
+                                     high_watermark, low_watermark)
+    server.daemon = True
+    server.start()
+    # Метрики у каждого процесса свои, обработчик N отдаёт их на порту metrics_port + N.
+    metrics_server = start_metrics_server(metrics_address, metrics_port + worker_id) \
+        if metrics_port else None
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    server.running = False
+    server.join()
+    if metrics_server is not None:
+        metrics_server.stop()
+    database.close()
+
+
+def start_workers(workers: int, listen_address: str, listen_port: int, database_path: str,
+                  high_watermark: int = OUTBOUND_HIGH_WATERMARK,
+                  low_watermark: int = OUTBOUND_LOW_WATERMARK,
+                  log_levels: str = LOGGING_LEVELS, log_json: bool = LOGGING_JSON,
+                  metrics_address: str = METRICS_ADDRESS, metrics_port: int = METRICS_PORT) -> tuple:
+    """ Запускает процессы-обработчики на общем порту.
+    :param workers: Количество процессов.
+    :param listen_address: IP-адрес для прослушивания.
+    :param listen_port: Порт для прослушивания.
+    :param database_path: Путь до файла базы данных.
+    :param high_watermark: Верхняя граница исходящего буфера клиента в байтах.
+    :param low_watermark: Нижняя граница исходящего буфера клиента в байтах.
+    :param log_levels: Уровни журналов процессов, см. LOGGING_LEVELS.
+    :param log_json: Писать журнал в формате JSON.
+    :param metrics_address: IP-адрес HTTP-сервера метрик.
+    :param metrics_port: Порт метрик первого обработчика, 0 - метрики не отдаются.
+    :return: Кортеж из списка процессов, события остановки и каталога шины. """
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Многопроцессный режим требует поддержки SO_REUSEPORT и Unix-сокетов.')
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    run_dir = tempfile.mkdtemp(prefix='async_chat_')
+    processes = []
+    for worker_id in range(workers):
+        process = context.Process(target=run_worker,
+                                  args=(worker_id, workers, run_dir, listen_address, listen_port,
+                                        database_path, high_watermark, low_watermark,
+                                        log_levels, log_json, metrics_address, metrics_port,
+                                        stop_event),
+                                  name=f'worker_{worker_id}',
+                                  daemon=True)
+        process.start()
+        processes.append(process)
+    logger.info('Запущено обработчиков: %s, каталог шины: %s.', workers, run_dir)
+    return processes, stop_event, run_dir
+
+
+def stop_workers(processes: list, stop_event: multiprocessing.Event, run_dir: str) -> None:
+    """ Останавливает процессы-обработчики и удаляет каталог шины. """
+    stop_event.set()
+    for process in processes:
+        process.join(SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+    shutil.rmtree(run_dir, ignore_errors=True)
@@ -1,7 +1,8 @@
 import os
 import sys
-import json
 import hmac
+import time
+import queue
 import select
 import socket
 import binascii
@@ -9,15 +10,19 @@ import threading
 
 sys.path.append('../')
 from server.database import ServerStorage
+from server.actions import Action
+from server.sessions import SessionRegistry, PendingAuth
 from common.settings import *
 from common.descriptors import Port
 from common.decorators import LoginRequired
-from common.utils import send_message, get_message
+from common.utils import decode_message, encode_message, MessageReader
+from server.metrics import MESSAGES, BYTES_RECEIVED, BYTES_SENT, AUTH_SECONDS, CONNECTED_CLIENTS, \
+    AUTHORIZED_USERS, OUTBOUND_BYTES, OUTBOUND_MAX_BYTES, CONGESTED_CLIENTS
 from logs.config_server_log import create_server_logger
-from common.exceptions import IncorrectDataRecivedError, NonDictInputError
+from common.exceptions import IncorrectDataRecivedError, NonDictInputError, OutboundOverflowError
 
 # Загрузка логгера.
-logger = create_server_logger()
+logger = create_server_logger('core')
 
 
 class MessageProcessor(threading.Thread):
@@ -27,12 +32,22 @@ class MessageProcessor(threading.Thread):
     # Работает в качестве отдельного потока.
     # """
     port = Port()
+    # Длина очереди ожидающих подключений для listen().
+    backlog = MAX_CONNECTIONS
+    # Разрешить нескольким процессам слушать один порт (SO_REUSEPORT).
+    reuse_port = False
 
-    def __init__(self, listen_address: str, listen_port: int, database: ServerStorage):
+    def __init__(self, listen_address: str, listen_port: int, database: ServerStorage,
+                 high_watermark: int = OUTBOUND_HIGH_WATERMARK,
+                 low_watermark: int = OUTBOUND_LOW_WATERMARK):
         """
         :param listen_address: IP-адрес для прослушивания.
         :param listen_port: Порты для прослушивания.
         :param database: Объект базы данных сервера.
+        :param high_watermark: Размер исходящего буфера клиента в байтах,
+                               выше которого клиент считается перегруженным.
+        :param low_watermark: Размер исходящего буфера клиента в байтах,
+                              ниже которого перегрузка снимается.
         """
         # Вызываем конструкторы предков
         threading.Thread.__init__(self)
@@ -47,310 +62,801 @@ class MessageProcessor(threading.Thread):
         self.error_sockets = None
         # Флаг продолжения работы основного цикла.
         self.running = True
-        # Словарь содержащий сопоставленные имена и соответствующие им сокеты.
-        self.names = dict()
-        # Список подключённых клиентов.
-        self.clients = list()
+        # Реестр сессий: имя -> сокет, с обратным индексом сокет -> имя.
+        self.names = SessionRegistry()
+        # Множество подключённых клиентов.
+        self.clients = set()
+        # Буферы приёма клиентов, согласовавших передачу кадрами.
+        self.readers = dict()
+        # Границы исходящих буферов клиентов.
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        # Исходящие буферы: сокет -> ещё не отправленные байты.
+        # Содержит только клиентов, у которых есть что отправить.
+        self.outbound = dict()
+        # Перегруженные клиенты: сокет -> время превышения верхней границы.
+        self.congested = dict()
+        # Клиенты, которым отправлен запрос 511: сокет -> PendingAuth.
+        self.pending_auth = dict()
+        # Номер обрабатываемого запроса клиента, возвращается в ответе.
+        self.request_id = None
+        # Вызовы, переданные из других потоков (например, по завершении
+        # команды потока записи базы): (функция, аргументы).
+        self.completions = queue.SimpleQueue()
+        # Пара сокетов, пробуждающая select при новом вызове в completions.
+        self.wakeup = None
 
     def run(self):
         """ Основной цикл программы сервера. """
         # Инициализация Сокета.
         self.init_socket()
+        self.wakeup = socket.socketpair()
+        for wakeup_socket in self.wakeup:
+            wakeup_socket.setblocking(False)
 
         # Основной цикл программы сервера.
         while self.running:
-            # Ждём подключения, если таймаут вышел, ловим исключение.
-            try:
-                client, client_address = self.sock.accept()
-            except OSError as er:
-                pass
-            else:
-                logger.info(f'Установлено соединение с ПК {client_address}')
-                client.settimeout(5)
-                self.clients.append(client)
-
             recv_data_lst = []
-            # send_data_lst = []
+            self.listen_sockets = []
             # err_lst = []
-            # Проверяем на наличие ждущих клиентов
+            # Ждём новых подключений и данных от клиентов в одном select,
+            # чтобы сообщения обрабатывались сразу после приёма. Клиентов
+            # с переполненным исходящим буфером не читаем, пока они не заберут
+            # ответы. На запись проверяем только тех, у кого есть неотправленные данные.
             try:
-                if self.clients:
-                    recv_data_lst, self.listen_sockets, self.error_sockets = select.select(
-                        self.clients, self.clients, [], 0)
+                recv_data_lst, self.listen_sockets, self.error_sockets = select.select(
+                    [self.sock, self.wakeup[0]] + [client for client in self.clients
+                                                   if client not in self.congested],
+                    list(self.outbound), [], SERVER_POLL_INTERVAL)
             except OSError as err:
-                logger.error(f'Ошибка работы с сокетами: {err.errno}')
+                logger.error('Ошибка работы с сокетами: %s', err.errno)
+
+            if self.wakeup[0] in recv_data_lst:
+                recv_data_lst.remove(self.wakeup[0])
+                try:
+                    self.wakeup[0].recv(MAX_PACKAGE_LENGTH)
+                except BlockingIOError:
+                    pass
+
+            if self.sock in recv_data_lst:
+                recv_data_lst.remove(self.sock)
+                try:
+                    client, client_address = self.sock.accept()
+                except OSError as er:
+                    pass
+                else:
+                    logger.info('Установлено соединение с ПК %s', client_address)
+                    client.settimeout(CLIENT_SOCKET_TIMEOUT)
+                    self.clients.add(client)
+
+            # Досылаем данные клиентам, готовым к записи.
+            for client_ready in self.listen_sockets:
+                try:
+                    self.flush_outbound(client_ready)
+                except OSError as err:
+                    logger.debug('Sending data to client exception.', exc_info=err)
+                    self.remove_client(client_ready)
 
             # Принимаем сообщения и если ошибка, исключаем клиента.
             if recv_data_lst:
                 for client_with_message in recv_data_lst:
+                    # Клиент мог быть отключён при обработке предыдущих сообщений.
+                    if client_with_message not in self.clients:
+                        continue
                     try:
-                        message_from_client = get_message(client_with_message)
-                        logger.debug(f'Получено сообщение от клиента: {message_from_client}')
-                        self.process_client_message(message_from_client, client_with_message)
-                    except (OSError, json.JSONDecodeError, TypeError,
+                        for message_from_client in self.receive_messages(client_with_message):
+                            logger.debug('Получено сообщение от клиента: %s', message_from_client)
+                            self.handle_client_message(message_from_client, client_with_message)
+                            if client_with_message not in self.clients:
+                                break
+                    # ValueError включает ошибки JSON и UnicodeDecodeError при неверной
+                    # кодировке: ошибка одного клиента не должна останавливать сервер.
+                    except (OSError, ValueError, TypeError,
                             IncorrectDataRecivedError, NonDictInputError) as err:
-                        logger.debug(f'Getting data from client exception.', exc_info=err)
+                        logger.debug('Getting data from client exception.', exc_info=err)
                         self.remove_client(client_with_message)
 
+            # Выполняем вызовы, переданные из других потоков.
+            self.run_completions()
+            # Отключаем клиентов, которые слишком долго не забирают данные
+            # или не ответили на запрос авторизации.
+            self.drop_slow_clients()
+            self.expire_auth()
+            # Записываем в базу накопленные счётчики сообщений.
+            self.database.flush_counters_if_due()
+
+    def call_soon(self, callback, *args) -> None:
+        """ Метод передаёт вызов callback(*args) в поток сервера.
+        Вызывается из других потоков, например из обратного вызова
+        Future потока записи базы: сокеты клиентов трогает только
+        поток сервера, и он не ждёт базу.
+        :param callback: Функция, выполняемая в потоке сервера.
+        :param args: Аргументы функции. """
+        self.completions.put((callback, args))
+        if self.wakeup is not None:
+            try:
+                self.wakeup[1].send(b'\0')
+            except OSError:
+                # Буфер пары полон: select и так будет разбужен.
+                pass
+
+    def run_completions(self) -> None:
+        """ Метод выполняет вызовы, переданные через call_soon. """
+        while True:
+            try:
+                callback, args = self.completions.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
     def remove_client(self, client: socket.socket) -> None:
         """ Метод-обработчик клиента с которым прервана связь.
         Ищет клиента и удаляет его из списков и базы. """
-        logger.info(f'Клиент {client.getpeername()} отключился от сервера.')
-        for name in self.names:
-            # Ищем клиента в словаре клиентов.
-            if self.names[name] == client:
-                # удаляем его из него и базы подключённых.
-                self.database.user_logout(name)
-                del self.names[name]
-                break
-        self.clients.remove(client)
+        logger.info('Клиент %s отключился от сервера.', client.getpeername())
+        # Удаляем сессию клиента из реестра и базы подключённых.
+        name = self.names.unregister(client)
+        if name is not None:
+            self.database.user_logout(name)
+        self.clients.discard(client)
+        self.readers.pop(client, None)
+        self.outbound.pop(client, None)
+        self.congested.pop(client, None)
+        self.pending_auth.pop(client, None)
         client.close()
 
+    def handle_client_message(self, message: dict, client: socket.socket) -> None:
+        """ Метод передаёт ответ на запрос 511 авторизации,
+        остальные сообщения - в process_client_message.
+        :param message: Сообщение от клиента.
+        :param client: Сокет клиента. """
+        pending = self.pending_auth.pop(client, None)
+        if pending is not None:
+            self.auth_complete(pending.message, client, message, pending.digest)
+            self.auth_finished(pending.message, client, pending.started)
+        else:
+            self.process_client_message(message, client)
+
+    def expire_auth(self) -> None:
+        """ Метод отключает клиентов, не ответивших на запрос 511
+        за AUTH_TIMEOUT секунд. """
+        if not self.pending_auth:
+            return
+        now = time.monotonic()
+        for client, pending in list(self.pending_auth.items()):
+            if now > pending.deadline:
+                logger.info('Клиент %s не ответил на запрос авторизации.', client.getpeername())
+                AUTH_SECONDS.observe(now - pending.started, ('timeout',))
+                self.remove_client(client)
+
+    def receive_messages(self, client: socket.socket) -> list[dict]:
+        """ Метод приёма сообщений от готового к чтению клиента.
+        В режиме кадров за один recv может прийти несколько сообщений,
+        поэтому возвращается список.
+        :param client: Сокет клиента.
+        :return: Список принятых сообщений. """
+        reader = self.readers.get(client)
+        if reader is None:
+            data = client.recv(MAX_PACKAGE_LENGTH)
+            BYTES_RECEIVED.inc(amount=len(data))
+            return [decode_message(data)]
+        data = client.recv(FRAMED_RECV_SIZE)
+        if not data:
+            raise ConnectionResetError('Соединение закрыто клиентом.')
+        BYTES_RECEIVED.inc(amount=len(data))
+        reader.feed(data)
+        messages = []
+        while reader.has_message():
+            messages.append(reader.pop())
+        return messages
+
+    def is_framed(self, client: socket.socket) -> bool:
+        """ Проверяет, согласовал ли клиент передачу кадрами. """
+        return client in self.readers
+
+    def enable_framing(self, client: socket.socket) -> None:
+        """ Переводит соединение клиента в режим передачи кадрами. """
+        self.readers[client] = MessageReader()
+
+    def send_to(self, client: socket.socket, message: dict) -> None:
+        """ Метод отправки сообщения клиенту с учётом согласованного
+        режима передачи. Сообщение ставится в исходящий буфер клиента
+        и не блокирует обработку остальных клиентов.
+        :param client: Сокет клиента.
+        :param message: Словарь-сообщение. """
+        self.enqueue(client, encode_message(message, self.is_framed(client)))
+
+    def enqueue(self, client: socket.socket, data: bytes) -> None:
+        """ Метод добавления байтов в исходящий буфер клиента.
+        Сразу пытается отправить буфер, остаток досылается,
+        когда сокет будет готов к записи.
+        :param client: Сокет клиента.
+        :param data: Байты для отправки.
+        :raises OutboundOverflowError: Буфер клиента превысил OUTBOUND_MAX_BUFFER. """
+        buffer = self.outbound.get(client)
+        if buffer is None:
+            buffer = self.outbound[client] = bytearray()
+        if len(buffer) + len(data) > OUTBOUND_MAX_BUFFER:
+            # Клиент не забирает данные: вызывающий отключит его,
+            # а сообщение сохранит до следующего подключения.
+            logger.error('Исходящий буфер клиента %s переполнен, соединение закрывается.',
+                         client.getpeername())
+            raise OutboundOverflowError
+        buffer += data
+        self.flush_outbound(client)
+
+    def flush_outbound(self, client: socket.socket) -> None:
+        """ Метод неблокирующей отправки исходящего буфера клиента.
+        Отправляет столько, сколько принимает сокет, остаток
+        остаётся в буфере. Ошибки сокета передаются вызывающему.
+        :param client: Сокет клиента. """
+        buffer = self.outbound.get(client)
+        if not buffer:
+            self.outbound.pop(client, None)
+            return
+        client.setblocking(False)
+        try:
+            sent = client.send(buffer)
+        except BlockingIOError:
+            sent = 0
+        finally:
+            client.settimeout(CLIENT_SOCKET_TIMEOUT)
+        BYTES_SENT.inc(amount=sent)
+        del buffer[:sent]
+        if not buffer:
+            del self.outbound[client]
+        self.update_congestion(client)
+
+    def pending_bytes(self, client: socket.socket) -> int:
+        """ Количество неотправленных клиенту байтов. """
+        return len(self.outbound.get(client, b''))
+
+    def update_congestion(self, client: socket.socket) -> None:
+        """ Метод отмечает клиента перегруженным при превышении верхней
+        границы исходящего буфера и снимает отметку ниже нижней границы.
+        :param client: Сокет клиента. """
+        pending = self.pending_bytes(client)
+        if pending > self.high_watermark:
+            self.congested.setdefault(client, time.monotonic())
+        elif pending <= self.low_watermark and client in self.congested:
+            del self.congested[client]
+
+    def drop_slow_clients(self) -> None:
+        """ Метод отключает клиентов, исходящий буфер которых дольше
+        OUTBOUND_STALL_TIMEOUT секунд остаётся выше нижней границы. """
+        if not self.congested:
+            return
+        now = time.monotonic()
+        for client in list(self.congested):
+            self.update_congestion(client)
+            since = self.congested.get(client)
+            if since is not None and now - since > OUTBOUND_STALL_TIMEOUT:
+                logger.error('Клиент %s не принимает данные, '
+                             'соединение закрывается.', client.getpeername())
+                self.remove_client(client)
+
     def init_socket(self) -> None:
         """ Метод-инициализатор сокета. """
         logger.info(
-            f'Запущен сервер, порт для подключений: {self.port}, '
-            f'адрес с которого принимаются подключения: {self.addr}. '
-            f'Если адрес не указан, принимаются соединения с любых адресов.')
+            'Запущен сервер, порт для подключений: %s, '
+            'адрес с которого принимаются подключения: %s. '
+            'Если адрес не указан, принимаются соединения с любых адресов.',
+            self.port, self.addr)
         # Готовим сокет
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((self.addr, self.port))
-        self.sock.settimeout(0.5)
-        self.sock.listen(MAX_CONNECTIONS)
+        self.sock.settimeout(SERVER_POLL_INTERVAL)
+        self.sock.listen(self.backlog)
+        self.bind_metrics()
+
+    def bind_metrics(self) -> None:
+        """ Метод связывает показатели сервера с этим обработчиком.
+        Значения читаются потоком HTTP-сервера метрик только при опросе. """
+        CONNECTED_CLIENTS.set_function(lambda: len(self.clients))
+        AUTHORIZED_USERS.set_function(lambda: len(self.names))
+        OUTBOUND_BYTES.set_function(lambda: sum(self.outbound_depths()))
+        OUTBOUND_MAX_BYTES.set_function(lambda: max(self.outbound_depths(), default=0))
+        CONGESTED_CLIENTS.set_function(lambda: len(self.congested))
+
+    def outbound_depths(self) -> list[int]:
+        """ Размеры исходящих буферов подключённых клиентов, байт. """
+        return [self.pending_bytes(client) for client in list(self.clients)]
 
     def process_message(self, message: dict) -> None:
         """ Метод адресной отправки сообщения клиенту.
         Принимает словарь-сообщение.
         :param message: Сообщение готовое к отправке в виде словаря. """
-        if message[DESTINATION] in self.names \
-                and self.names[message[DESTINATION]] in self.listen_sockets:
+        if message[DESTINATION] in self.names:
+            recipient = self.names[message[DESTINATION]]
             try:
-                send_message(self.names[message[DESTINATION]], message)
-                logger.info(f'Отправлено сообщение пользователю {message[DESTINATION]} '
-                            f'от пользователя {message[SENDER]}.')
+                self.send_to(recipient, message)
+                logger.debug('Отправлено сообщение пользователю %s от пользователя %s.',
+                             message[DESTINATION], message[SENDER])
             except (OSError, NonDictInputError):
-                logger.error(f'От клиента {self.names[message[DESTINATION]].getpeername()} '
-                             f'приняты некорректные данные. Соединение закрывается.')
-                self.remove_client(message[DESTINATION])
-        elif message[DESTINATION] in self.names \
-                and self.names[message[DESTINATION]] not in self.listen_sockets:
-            logger.error(
-                f'Связь с клиентом {message[DESTINATION]} была потеряна. Соединение закрыто, доставка невозможна.')
-            self.remove_client(self.names[message[DESTINATION]])
-        else:
-            logger.error(f'Пользователь {message[DESTINATION]} не зарегистрирован'
-                                f' на сервере, отправка сообщения невозможна.')
+                logger.error('Связь с клиентом %s была потеряна. '
+                             'Соединение закрыто, сообщение сохранено до подключения.', message[DESTINATION])
+                self.remove_client(recipient)
+                self.store_offline(message)
+        elif self.forward(message):
+            logger.debug('Сообщение пользователю %s от пользователя %s передано другому обработчику.',
+                         message[DESTINATION], message[SENDER])
+        elif not self.store_offline(message):
+            logger.error('Пользователь %s не зарегистрирован'
+                         ' на сервере, отправка сообщения невозможна.', message[DESTINATION])
+
+    def fan_out(self, message: dict, recipients: list[str]) -> list[str]:
+        """ Метод рассылки одного сообщения нескольким клиентам этого
+        обработчика. Сообщение кодируется один раз для каждого режима
+        передачи, и те же байты ставятся в исходящие буферы всех получателей.
+        :param message: Сообщение в виде словаря.
+        :param recipients: Логины получателей.
+        :return: Логины получателей, которым сообщение не отправлено. """
+        encoded = dict()
+        missed = []
+        for username in recipients:
+            client = self.names.get(username)
+            if client is None:
+                missed.append(username)
+                continue
+            framed = self.is_framed(client)
+            data = encoded.get(framed)
+            if data is None:
+                data = encoded[framed] = encode_message(message, framed)
+            try:
+                self.enqueue(client, data)
+            except OSError:
+                logger.error('Связь с клиентом %s была потеряна. '
+                             'Соединение закрыто, сообщение сохранено до подключения.', username)
+                self.remove_client(client)
+                missed.append(username)
+        return missed
+
+    def forward_group(self, message: dict, recipients: list[str]) -> list[str]:
+        """ Метод передачи сообщения группе участникам, подключённым
+        к другим обработчикам. Многопроцессный режим переопределяет метод.
+        :param message: Сообщение в виде словаря.
+        :param recipients: Логины участников, не подключённых к этому обработчику.
+        :return: Логины участников, которым сообщение не передано. """
+        return recipients
+
+    def group_changed(self, name: str) -> None:
+        """ Метод вызывается после изменения участников группы.
+        Многопроцессный режим переопределяет метод, чтобы другие
+        обработчики обновили справочник групп.
+        :param name: Имя группы. """
+        pass
+
+    def store_offline(self, message: dict) -> bool:
+        """ Метод сохраняет сообщение для получателя не в сети. Получатель
+        заберёт его запросом GET_OFFLINE после подключения.
+        :param message: Сообщение в виде словаря.
+        :return: True, если получатель зарегистрирован и сообщение сохранено. """
+        if self.database.store_message(message[DESTINATION], message):
+            logger.debug('Сообщение пользователю %s не в сети от пользователя %s сохранено.',
+                         message[DESTINATION], message[SENDER])
+            return True
+        return False
+
+    def is_online(self, username: str) -> bool:
+        """ Метод проверяет, подключён ли пользователь к серверу.
+        :param username: Уникальный логин пользователя. """
+        return username in self.names
+
+    def forward(self, message: dict) -> bool:
+        """ Метод передачи сообщения пользователю, подключённому
+        к другому обработчику. Один процесс-сервер других обработчиков
+        не имеет, многопроцессный режим переопределяет метод.
+        :param message: Сообщение готовое к отправке в виде словаря.
+        :return: True, если сообщение передано. """
+        return False
+
+    # Таблица обработчиков действий JIM: значение ACTION -> Action.
+    # Заполняется через register_action, подклассы получают свою копию.
+    actions = dict()
+
+    @classmethod
+    def register_action(cls, name: str, handler, required: tuple = (), owner: str = None):
+        """ Метод регистрации обработчика действия протокола JIM.
+        Позволяет плагинам и подклассам добавлять новые действия
+        или заменять существующие. Регистрация в подклассе
+        не меняет таблицу родительского класса.
+        :param name: Значение поля ACTION.
+        :param handler: Функция handler(processor, message, client).
+        :param required: Поля, которые должны быть в сообщении.
+        :param owner: Поле с именем пользователя, которое должно
+                      совпадать с авторизованным на соединении.
+        :return: Переданный обработчик. """
+        if 'actions' not in cls.__dict__:
+            cls.actions = dict(cls.actions)
+        cls.actions[name] = Action(name, handler, required, owner)
+        return handler
 
     @LoginRequired()
     def process_client_message(self, message: dict, client: socket.socket) -> None:
         """ Метод-обработчик поступающих сообщений от клиентов,
-        принимает словарь-сообщение от клиента, проверяет корректность,
-        отправляет клиенту словарь-ответ, если необходимо.
+        принимает словарь-сообщение от клиента, находит обработчик
+        действия в таблице actions, проверяет корректность и вызывает его.
         :param message: Сообщение от клиента по протоколу JIM.
         :param client: Файловый дескриптор, готовый к вводу (готовый принять сообщение от сервера). """
-        logger.debug(f'Разбор сообщения от клиента : {message}')
-        # Если это сообщение о присутствии, принимаем и отвечаем
-        if ACTION in message \
-                and message[ACTION] == PRESENCE \
-                and TIME in message \
-                and USER in message:
-            # Если сообщение о присутствии, то вызываем функцию авторизации.
-            self.user_authorization(message, client)
-
-        # Если это сообщение, то отправляем его получателю.
-        elif ACTION in message \
-                and message[ACTION] == MESSAGE \
-                and DESTINATION in message \
-                and TIME in message \
-                and SENDER in message \
-                and MESSAGE_TEXT in message \
-                and self.names[message[SENDER]] == client:
-            if message[DESTINATION] in self.names:
-                self.database.process_message(message[SENDER],
-                                              message[DESTINATION])
-                self.process_message(message)
-                try:
-                    send_message(client, RESPONSE_200)
-                except (OSError, NonDictInputError):
-                    self.remove_client(client)
+        logger.debug('Разбор сообщения от клиента : %s', message)
+        # Номер запроса не пересылается получателям, он нужен только в ответе.
+        self.request_id = message.pop(REQUEST_ID, None)
+        try:
+            action = self.actions.get(message.get(ACTION))
+            MESSAGES.inc((action.name if action is not None else 'unknown',))
+            if action is not None and action.accepts(message, client, self.names):
+                action.handler(self, message, client)
+            # Иначе отдаём Bad request
             else:
-                response = RESPONSE_400
-                response[ERROR] = 'Пользователь не зарегистрирован на сервере.'
-                try:
-                    send_message(client, response)
-                except (OSError, NonDictInputError):
-                    pass
-            return
+                self.reply_error(client, 'Запрос некорректен.')
+        finally:
+            self.request_id = None
 
-        # Если клиент выходит
-        elif ACTION in message \
-                and message[ACTION] == EXIT \
-                and ACCOUNT_NAME in message \
-                and self.names[message[ACCOUNT_NAME]] == client:
+    def reply(self, client: socket.socket, response: dict) -> None:
+        """ Метод отправки ответа клиенту. При ошибке связи клиент отключается.
+        Если в запросе был номер REQUEST_ID, он возвращается в ответе,
+        по нему клиент сопоставляет ответы с запросами.
+        :param client: Сокет клиента.
+        :param response: Словарь-ответ. """
+        if self.request_id is not None:
+            response = dict(response)
+            response[REQUEST_ID] = self.request_id
+        try:
+            self.send_to(client, response)
+        except (OSError, NonDictInputError):
             self.remove_client(client)
 
-        # Если это запрос контакт-листа
-        elif ACTION in message \
-                and message[ACTION] == GET_CONTACTS \
-                and USER in message \
-                and self.names[message[USER]] == client:
-            response = RESPONSE_202
-            response[LIST_INFO] = self.database.get_contacts(message[USER])
-            try:
-                send_message(client, response)
-            except (OSError, NonDictInputError):
-                self.remove_client(client)
+    def reply_error(self, client: socket.socket, error: str) -> None:
+        """ Метод отправки ответа 400 с текстом ошибки.
+        :param client: Сокет клиента.
+        :param error: Текст ошибки. """
+        response = dict(RESPONSE_400)
+        response[ERROR] = error
+        self.reply(client, response)
 
-        # Если это добавление контакта
-        elif ACTION in message \
-                and message[ACTION] == ADD_CONTACT \
-                and ACCOUNT_NAME in message \
-                and USER in message \
-                and self.names[message[USER]] == client:
-            self.database.add_contact(message[USER],
-                                      message[ACCOUNT_NAME])
-            try:
-                send_message(client, RESPONSE_200)
-            except (OSError, NonDictInputError):
-                self.remove_client(client)
+    def action_message(self, message: dict, client: socket.socket) -> None:
+        """ Сообщение пользователю: отправляем его получателю. """
+        if self.is_online(message[DESTINATION]):
+            self.database.process_message(message[SENDER],
+                                          message[DESTINATION])
+            self.process_message(message)
+            self.reply(client, RESPONSE_200)
+        elif self.store_offline(message):
+            self.database.process_message(message[SENDER],
+                                          message[DESTINATION])
+            self.reply(client, RESPONSE_200)
+        else:
+            self.reply_error(client, 'Пользователь не зарегистрирован на сервере.')
 
-        # Если это удаление контакта
-        elif ACTION in message \
-                and message[ACTION] == REMOVE_CONTACT \
-                and ACCOUNT_NAME in message \
-                and USER in message \
-                and self.names[message[USER]] == client:
-            self.database.remove_contact(message[USER],
-                                         message[ACCOUNT_NAME])
-            try:
-                send_message(client, RESPONSE_200)
-            except (OSError, NonDictInputError):
-                self.remove_client(client)
+    def action_exit(self, message: dict, client: socket.socket) -> None:
+        """ Клиент выходит. """
+        self.remove_client(client)
 
-        # Если это запрос известных пользователей
-        elif ACTION in message \
-                and message[ACTION] == USERS_REQUEST \
-                and ACCOUNT_NAME in message \
-                and self.names[message[ACCOUNT_NAME]] == client:
-            response = RESPONSE_202
-            all_username_list = [user[0] for user in self.database.get_users_list()]
-            response[LIST_INFO] = all_username_list
-            try:
-                send_message(client, response)
-            except (OSError, NonDictInputError):
-                self.remove_client(client)
+    @staticmethod
+    def list_response(changes: tuple) -> dict:
+        """ Метод формирования ответа 202 на запрос списка с версией.
+        :param changes: Кортеж (версия, полный список, добавленные, удалённые).
+        :return: Ответ с полным списком в LIST_INFO или с изменениями
+                 в ADDED и REMOVED. """
+        version, names, added, removed = changes
+        response = dict(RESPONSE_202)
+        response[VERSION] = version
+        if names is not None:
+            response[LIST_INFO] = names
+        else:
+            response[ADDED] = added
+            response[REMOVED] = removed
+        return response
 
-        # Если это запрос публичного ключа пользователя
-        elif ACTION in message \
-                and message[ACTION] == PUBLIC_KEY_REQUEST \
-                and ACCOUNT_NAME in message:
-            response = RESPONSE_511
-            response[DATA] = self.database.get_pubkey(message[ACCOUNT_NAME])
-            # может быть, что ключа ещё нет (пользователь никогда не логинился, тогда шлём 400)
-            if response[DATA]:
-                try:
-                    send_message(client, response)
-                except (OSError, NonDictInputError):
-                    self.remove_client(client)
-            else:
-                response = RESPONSE_400
-                response[ERROR] = 'Нет публичного ключа для данного пользователя'
-                try:
-                    send_message(client, response)
-                except (OSError, NonDictInputError):
-                    self.remove_client(client)
+    @staticmethod
+    def client_version(message: dict) -> int | None:
+        """ Метод возвращает версию списка, указанную клиентом в запросе.
+        Клиенты без поддержки версий и некорректная версия - None,
+        такие клиенты получают полный список. """
+        version = message.get(VERSION)
+        if not isinstance(version, int) or isinstance(version, bool):
+            return None
+        return version
+
+    def action_get_contacts(self, message: dict, client: socket.socket) -> None:
+        """ Запрос контакт-листа. Клиент, передавший VERSION,
+        получает только изменения после своей версии. """
+        if VERSION in message:
+            self.reply(client, self.list_response(
+                self.database.get_contacts_changes(message[USER], self.client_version(message))))
+            return
+        response = dict(RESPONSE_202)
+        response[LIST_INFO] = self.database.get_contacts(message[USER])
+        self.reply(client, response)
+
+    def action_add_contact(self, message: dict, client: socket.socket) -> None:
+        """ Добавление контакта. """
+        self.database.add_contact(message[USER],
+                                  message[ACCOUNT_NAME])
+        self.reply(client, RESPONSE_200)
 
-        # Иначе отдаём Bad request
+    def action_remove_contact(self, message: dict, client: socket.socket) -> None:
+        """ Удаление контакта. """
+        self.database.remove_contact(message[USER],
+                                     message[ACCOUNT_NAME])
+        self.reply(client, RESPONSE_200)
+
+    def action_users_request(self, message: dict, client: socket.socket) -> None:
+        """ Запрос известных пользователей. Клиент, передавший VERSION,
+        получает только изменения после своей версии. """
+        if VERSION in message:
+            self.reply(client, self.list_response(
+                self.database.get_users_changes(self.client_version(message))))
+            return
+        response = dict(RESPONSE_202)
+        response[LIST_INFO] = [user[0] for user in self.database.get_users_list()]
+        self.reply(client, response)
+
+    def action_get_offline(self, message: dict, client: socket.socket) -> None:
+        """ Запрос сообщений, полученных, пока пользователь был не в сети.
+        Поле OFFLINE_ACK - номер последнего уже полученного сообщения:
+        сообщения до него включительно удаляются, в ответ отдаётся следующая
+        страница. Пустой список означает, что сообщений больше нет. """
+        ack = message[OFFLINE_ACK]
+        if not isinstance(ack, int) or isinstance(ack, bool):
+            self.reply_error(client, 'Запрос некорректен.')
+            return
+        username = message[ACCOUNT_NAME]
+        self.database.ack_offline_messages(username, ack)
+        # Без передачи кадрами клиент читает не больше MAX_PACKAGE_LENGTH байт,
+        # поэтому отдаём по одному сообщению.
+        limit = OFFLINE_PAGE_SIZE if self.is_framed(client) else 1
+        # Страницу выбирает поток записи, ответ отправляется по её готовности.
+        future = self.database.get_offline_messages(username, ack, limit)
+        request_id = self.request_id
+        future.add_done_callback(
+            lambda done: self.call_soon(self.offline_page_ready, client, request_id, done))
+
+    def offline_page_ready(self, client: socket.socket, request_id, future) -> None:
+        """ Ответ на GET_OFFLINE по готовности страницы сообщений.
+        :param client: Сокет клиента.
+        :param request_id: Номер запроса REQUEST_ID или None.
+        :param future: Future выборки get_offline_messages. """
+        if client not in self.clients:
+            return
+        if future.exception() is not None:
+            response = dict(RESPONSE_400)
+            response[ERROR] = 'Сообщения временно недоступны.'
         else:
-            response = RESPONSE_400
-            response[ERROR] = 'Запрос некорректен.'
-            try:
-                send_message(client, response)
-            except (OSError, NonDictInputError):
-                self.remove_client(client)
+            response = dict(RESPONSE_202)
+            response[LIST_INFO] = future.result()
+        if request_id is not None:
+            response[REQUEST_ID] = request_id
+        self.reply(client, response)
+
+    def action_create_group(self, message: dict, client: socket.socket) -> None:
+        """ Создание группы, создатель становится её участником. """
+        if self.database.create_group(message[GROUP], message[ACCOUNT_NAME]):
+            self.reply(client, RESPONSE_200)
+        else:
+            self.reply_error(client, 'Группа с таким именем уже существует.')
+
+    def action_join_group(self, message: dict, client: socket.socket) -> None:
+        """ Вход в группу. """
+        if self.database.join_group(message[GROUP], message[ACCOUNT_NAME]):
+            self.group_changed(message[GROUP])
+            self.reply(client, RESPONSE_200)
+        else:
+            self.reply_error(client, 'Группа не найдена.')
+
+    def action_leave_group(self, message: dict, client: socket.socket) -> None:
+        """ Выход из группы. """
+        if self.database.leave_group(message[GROUP], message[ACCOUNT_NAME]):
+            self.group_changed(message[GROUP])
+            self.reply(client, RESPONSE_200)
+        else:
+            self.reply_error(client, 'Пользователь не состоит в группе.')
+
+    def action_get_groups(self, message: dict, client: socket.socket) -> None:
+        """ Запрос групп пользователя. """
+        response = dict(RESPONSE_202)
+        response[LIST_INFO] = self.database.get_user_groups(message[ACCOUNT_NAME])
+        self.reply(client, response)
+
+    def action_group_message(self, message: dict, client: socket.socket) -> None:
+        """ Сообщение группе: рассылаем участникам этого обработчика,
+        передаём участникам других обработчиков, для остальных сохраняем. """
+        group = self.database.get_group(message[GROUP])
+        sender = message[SENDER]
+        if group is None or sender not in group.members:
+            self.reply_error(client, 'Пользователь не состоит в группе.')
+            return
+        recipients = [username for username in list(group.members) if username != sender]
+        offline = self.forward_group(message, self.fan_out(message, recipients))
+        if offline:
+            self.database.store_group_message(offline, message)
+        self.database.process_group_message(sender, recipients)
+        logger.debug('Сообщение группе %s от пользователя %s '
+                     'разослано %s участникам, из них не в сети: %s.',
+                     group.name, sender, len(recipients), len(offline))
+        self.reply(client, RESPONSE_200)
+
+    def action_public_key_request(self, message: dict, client: socket.socket) -> None:
+        """ Запрос публичного ключа пользователя. """
+        response = dict(RESPONSE_511)
+        response[DATA] = self.database.get_pubkey(message[ACCOUNT_NAME])
+        # может быть, что ключа ещё нет (пользователь никогда не логинился, тогда шлём 400)
+        if response[DATA]:
+            self.reply(client, response)
+        else:
+            self.reply_error(client, 'Нет публичного ключа для данного пользователя')
 
     def user_authorization(self, message: dict, sock: socket.socket) -> None:
         """ Метод реализующий авторизацию пользователей.
+        Отправляет клиенту запрос 511 и не ждёт ответа: соединение
+        запоминается в pending_auth, ответ обработает handle_client_message,
+        когда он придёт. До этого сервер обслуживает остальных клиентов.
         :param message: Сообщение от клиента.
         :param sock: Клиентский сокет. """
-        # Если имя пользователя уже занято, то возвращаем 400
-        logger.debug(f'Start auth process for {message[USER]}')
-        if message[USER][ACCOUNT_NAME] in self.names.keys():
+        started = time.monotonic()
+        if not self.auth_precheck(message, sock):
+            return
+        message_auth, digest = self.auth_challenge(message)
+        # Запрос 511 ещё идёт без кадра, ответ на него - уже в согласованном режиме.
+        self.send_to(sock, message_auth)
+        if message_auth.get(FRAMING) == FRAMING_LENGTH:
+            self.enable_framing(sock)
+        self.pending_auth[sock] = PendingAuth(message, digest, started, time.monotonic() + AUTH_TIMEOUT)
+
+    def auth_precheck(self, message: dict, sock: socket.socket) -> bool:
+        """ Первый шаг авторизации: проверка, что имя пользователя свободно
+        и зарегистрировано на сервере. При ошибке отправляет клиенту ответ 400
+        и закрывает соединение.
+        :param message: Сообщение о присутствии от клиента.
+        :param sock: Клиентский сокет.
+        :return: True, если можно переходить к проверке пароля. """
+        # Если имя пользователя уже занято или под ним уже идёт
+        # авторизация с другого соединения, то возвращаем 400
+        logger.debug('Start auth process for %s', message[USER])
+        if self.is_online(message[USER][ACCOUNT_NAME]) \
+                or self.is_authenticating(message[USER][ACCOUNT_NAME]):
             response = RESPONSE_400
             response[ERROR] = 'Имя пользователя уже занято.'
             try:
-                logger.debug(f'Username busy, sending {response}')
-                send_message(sock, response)
+                logger.debug('Username busy, sending %s', response)
+                self.send_to(sock, response)
             except OSError:
                 logger.debug('OS Error')
                 pass
-            self.clients.remove(sock)
-            sock.close()
+            self.remove_client(sock)
+            return False
         # Проверяем что пользователь зарегистрирован на сервере.
         elif not self.database.check_user(message[USER][ACCOUNT_NAME]):
             response = RESPONSE_400
             response[ERROR] = 'Пользователь не зарегистрирован.'
             try:
-                logger.debug(f'Unknown username, sending {response}')
-                send_message(sock, response)
+                logger.debug('Unknown username, sending %s', response)
+                self.send_to(sock, response)
             except OSError:
                 pass
-            self.clients.remove(sock)
-            sock.close()
-        else:
-            logger.debug('Correct username, starting passwd check.')
-            # Иначе отвечаем 511 и проводим процедуру авторизации
-            message_auth = RESPONSE_511
-            # Получаем набор байтов в hex представлении
-            random_str = binascii.hexlify(os.urandom(64))
-            # В словарь байты нельзя, декодируем (json.dumps -> TypeError)
-            message_auth[DATA] = random_str.decode('ascii')
-            # Создаём хэш пароля и связки с рандомной строкой, сохраняем серверную версию ключа
-            password_hash_bytes = self.database.get_hash(message[USER][ACCOUNT_NAME])
-            hash = hmac.new(password_hash_bytes, random_str, 'MD5')
-            digest = hash.digest()
-            logger.debug(f'Auth message = {message_auth}')
-            try:
-                # Обмен с клиентом
-                send_message(sock, message_auth)
-                answer = get_message(sock)
-            except OSError as err:
-                logger.debug('Error in auth, data:', exc_info=err)
-                sock.close()
-                return
+            self.remove_client(sock)
+            return False
+        logger.debug('Correct username, starting passwd check.')
+        return True
+
+    def is_authenticating(self, username: str) -> bool:
+        """ Метод проверяет, ждёт ли сервер ответа на запрос 511
+        от соединения, авторизующегося под этим именем. Перебираются
+        только незавершённые авторизации, их немного.
+        :param username: Уникальный логин пользователя. """
+        return any(pending.message[USER][ACCOUNT_NAME] == username
+                   for pending in self.pending_auth.values())
+
+    def auth_challenge(self, message: dict) -> tuple[dict, bytes]:
+        """ Второй шаг авторизации: формирование ответа 511 со случайной
+        строкой и расчёт ожидаемого от клиента дайджеста.
+        Если клиент предложил передачу кадрами, ответ подтверждает её.
+        :param message: Сообщение о присутствии от клиента.
+        :return: Кортеж из сообщения-запроса 511 и ожидаемого дайджеста. """
+        username = message[USER][ACCOUNT_NAME]
+        # Отвечаем 511 и проводим процедуру авторизации
+        message_auth = dict(RESPONSE_511)
+        if message.get(FRAMING) == FRAMING_LENGTH:
+            message_auth[FRAMING] = FRAMING_LENGTH
+        # Получаем набор байтов в hex представлении
+        random_str = binascii.hexlify(os.urandom(64))
+        # В словарь байты нельзя, декодируем (json.dumps -> TypeError)
+        message_auth[DATA] = random_str.decode('ascii')
+        # Создаём хэш пароля и связки с рандомной строкой, сохраняем серверную версию ключа
+        password_hash_bytes = self.database.get_hash(username)
+        hash = hmac.new(password_hash_bytes, random_str, 'MD5')
+        digest = hash.digest()
+        logger.debug('Auth message = %s', message_auth)
+        return message_auth, digest
+
+    def auth_complete(self, message: dict, sock: socket.socket, answer: dict, digest: bytes) -> None:
+        """ Последний шаг авторизации: сверка дайджеста клиента с ожидаемым.
+        :param message: Сообщение о присутствии от клиента.
+        :param sock: Клиентский сокет.
+        :param answer: Ответ клиента на запрос 511.
+        :param digest: Ожидаемый дайджест. """
+        try:
             client_digest = binascii.a2b_base64(answer[DATA])
-            # Если ответ клиента корректный, то сохраняем его в список пользователей.
-            if RESPONSE in answer \
-                    and answer[RESPONSE] == 511 \
-                    and hmac.compare_digest(digest, client_digest):
+        except (KeyError, TypeError, ValueError):
+            client_digest = b''
+        # Если ответ клиента корректный, то сохраняем его в список пользователей.
+        if answer.get(RESPONSE) == 511 \
+                and hmac.compare_digest(digest, client_digest):
+            try:
                 self.names[message[USER][ACCOUNT_NAME]] = sock
-                client_ip, client_port = sock.getpeername()
-                try:
-                    send_message(sock, RESPONSE_200)
-                except OSError:
-                    self.remove_client(message[USER][ACCOUNT_NAME])
-                # добавляем пользователя в список активных и,
-                # если у него изменился открытый ключ, то сохраняем новый
-                self.database.user_login(
-                    message[USER][ACCOUNT_NAME],
-                    client_ip,
-                    client_port,
-                    message[USER][PUBLIC_KEY])
-            else:
-                response = RESPONSE_400
-                response[ERROR] = 'Неверный пароль.'
-                try:
-                    send_message(sock, response)
-                except OSError:
-                    pass
-                self.clients.remove(sock)
-                sock.close()
+            except ValueError:
+                # Имя успели занять с другого соединения.
+                self.reply_error(sock, 'Имя пользователя уже занято.')
+                self.remove_client(sock)
+                return
+            client_ip, client_port = sock.getpeername()
+            try:
+                self.send_to(sock, RESPONSE_200)
+            except OSError:
+                self.remove_client(sock)
+                return
+            # добавляем пользователя в список активных и,
+            # если у него изменился открытый ключ, то сохраняем новый
+            self.database.user_login(
+                message[USER][ACCOUNT_NAME],
+                client_ip,
+                client_port,
+                message[USER][PUBLIC_KEY])
+        else:
+            response = RESPONSE_400
+            response[ERROR] = 'Неверный пароль.'
+            try:
+                self.send_to(sock, response)
+            except OSError:
+                pass
+            self.remove_client(sock)
+
+    def auth_finished(self, message: dict, sock: socket.socket, started: float) -> None:
+        """ Метод записывает в метрики длительность завершённой авторизации.
+        :param message: Сообщение о присутствии от клиента.
+        :param sock: Клиентский сокет.
+        :param started: Момент (time.monotonic) получения сообщения о присутствии. """
+        result = 'ok' if self.names.get(message[USER][ACCOUNT_NAME]) is sock else 'failed'
+        AUTH_SECONDS.observe(time.monotonic() - started, (result,))
 
     def service_update_lists(self) -> None:
-        """ Метод реализующий отправки сервисного сообщения 205 клиентам. """
-        for client in self.names:
+        """ Метод реализующий отправки сервисного сообщения 205 клиентам.
+        Сообщение содержит текущую версию списков: клиент, уже получивший
+        эту версию, списки не запрашивает. """
+        message = dict(RESPONSE_205)
+        message[VERSION] = self.database.get_directory_version()
+        for client in list(self.names.values()):
             try:
-                send_message(self.names[client], RESPONSE_205)
+                self.send_to(client, message)
             except OSError:
-                self.remove_client(self.names[client])
+                self.remove_client(client)
+
+
+# Действия протокола JIM, которые обрабатывает сервер.
+MessageProcessor.register_action(PRESENCE, MessageProcessor.user_authorization, (TIME, USER))
+MessageProcessor.register_action(MESSAGE, MessageProcessor.action_message,
+                                 (DESTINATION, TIME, MESSAGE_TEXT), owner=SENDER)
+MessageProcessor.register_action(EXIT, MessageProcessor.action_exit, owner=ACCOUNT_NAME)
+MessageProcessor.register_action(GET_CONTACTS, MessageProcessor.action_get_contacts, owner=USER)
+MessageProcessor.register_action(ADD_CONTACT, MessageProcessor.action_add_contact,
+                                 (ACCOUNT_NAME,), owner=USER)
+MessageProcessor.register_action(REMOVE_CONTACT, MessageProcessor.action_remove_contact,
+                                 (ACCOUNT_NAME,), owner=USER)
+MessageProcessor.register_action(USERS_REQUEST, MessageProcessor.action_users_request,
+                                 owner=ACCOUNT_NAME)
+MessageProcessor.register_action(GET_OFFLINE, MessageProcessor.action_get_offline,
+                                 (TIME, OFFLINE_ACK), owner=ACCOUNT_NAME)
+MessageProcessor.register_action(CREATE_GROUP, MessageProcessor.action_create_group,
+                                 (TIME, GROUP), owner=ACCOUNT_NAME)
+MessageProcessor.register_action(JOIN_GROUP, MessageProcessor.action_join_group,
+                                 (TIME, GROUP), owner=ACCOUNT_NAME)
+MessageProcessor.register_action(LEAVE_GROUP, MessageProcessor.action_leave_group,
+                                 (TIME, GROUP), owner=ACCOUNT_NAME)
+MessageProcessor.register_action(GET_GROUPS, MessageProcessor.action_get_groups,
+                                 (TIME,), owner=ACCOUNT_NAME)
+MessageProcessor.register_action(GROUP_MESSAGE, MessageProcessor.action_group_message,
+                                 (TIME, GROUP, MESSAGE_TEXT), owner=SENDER)
+MessageProcessor.register_action(PUBLIC_KEY_REQUEST, MessageProcessor.action_public_key_request,
+                                 (ACCOUNT_NAME,))
@@ -1,13 +1,36 @@
+import json
+import time
+import threading
 from datetime import datetime
+from collections import Counter
+from concurrent.futures import Future, wait
 from sqlalchemy.orm import sessionmaker, registry
-from sqlalchemy import create_engine, Table, Column, \
-    Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import create_engine, event, text, Table, Column, Index, \
+    Integer, String, Boolean, ForeignKey, DateTime, Text, select, bindparam, func
+from common.settings import COUNTERS_FLUSH_INTERVAL, COUNTERS_FLUSH_SIZE, USER_CACHE_SIZE, \
+    SERVER_DB_PRAGMAS, OFFLINE_ID, DIRECTORY_LOG_SIZE
+from server.directory import UserDirectory, CachedUser, GroupDirectory, CachedGroup
+from server.writer import DatabaseWriter
+from server.metrics import DB_CALL_SECONDS, DB_WRITER_QUEUE, timed
+
+
+def apply_pragmas(dbapi_connection, connection_record) -> None:
+    """ Обработчик события connect движка: настраивает новое
+    соединение SQLite согласно SERVER_DB_PRAGMAS. """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SERVER_DB_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
 
 
 class ServerStorage:
     """ Класс - оболочка для работы с базой данных сервера.
     Использует SQLite базу данных, реализован с помощью
-    SQLAlchemy ORM и используется классический подход. """
+    SQLAlchemy ORM и используется классический подход.
+    Длительность вызовов публичных методов записывается в метрики сервера. """
+    # Версия схемы базы, хранится в PRAGMA user_version.
+    # Базы старых версий обновляются методом migrate при открытии.
+    schema_version = 4
 
     class AllUsers:
         """ Класс для отображения таблицы всех пользователей
@@ -70,6 +93,61 @@ class ServerStorage:
             self.user_id = user_id
             self.contact = contact
 
+    class Groups:
+        """ Класс - отображение таблицы групп (комнат). """
+
+        def __init__(self, name: str, created: datetime):
+            """
+            :param name: Уникальное имя группы.
+            :param created: Время создания.
+            """
+            self.id = None  # primary_key
+            self.name = name
+            self.created = created
+
+    class GroupMembers:
+        """ Класс - отображение таблицы участников групп. """
+
+        def __init__(self, group_id: int, user_id: int):
+            """
+            :param group_id: Уникальный внешний ключ - 'Groups.id'.
+            :param user_id: Уникальный внешний ключ - 'All_users.id'.
+            """
+            self.id = None  # primary_key
+            self.group_id = group_id
+            self.user_id = user_id
+
+    class OfflineMessage:
+        """ Класс - отображение таблицы сообщений для пользователей не в сети.
+        Записи только добавляются и удаляются после подтверждения получения. """
+
+        def __init__(self, recipient_id: int, message: str, created: datetime):
+            """
+            :param recipient_id: Уникальный внешний ключ - 'All_users.id'.
+            :param message: Сообщение JIM в виде JSON.
+            :param created: Время сохранения.
+            """
+            self.id = None  # primary_key, порядковый номер сообщения
+            self.recipient_id = recipient_id
+            self.message = message
+            self.created = created
+
+    class DirectoryChange:
+        """ Класс - отображение журнала изменений списков пользователей
+        и контактов. Номер записи - версия списка после изменения. """
+
+        def __init__(self, owner_id: int | None, name: str, added: bool):
+            """
+            :param owner_id: Владелец контакт-листа - 'All_users.id',
+                             None - список всех пользователей.
+            :param name: Имя добавленного или удалённого пользователя.
+            :param added: True - имя добавлено, False - удалено.
+            """
+            self.id = None  # primary_key, версия списка
+            self.owner_id = owner_id
+            self.name = name
+            self.added = added
+
     class UserHistory:
         """ Класс - отображение таблицы истории действий. """
 
@@ -82,10 +160,22 @@ class ServerStorage:
             self.sent = 0  # Кол-во отправленных сообщений.
             self.accepted = 0  # Кол-во полученных сообщений.
 
-    def __init__(self, path: str):
+    def __init__(self, path: str,
+                 flush_interval: float = COUNTERS_FLUSH_INTERVAL,
+                 flush_size: int = COUNTERS_FLUSH_SIZE,
+                 cache_size: int = USER_CACHE_SIZE,
+                 clear_active: bool = True):
         """ Конструктор создаёт движок базы данных, все таблицы,
         связывает их классы в ORM с таблицей sqlite и создаёт сессию для запросов.
         :param path: Путь до файла базы данных.
+        :param flush_interval: Максимальное время хранения счётчиков сообщений
+                               в памяти до записи в базу, сек.
+        :param flush_size: Количество сообщений, после которого счётчики
+                           записываются в базу сразу.
+        :param cache_size: Максимальное количество пользователей в кэше справочника.
+        :param clear_active: Очистить таблицу активных пользователей. Делает это
+                             только процесс, запускающий сервер: процессы-обработчики
+                             и служебные программы открывают базу работающего сервера.
         """
         # Создаём отображения для метаданных.
         self.mapper_registry = registry()
@@ -114,14 +204,18 @@ class ServerStorage:
                                     Column('user_id', ForeignKey('All_users.id')),
                                     Column('ip_address', String),
                                     Column('port', Integer),  # String
-                                    Column('date_time', DateTime)
+                                    Column('date_time', DateTime),
+                                    Index('ix_login_history_user_time', 'user_id', 'date_time')
                                     )
 
         # Создаём таблицу контактов пользователей
         user_contacts_table = Table('User_contacts', self.mapper_registry.metadata,
                                     Column('id', Integer, primary_key=True),
                                     Column('user_id', ForeignKey('All_users.id')),
-                                    Column('contact', ForeignKey('All_users.id'))
+                                    Column('contact', ForeignKey('All_users.id')),
+                                    Index('ix_user_contacts_user_contact', 'user_id', 'contact',
+                                          unique=True),
+                                    Index('ix_user_contacts_contact', 'contact')
                                     )
 
         # Создаём таблицу истории пользователей
@@ -129,15 +223,54 @@ class ServerStorage:
                                    Column('id', Integer, primary_key=True),
                                    Column('user_id', ForeignKey('All_users.id')),
                                    Column('sent', Integer),
-                                   Column('accepted', Integer)
+                                   Column('accepted', Integer),
+                                   Index('ix_user_history_user', 'user_id')
                                    )
 
+        # Создаём таблицу сообщений для пользователей не в сети.
+        offline_messages_table = Table('Offline_messages', self.mapper_registry.metadata,
+                                       Column('id', Integer, primary_key=True),
+                                       Column('recipient_id', ForeignKey('All_users.id')),
+                                       Column('message', Text),
+                                       Column('created', DateTime),
+                                       Index('ix_offline_messages_recipient', 'recipient_id', 'id')
+                                       )
+
+        # Создаём таблицы групп и участников групп.
+        groups_table = Table('Groups', self.mapper_registry.metadata,
+                             Column('id', Integer, primary_key=True),
+                             Column('name', String, unique=True),
+                             Column('created', DateTime)
+                             )
+
+        group_members_table = Table('Group_members', self.mapper_registry.metadata,
+                                    Column('id', Integer, primary_key=True),
+                                    Column('group_id', ForeignKey('Groups.id')),
+                                    Column('user_id', ForeignKey('All_users.id')),
+                                    Index('ix_group_members_group_user', 'group_id', 'user_id',
+                                          unique=True),
+                                    Index('ix_group_members_user', 'user_id')
+                                    )
+
+        # Создаём журнал изменений списков пользователей и контактов.
+        # sqlite_autoincrement: номера не используются повторно после очистки.
+        directory_changes_table = Table('Directory_changes', self.mapper_registry.metadata,
+                                        Column('id', Integer, primary_key=True),
+                                        Column('owner_id', Integer),
+                                        Column('name', String),
+                                        Column('added', Boolean),
+                                        Index('ix_directory_changes_owner', 'owner_id', 'id'),
+                                        sqlite_autoincrement=True
+                                        )
+
         self.database_engine = create_engine(f'sqlite:///{path}',
                                              echo=False,
                                              pool_recycle=7200,
                                              connect_args={'check_same_thread': False})
-        # Создаём таблицы.
+        event.listen(self.database_engine, 'connect', apply_pragmas)
+        # Создаём таблицы и обновляем схему существующей базы.
         self.mapper_registry.metadata.create_all(self.database_engine)
+        self.migrate()
 
         # Связываем класс в ORM с таблицей.
         self.mapper_registry.map_imperatively(self.AllUsers, all_users_table)
@@ -145,167 +278,342 @@ class ServerStorage:
         self.mapper_registry.map_imperatively(self.LoginHistory, login_history_table)
         self.mapper_registry.map_imperatively(self.UserContacts, user_contacts_table)
         self.mapper_registry.map_imperatively(self.UserHistory, user_history_table)
-
-        # Создаём сессию
-        Session = sessionmaker(bind=self.database_engine)
-        self.session = Session()
+        self.mapper_registry.map_imperatively(self.OfflineMessage, offline_messages_table)
+        self.mapper_registry.map_imperatively(self.Groups, groups_table)
+        self.mapper_registry.map_imperatively(self.GroupMembers, group_members_table)
+        self.mapper_registry.map_imperatively(self.DirectoryChange, directory_changes_table)
+
+        # Фабрика сессий. Изменения выполняет поток записи в своей сессии,
+        # чтение - короткие сессии из пула соединений в вызывающем потоке,
+        # поэтому поток сервера и GUI не делят одну сессию.
+        self.Session = sessionmaker(bind=self.database_engine)
+        self.writer = DatabaseWriter(self.Session)
+        self.writer.start()
+        DB_WRITER_QUEUE.set_function(self.writer.commands.qsize)
 
         # Если в таблице активных пользователей есть записи, то их необходимо
         # удалить
-        self.session.query(self.ActiveUsers).delete()
-        self.session.commit()
-
+        if clear_active:
+            self.writer.submit(self.write_clear_active).result()
+
+        # Справочник пользователей: запросы авторизации, ключей и контактов
+        # обслуживаются из памяти, в All_users обращаемся только при промахе.
+        self.directory = UserDirectory(cache_size)
+        # Справочник групп: участники нужны при каждом сообщении группе.
+        self.groups = GroupDirectory(cache_size)
+
+        # Счётчики сообщений, ещё не записанные в User_history: имя -> количество.
+        # process_message вызывается из потока сервера, статистику читает GUI,
+        # поэтому доступ к счётчикам защищён блокировкой.
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.counters_lock = threading.Lock()
+        self.pending_sent = Counter()
+        self.pending_accepted = Counter()
+        self.pending_messages = 0
+        self.last_flush = time.monotonic()
+        # Пакетное увеличение счётчиков одним UPDATE на пользователя.
+        self.counters_update = user_history_table.update().where(
+            user_history_table.c.user_id == select(all_users_table.c.id).where(
+                all_users_table.c.name == bindparam('username')).scalar_subquery()
+        ).values(sent=user_history_table.c.sent + bindparam('sent_delta'),
+                 accepted=user_history_table.c.accepted + bindparam('accepted_delta'))
+
+    def migrate(self) -> None:
+        """ Метод обновления схемы базы до schema_version.
+        create_all создаёт только отсутствующие таблицы, поэтому индексы
+        для таблиц, созданных прежними версиями сервера, добавляются здесь. """
+        with self.database_engine.begin() as connection:
+            version = connection.execute(text('PRAGMA user_version')).scalar()
+            if version < 1:
+                # Версия 1: индексы по user_id/contact. Перед созданием
+                # уникального индекса удаляем повторы контактов.
+                connection.execute(text(
+                    'DELETE FROM User_contacts WHERE id NOT IN '
+                    '(SELECT MIN(id) FROM User_contacts GROUP BY user_id, contact)'))
+                for table in self.mapper_registry.metadata.sorted_tables:
+                    for index in table.indexes:
+                        index.create(connection, checkfirst=True)
+            # Версия 2: таблица Offline_messages, версия 3: таблицы Groups
+            # и Group_members, версия 4: таблица Directory_changes,
+            # их создаёт create_all.
+            if version < self.schema_version:
+                connection.execute(text(f'PRAGMA user_version = {self.schema_version}'))
+
+    @timed(DB_CALL_SECONDS)
     def user_login(self, username: str, ip_address: str, port: int, key: str) -> None:
         """ Функция выполняющаяся при входе пользователя,
         записывает факт входа в таблицы ActiveUsers и LoginHistory.
         Если имя пользователя уже присутствует в таблице AllUsers,
         обновляет время последнего входа, если нет, то создаёт нового пользователя в AllUsers.
         Обновляет открытый ключ пользователя при его изменении.
+        Запись выполняется потоком записи, метод не ждёт её завершения.
         :param username: Уникальный логин пользователя(клиента).
         :param ip_address: IP-адрес пользователя.
         :param port: Порт, с которого подключён пользователь.
         :param key: Ключ, для проверки пользователя.
         """
-        # Запрос в таблицу пользователей на наличие там пользователя с таким
-        # именем
-        all_users = self.session.query(self.AllUsers).filter_by(name=username)
-
-        # Если имя пользователя уже присутствует в таблице, обновляем время последнего входа
-        # и проверяем корректность ключа. Если клиент прислал новый ключ,
-        # сохраняем его.
-        if all_users.count():
-            user = all_users.first()
-            user.last_login = datetime.now()
-            if user.pubkey != key:
-                user.pubkey = key
+        # Ищем пользователя в справочнике.
+        user = self.get_user(username)
         # Если нет, то генерируем исключение
-        else:
+        if user is None:
             raise ValueError('Пользователь не зарегистрирован.')
-
+        # Если клиент прислал новый ключ, сохраняем его.
+        user.pubkey = key
+        self.directory.pin(username, self.writer.submit(self.write_login, user.id, ip_address,
+                                                        port, key, datetime.now()))
+
+    def write_login(self, session, user_id: int, ip_address: str, port: int,
+                    key: str, login_time: datetime) -> None:
+        """ Команда потока записи для user_login. """
+        # Обновляем время последнего входа и ключ.
+        session.query(self.AllUsers).filter_by(id=user_id).update(
+            {'last_login': login_time, 'pubkey': key})
         # Теперь можно создать запись в таблицу активных пользователей о факте
         # входа.
-        new_active_user = self.ActiveUsers(user.id, ip_address,
-                                           port, datetime.now())
-        self.session.add(new_active_user)
-
+        session.add(self.ActiveUsers(user_id, ip_address, port, login_time))
         # и сохранить в историю входов
-        history = self.LoginHistory(user.id, ip_address,
-                                    port, datetime.now())
-        self.session.add(history)
+        session.add(self.LoginHistory(user_id, ip_address, port, login_time))
 
-        # Сохраняем изменения
-        self.session.commit()
+    def write_clear_active(self, session) -> None:
+        """ Команда потока записи: очистка таблицы активных пользователей. """
+        session.query(self.ActiveUsers).delete()
 
+    @timed(DB_CALL_SECONDS)
     def add_user(self, username: str, password_hash: bytes) -> None:
         """ Метод регистрации пользователя.
         Принимает имя и хэш пароля, создаёт запись в таблице статистики.
+        Ждёт завершения записи, ошибки базы передаются вызывающему.
         :param username: Уникальный логин пользователя.
         :param password_hash: Хэш-пароль. """
+        user_id = self.writer.submit(self.write_user, username, password_hash).result()
+        self.directory.put(CachedUser(user_id, username, password_hash, None))
+
+    def write_user(self, session, username: str, password_hash: bytes) -> int:
+        """ Команда потока записи для add_user.
+        :return: Идентификатор нового пользователя. """
         new_user = self.AllUsers(username, password_hash)
-        self.session.add(new_user)
-        self.session.commit()
-        history_row = self.UserHistory(new_user.id)
-        self.session.add(history_row)
-        self.session.commit()
+        session.add(new_user)
+        session.flush()
+        session.add(self.UserHistory(new_user.id))
+        self.log_change(session, None, username, True)
+        return new_user.id
 
+    @timed(DB_CALL_SECONDS)
     def remove_user(self, username: str) -> None:
         """ Метод удаляющий пользователя из базы.
+        Ждёт завершения записи.
         :param username: Уникальный логин пользователя."""
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-        self.session.query(self.ActiveUsers).filter_by(user_id=user.id).delete()
-        self.session.query(self.LoginHistory).filter_by(user_id=user.id).delete()
-        self.session.query(self.UserContacts).filter_by(user_id=user.id).delete()
-        self.session.query(self.UserContacts).filter_by(contact=user.id).delete()
-        self.session.query(self.UserHistory).filter_by(user_id=user.id).delete()
-        self.session.query(self.AllUsers).filter_by(name=username).delete()
-        self.session.commit()
-
+        self.writer.submit(self.write_remove_user, username).result()
+        self.directory.discard(username)
+        self.directory.forget_contact(username)
+        self.groups.forget_contact(username)
+
+    def write_remove_user(self, session, username: str) -> None:
+        """ Команда потока записи для remove_user. """
+        user = session.query(self.AllUsers).filter_by(name=username).first()
+        # Пользователь пропадает из списка всех пользователей и из
+        # контакт-листов, в которых он был.
+        owners = [row[0] for row in session.query(self.UserContacts.user_id).filter_by(contact=user.id)]
+        for owner_id in [None] + owners:
+            self.log_change(session, owner_id, username, False)
+        session.query(self.DirectoryChange).filter_by(owner_id=user.id).delete()
+        session.query(self.ActiveUsers).filter_by(user_id=user.id).delete()
+        session.query(self.LoginHistory).filter_by(user_id=user.id).delete()
+        session.query(self.UserContacts).filter_by(user_id=user.id).delete()
+        session.query(self.UserContacts).filter_by(contact=user.id).delete()
+        session.query(self.UserHistory).filter_by(user_id=user.id).delete()
+        session.query(self.OfflineMessage).filter_by(recipient_id=user.id).delete()
+        session.query(self.GroupMembers).filter_by(user_id=user.id).delete()
+        session.query(self.AllUsers).filter_by(name=username).delete()
+
+    def get_user(self, username: str) -> CachedUser | None:
+        """ Метод получения записи справочника пользователей.
+        При отсутствии записи в кэше загружает её из All_users.
+        :param username: Уникальный логин пользователя.
+        :return: Запись справочника или None, если пользователя нет. """
+        user = self.directory.get(username)
+        if user is not None:
+            return user
+        # Запись удалили из справочника (forget_user) до записи её
+        # изменений в базу: без ожидания загрузилось бы старое состояние.
+        self.wait_pending(self.directory.pending_write(username))
+        with self.Session() as session:
+            row = session.query(self.AllUsers.id,
+                                self.AllUsers.password_hash,
+                                self.AllUsers.pubkey).filter_by(name=username).first()
+        if row is None:
+            return None
+        user = CachedUser(row.id, username, row.password_hash, row.pubkey)
+        self.directory.put(user)
+        return user
+
+    @staticmethod
+    def wait_pending(future: Future | None) -> None:
+        """ Ожидает завершения команды потока записи, если она есть.
+        Ошибка команды уже записана в журнал потоком записи. """
+        if future is not None:
+            wait((future,))
+
+    def forget_user(self, username: str) -> None:
+        """ Метод удаляет пользователя из кэша справочника, например
+        когда данные пользователя изменил другой процесс-обработчик.
+        :param username: Уникальный логин пользователя. """
+        self.directory.discard(username)
+
+    def load_contacts(self, user: CachedUser) -> dict:
+        """ Метод получения контактов пользователя, при первом
+        обращении загружает их из User_contacts.
+        :param user: Запись справочника пользователей.
+        :return: Словарь имя контакта -> идентификатор. """
+        if user.contacts is None:
+            with self.Session() as session:
+                query = session.query(self.AllUsers.name, self.AllUsers.id). \
+                    join(self.UserContacts, self.UserContacts.contact == self.AllUsers.id). \
+                    filter(self.UserContacts.user_id == user.id). \
+                    order_by(self.UserContacts.id)
+                user.contacts = dict(query.all())
+        return user.contacts
+
+    @timed(DB_CALL_SECONDS)
     def get_hash(self, username: str) -> bytes:
         """ Метод получения хэш-пароля пользователя.
         :param username: Уникальный логин пользователя.
         :return: Хэш-пароль пользователя из базы. """
+        user = self.get_user(username)
+        return user.password_hash if user is not None else None
 
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-        return user.password_hash
-
+    @timed(DB_CALL_SECONDS)
     def get_pubkey(self, username: str) -> str:
         """ Метод получения публичного ключа пользователя.
         :param username: Уникальный логин пользователя.
         :return: Публичный ключ пользователя из базы. """
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-        return user.pubkey
+        user = self.get_user(username)
+        return user.pubkey if user is not None else None
 
+    @timed(DB_CALL_SECONDS)
     def check_user(self, username: str) -> bool:
         """ Метод проверяющий существование пользователя.
         :param username: Уникальный логин пользователя.
         :return: True, если пользователь есть в базе, иначе False """
-        if self.session.query(self.AllUsers).filter_by(name=username).count():
-            return True
-        else:
-            return False
+        return self.get_user(username) is not None
 
+    @timed(DB_CALL_SECONDS)
     def user_logout(self, username: str) -> None:
         """ Метод фиксирующий отключения пользователя.
         :param username: Уникальный логин пользователя, которого нужно удалить. """
-        # Находим пользователя в представлении AllUsers.
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
+        # Находим пользователя в справочнике.
+        user = self.get_user(username)
+        if user is None:
+            return
         # Удаляем его из таблицы активных пользователей.
-        self.session.query(self.ActiveUsers).filter_by(user_id=user.id).delete()
-        # Применяем изменения.
-        self.session.commit()
+        self.writer.submit(self.write_logout, user.id)
+
+    def write_logout(self, session, user_id: int) -> None:
+        """ Команда потока записи для user_logout. """
+        session.query(self.ActiveUsers).filter_by(user_id=user_id).delete()
 
+    @timed(DB_CALL_SECONDS)
+    def process_group_message(self, sender: str, recipients: list[str]) -> None:
+        """ Метод фиксирует отправку сообщения группе: одно отправленное
+        сообщение у отправителя и по одному полученному у каждого участника.
+        :param sender: Уникальный логин отправителя.
+        :param recipients: Логины участников группы, кроме отправителя. """
+        with self.counters_lock:
+            self.pending_sent[sender] += 1
+            self.pending_accepted.update(recipients)
+            self.pending_messages += 1
+            due = self.pending_messages >= self.flush_size
+        if due:
+            self.flush_counters()
+        else:
+            self.flush_counters_if_due()
+
+    @timed(DB_CALL_SECONDS)
     def process_message(self, sender: str, recipient: str) -> None:
         """ Метод фиксирует передачу и получение сообщения и увеличивает
-        значения полей sent и accepted в таблице User_history
+        значения полей sent и accepted в таблице User_history.
+        Счётчики накапливаются в памяти и записываются в базу пакетом
+        по интервалу или размеру (flush_counters), а не на каждое сообщение.
         :param sender: Уникальный логин отправителя.
         :param recipient: Уникальный логин отправителя. """
-        # Получаем ID отправителя и получателя
-        sender = self.session.query(
-            self.AllUsers).filter_by(
-            name=sender).first().id
-        recipient = self.session.query(
-            self.AllUsers).filter_by(
-            name=recipient).first().id
-        # Запрашиваем строки из истории и увеличиваем счётчики
-        sender_row = self.session.query(
-            self.UserHistory).filter_by(
-            user_id=sender).first()
-        sender_row.sent += 1
-        recipient_row = self.session.query(
-            self.UserHistory).filter_by(
-            user_id=recipient).first()
-        recipient_row.accepted += 1
-
-        self.session.commit()
-
+        with self.counters_lock:
+            self.pending_sent[sender] += 1
+            self.pending_accepted[recipient] += 1
+            self.pending_messages += 1
+            due = self.pending_messages >= self.flush_size
+        if due:
+            self.flush_counters()
+        else:
+            self.flush_counters_if_due()
+
+    def flush_counters_if_due(self) -> None:
+        """ Метод записывает накопленные счётчики, если с прошлой записи
+        прошло больше flush_interval секунд. Вызывается также основным
+        циклом сервера, чтобы счётчики не задерживались в памяти при простое. """
+        if self.pending_messages and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush_counters()
+
+    def flush_counters(self) -> Future:
+        """ Метод передаёт накопленные счётчики сообщений потоку записи,
+        который обновляет User_history одним пакетом UPDATE ... SET sent = sent + ?.
+        :return: Future, завершающийся после записи. """
+        with self.counters_lock:
+            self.last_flush = time.monotonic()
+            sent, accepted = self.pending_sent, self.pending_accepted
+            self.pending_sent, self.pending_accepted = Counter(), Counter()
+            self.pending_messages = 0
+        rows = [{'username': username,
+                 'sent_delta': sent[username],
+                 'accepted_delta': accepted[username]}
+                for username in sent.keys() | accepted.keys()]
+        return self.writer.submit(self.write_counters, rows)
+
+    def write_counters(self, session, rows: list[dict]) -> None:
+        """ Команда потока записи для flush_counters. """
+        if rows:
+            session.execute(self.counters_update, rows)
+
+    def close(self) -> None:
+        """ Метод завершения работы с базой: записывает накопленные
+        счётчики сообщений, дожидается выполнения всех команд записи
+        и останавливает поток записи. """
+        self.flush_counters()
+        self.writer.stop()
+        self.database_engine.dispose()
+
+    @timed(DB_CALL_SECONDS)
     def add_contact(self, username: str, contact: str) -> None:
         """ Метод добавления контакта для пользователя.
         :param username: Имя пользователя, к которому добавляется контакт.
         :param contact: Имя пользователя, который добавляется, как новый контакт. """
-        # Получаем ID пользователей
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-        contact = self.session.query(self.AllUsers).filter_by(name=contact).first()
+        # Получаем пользователей из справочника
+        user = self.get_user(username)
+        contact = self.get_user(contact)
 
         # Проверяем что не дубль и что контакт может существовать (полю
         # пользователь мы доверяем)
-        if not contact or self.session.query(
-                self.UserContacts).filter_by(user_id=user.id,
-                                             contact=contact.id).count():
+        if not contact or contact.name in self.load_contacts(user):
             return
 
-        # Создаём объект и заносим его в базу
-        new_contact = self.UserContacts(user.id, contact.id)
-        self.session.add(new_contact)
-        self.session.commit()
+        # Заносим контакт в справочник и передаём запись в базу
+        user.contacts[contact.name] = contact.id
+        self.directory.pin(user.name, self.writer.submit(self.write_contact, user.id, contact.id))
+
+    def write_contact(self, session, user_id: int, contact_id: int) -> None:
+        """ Команда потока записи для add_contact. """
+        session.add(self.UserContacts(user_id, contact_id))
+        self.log_change(session, user_id, self.get_name(session, contact_id), True)
 
     # Функция удаляет контакт из базы данных
+    @timed(DB_CALL_SECONDS)
     def remove_contact(self, username: str, contact: str) -> None:
         """ Функция удаляет контакт из таблицы User_contacts.
         :param username: Имя пользователя, у которого удаляется контакт.
         :param contact: Имя пользователя, который удаляется, как контакт. """
-        # Получаем ID пользователей
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-        contact = self.session.query(self.AllUsers).filter_by(name=contact).first()
+        # Получаем пользователей из справочника
+        user = self.get_user(username)
+        contact = self.get_user(contact)
 
         # Проверяем что контакт может существовать (полю пользователь мы
         # доверяем)
@@ -313,32 +621,335 @@ class ServerStorage:
             return
 
         # Удаляем требуемое
-        self.session.query(self.UserContacts).filter(self.UserContacts.user_id == user.id,
-                                                     self.UserContacts.contact == contact.id).delete()
-        self.session.commit()
-
+        if user.contacts is not None:
+            user.contacts.pop(contact.name, None)
+        self.directory.pin(user.name, self.writer.submit(self.write_remove_contact, user.id, contact.id))
+
+    def write_remove_contact(self, session, user_id: int, contact_id: int) -> None:
+        """ Команда потока записи для remove_contact. """
+        if session.query(self.UserContacts).filter(self.UserContacts.user_id == user_id,
+                                                   self.UserContacts.contact == contact_id).delete():
+            self.log_change(session, user_id, self.get_name(session, contact_id), False)
+
+    def get_name(self, session, user_id: int) -> str:
+        """ Метод возвращает имя пользователя по идентификатору. """
+        return session.query(self.AllUsers.name).filter_by(id=user_id).scalar()
+
+    def log_change(self, session, owner_id: int | None, name: str, added: bool) -> None:
+        """ Метод записи изменения в журнал Directory_changes, вызывается
+        в командах потока записи. Записи старше DIRECTORY_LOG_SIZE удаляются.
+        :param session: Сессия потока записи.
+        :param owner_id: Владелец контакт-листа или None для списка пользователей.
+        :param name: Имя добавленного или удалённого пользователя.
+        :param added: True - имя добавлено, False - удалено. """
+        change = self.DirectoryChange(owner_id, name, added)
+        session.add(change)
+        session.flush()
+        session.query(self.DirectoryChange).filter(
+            self.DirectoryChange.id <= change.id - DIRECTORY_LOG_SIZE).delete()
+
+    def load_changes(self, session, owner_id: int | None, version: int | None) -> tuple | None:
+        """ Метод получения изменений списка после версии клиента.
+        :param session: Сессия чтения.
+        :param owner_id: Владелец контакт-листа или None для списка пользователей.
+        :param version: Версия списка у клиента.
+        :return: Кортеж (текущая версия, добавленные, удалённые) или None,
+                 если изменений после этой версии в журнале уже нет и клиенту
+                 нужен полный список. """
+        first, current = session.query(func.min(self.DirectoryChange.id),
+                                       func.max(self.DirectoryChange.id)).one()
+        current = current or 0
+        if version is None or version > current or (first is not None and version < first - 1):
+            return None
+        # Для каждого имени важно только последнее изменение.
+        changes = dict()
+        query = session.query(self.DirectoryChange.name, self.DirectoryChange.added). \
+            filter(self.DirectoryChange.owner_id == owner_id,
+                   self.DirectoryChange.id > version). \
+            order_by(self.DirectoryChange.id)
+        for name, added in query:
+            changes[name] = added
+        return (current,
+                [name for name, added in changes.items() if added],
+                [name for name, added in changes.items() if not added])
+
+    @timed(DB_CALL_SECONDS)
+    def get_directory_version(self) -> int:
+        """ Метод возвращает текущую версию списков пользователей и контактов.
+        :return: Номер последнего изменения в журнале. """
+        with self.Session() as session:
+            return session.query(func.max(self.DirectoryChange.id)).scalar() or 0
+
+    @timed(DB_CALL_SECONDS)
+    def get_users_changes(self, version: int | None) -> tuple:
+        """ Метод возвращает изменения списка известных пользователей.
+        :param version: Версия списка у клиента или None.
+        :return: Кортеж (версия, полный список, добавленные, удалённые): если
+                 клиенту достаточно изменений, полный список - None, иначе
+                 None - списки изменений. """
+        # Версия и список читаются в одной транзакции.
+        with self.Session() as session:
+            changes = self.load_changes(session, None, version)
+            if changes is not None:
+                return changes[0], None, changes[1], changes[2]
+            current = session.query(func.max(self.DirectoryChange.id)).scalar() or 0
+            names = [row[0] for row in session.query(self.AllUsers.name)]
+            return current, names, None, None
+
+    @timed(DB_CALL_SECONDS)
+    def get_contacts_changes(self, username: str, version: int | None) -> tuple:
+        """ Метод возвращает изменения контакт-листа пользователя.
+        :param username: Имя пользователя.
+        :param version: Версия контакт-листа у клиента или None.
+        :return: Кортеж (версия, полный список, добавленные, удалённые),
+                 как у get_users_changes. """
+        user = self.get_user(username)
+        with self.Session() as session:
+            changes = self.load_changes(session, user.id, version)
+            if changes is not None:
+                return changes[0], None, changes[1], changes[2]
+            current = session.query(func.max(self.DirectoryChange.id)).scalar() or 0
+        # Версия читается до списка из справочника: изменение, попавшее
+        # в справочник, но ещё не в журнал, клиент получит повторно.
+        return current, self.get_contacts(username), None, None
+
+    @timed(DB_CALL_SECONDS)
+    def store_message(self, recipient: str, message: dict) -> bool:
+        """ Метод сохранения сообщения для пользователя не в сети.
+        Запись выполняется потоком записи.
+        :param recipient: Уникальный логин получателя.
+        :param message: Сообщение JIM.
+        :return: True, если получатель зарегистрирован и сообщение сохраняется. """
+        user = self.get_user(recipient)
+        if user is None:
+            return False
+        self.writer.submit(self.write_offline_message, user.id, json.dumps(message), datetime.now())
+        return True
+
+    def write_offline_message(self, session, recipient_id: int, message: str, created: datetime) -> None:
+        """ Команда потока записи для store_message. """
+        session.add(self.OfflineMessage(recipient_id, message, created))
+
+    @timed(DB_CALL_SECONDS)
+    def store_group_message(self, recipients: list[str], message: dict) -> None:
+        """ Метод сохранения сообщения группе для участников не в сети.
+        Сообщение сериализуется один раз, строки для всех участников
+        добавляются одной командой потока записи.
+        :param recipients: Логины участников не в сети.
+        :param message: Сообщение JIM. """
+        recipient_ids = [user.id for user in map(self.get_user, recipients) if user is not None]
+        if recipient_ids:
+            self.writer.submit(self.write_group_offline, recipient_ids,
+                               json.dumps(message), datetime.now())
+
+    def write_group_offline(self, session, recipient_ids: list[int], message: str,
+                            created: datetime) -> None:
+        """ Команда потока записи для store_group_message. """
+        session.add_all([self.OfflineMessage(recipient_id, message, created)
+                         for recipient_id in recipient_ids])
+
+    @timed(DB_CALL_SECONDS)
+    def get_offline_messages(self, username: str, after_id: int, limit: int) -> Future:
+        """ Метод получения страницы сохранённых сообщений пользователя.
+        Выбирает по индексу (recipient_id, id) не больше limit сообщений,
+        поэтому размер ответа не зависит от количества ожидающих сообщений.
+        Выборка выполняется командой потока записи: команды выполняются
+        по порядку, поэтому в страницу попадают сообщения, сохранённые
+        перед запросом, а вызывающий поток не ждёт базу.
+        :param username: Уникальный логин получателя.
+        :param after_id: Номер последнего полученного сообщения.
+        :param limit: Максимальное количество сообщений.
+        :return: Future со списком сообщений JIM с номером в поле OFFLINE_ID. """
+        user = self.get_user(username)
+        if user is None:
+            future = Future()
+            future.set_result([])
+            return future
+        return self.writer.submit(self.read_offline_messages, user.id, after_id, limit)
+
+    def read_offline_messages(self, session, recipient_id: int, after_id: int, limit: int) -> list[dict]:
+        """ Команда потока записи для get_offline_messages. Сессия потока
+        записи видит и ещё не зафиксированные сообщения своей транзакции. """
+        rows = session.query(self.OfflineMessage.id, self.OfflineMessage.message). \
+            filter(self.OfflineMessage.recipient_id == recipient_id,
+                   self.OfflineMessage.id > after_id). \
+            order_by(self.OfflineMessage.id).limit(limit).all()
+        messages = []
+        for message_id, text in rows:
+            message = json.loads(text)
+            message[OFFLINE_ID] = message_id
+            messages.append(message)
+        return messages
+
+    @timed(DB_CALL_SECONDS)
+    def ack_offline_messages(self, username: str, last_id: int) -> None:
+        """ Метод удаления сообщений, получение которых подтвердил пользователь.
+        :param username: Уникальный логин получателя.
+        :param last_id: Номер последнего полученного сообщения. """
+        user = self.get_user(username)
+        if user is not None and last_id > 0:
+            self.writer.submit(self.write_offline_ack, user.id, last_id)
+
+    def write_offline_ack(self, session, recipient_id: int, last_id: int) -> None:
+        """ Команда потока записи для ack_offline_messages. """
+        session.query(self.OfflineMessage).filter(self.OfflineMessage.recipient_id == recipient_id,
+                                                  self.OfflineMessage.id <= last_id).delete()
+
+    @timed(DB_CALL_SECONDS)
+    def get_group(self, name: str) -> CachedGroup | None:
+        """ Метод получения записи справочника групп.
+        При отсутствии записи в кэше загружает группу и её участников.
+        :param name: Уникальное имя группы.
+        :return: Запись справочника или None, если группы нет. """
+        group = self.groups.get(name)
+        if group is not None:
+            return group
+        # Группу удалили из справочника (forget_group) до записи её изменений.
+        self.wait_pending(self.groups.pending_write(name))
+        with self.Session() as session:
+            group_id = session.query(self.Groups.id).filter_by(name=name).scalar()
+            if group_id is None:
+                return None
+            members = session.query(self.AllUsers.name, self.AllUsers.id). \
+                join(self.GroupMembers, self.GroupMembers.user_id == self.AllUsers.id). \
+                filter(self.GroupMembers.group_id == group_id).all()
+        group = CachedGroup(group_id, name, dict(members))
+        self.groups.put(group)
+        return group
+
+    def forget_group(self, name: str) -> None:
+        """ Метод удаляет группу из кэша справочника, например когда
+        участников изменил другой процесс-обработчик.
+        :param name: Уникальное имя группы. """
+        self.groups.discard(name)
+
+    def pending_group_write(self, name: str) -> Future | None:
+        """ Незавершённая команда записи изменений группы, если она есть.
+        :param name: Уникальное имя группы. """
+        return self.groups.pending_write(name)
+
+    @timed(DB_CALL_SECONDS)
+    def create_group(self, name: str, username: str) -> bool:
+        """ Метод создания группы, создатель становится её участником.
+        Группа сразу заносится в справочник, запись в базу не ожидается.
+        Если имя успел занять другой обработчик, запись не выполнится
+        и группа будет удалена из справочника.
+        :param name: Уникальное имя группы.
+        :param username: Уникальный логин создателя.
+        :return: True, если группа создана, False - если имя занято. """
+        user = self.get_user(username)
+        if user is None or self.get_group(name) is not None:
+            return False
+        group = CachedGroup(None, name, {username: user.id})
+        self.groups.put(group)
+        future = self.writer.submit(self.write_group, name, user.id)
+        self.groups.pin(name, future)
+        future.add_done_callback(lambda done: self.group_written(group, done))
+        return True
+
+    def group_written(self, group: CachedGroup, future: Future) -> None:
+        """ Завершение записи новой группы, вызывается потоком записи.
+        :param group: Запись справочника групп.
+        :param future: Future команды write_group. """
+        if future.exception() is None:
+            group.id = future.result()
+        elif self.groups.get(group.name) is group:
+            self.groups.discard(group.name)
+
+    def write_group(self, session, name: str, user_id: int) -> int:
+        """ Команда потока записи для create_group.
+        :return: Идентификатор новой группы. """
+        group = self.Groups(name, datetime.now())
+        session.add(group)
+        session.flush()
+        session.add(self.GroupMembers(group.id, user_id))
+        return group.id
+
+    @timed(DB_CALL_SECONDS)
+    def join_group(self, name: str, username: str) -> bool:
+        """ Метод добавления пользователя в участники группы.
+        Участник сразу заносится в справочник, запись в базу не ожидается.
+        :param name: Уникальное имя группы.
+        :param username: Уникальный логин пользователя.
+        :return: True, если пользователь - участник группы. """
+        group = self.get_group(name)
+        user = self.get_user(username)
+        if group is None or user is None:
+            return False
+        if username not in group.members:
+            group.members[username] = user.id
+            self.groups.pin(name, self.writer.submit(self.write_group_member, name, user.id))
+        return True
+
+    def group_id(self, session, name: str) -> int:
+        """ Метод возвращает идентификатор группы по имени. Новая группа
+        получает идентификатор только при записи, поэтому команды
+        изменения участников передают имя группы. """
+        return session.query(self.Groups.id).filter_by(name=name).scalar()
+
+    def write_group_member(self, session, name: str, user_id: int) -> None:
+        """ Команда потока записи для join_group. """
+        session.add(self.GroupMembers(self.group_id(session, name), user_id))
+
+    @timed(DB_CALL_SECONDS)
+    def leave_group(self, name: str, username: str) -> bool:
+        """ Метод удаления пользователя из участников группы.
+        :param name: Уникальное имя группы.
+        :param username: Уникальный логин пользователя.
+        :return: True, если пользователь был участником группы. """
+        group = self.get_group(name)
+        if group is None or username not in group.members:
+            return False
+        user_id = group.members.pop(username)
+        self.groups.pin(name, self.writer.submit(self.write_remove_group_member, name, user_id))
+        return True
+
+    def write_remove_group_member(self, session, name: str, user_id: int) -> None:
+        """ Команда потока записи для leave_group. """
+        session.query(self.GroupMembers).filter(self.GroupMembers.group_id == self.group_id(session, name),
+                                                self.GroupMembers.user_id == user_id).delete()
+
+    @timed(DB_CALL_SECONDS)
+    def get_user_groups(self, username: str) -> list[str]:
+        """ Метод возвращает группы, участником которых является пользователь.
+        :param username: Уникальный логин пользователя.
+        :return: Список имён групп. """
+        user = self.get_user(username)
+        if user is None:
+            return []
+        with self.Session() as session:
+            query = session.query(self.Groups.name). \
+                join(self.GroupMembers, self.GroupMembers.group_id == self.Groups.id). \
+                filter(self.GroupMembers.user_id == user.id).order_by(self.Groups.name)
+            return [row[0] for row in query.all()]
+
+    @timed(DB_CALL_SECONDS)
     def get_users_list(self) -> list[[tuple]]:
         """ Метод возвращает список известных пользователей
         со временем последнего входа.
         :return: Список кортежей из имён и времени последнего входа. """
         # Запрос пользователей из таблицы All_users.
-        query = self.session.query(self.AllUsers.name,
-                                   self.AllUsers.last_login)
-        # Возвращаем список кортежей.
-        return query.all()
+        with self.Session() as session:
+            query = session.query(self.AllUsers.name,
+                                  self.AllUsers.last_login)
+            # Возвращаем список кортежей.
+            return query.all()
 
+    @timed(DB_CALL_SECONDS)
     def get_active_users_list(self) -> list[[tuple]]:
         """ Метод возвращает список активных пользователей.
         :return: Список кортежей из имён, ip-адреса, порта и времени последнего входа. """
         # Запрашиваем соединение таблиц и собираем кортежи имя, адрес, порт, время.
-        query = self.session.query(self.AllUsers.name,
-                                   self.ActiveUsers.ip_address,
-                                   self.ActiveUsers.port,
-                                   self.ActiveUsers.login_time
-                                   ).join(self.AllUsers)
-        # Возвращаем список кортежей.
-        return query.all()
-
+        with self.Session() as session:
+            query = session.query(self.AllUsers.name,
+                                  self.ActiveUsers.ip_address,
+                                  self.ActiveUsers.port,
+                                  self.ActiveUsers.login_time
+                                  ).join(self.AllUsers)
+            # Возвращаем список кортежей.
+            return query.all()
+
+    @timed(DB_CALL_SECONDS)
     def get_login_history(self, username: str = None) -> list[[tuple]]:
         """ Метод возвращает историю входов
         по конкретному пользователю или всем пользователям.
@@ -346,47 +957,44 @@ class ServerStorage:
                          если None, то возвращается история входов по всем пользователям.
         :return: Список кортежей из имён, ip-адреса, порта и времени входа. """
         # Запрашиваем соединение таблиц для истории входа.
-        query = self.session.query(self.AllUsers.name,
-                                   self.LoginHistory.ip_address,
-                                   self.LoginHistory.port,
-                                   self.LoginHistory.date_time,
-                                   ).join(self.AllUsers)
-        # Если было указано имя пользователя, то фильтруем по этому имени
-        if username:
-            query = query.filter(self.AllUsers.name == username)
-        # Возвращаем список кортежей
-        return query.all()
-
+        with self.Session() as session:
+            query = session.query(self.AllUsers.name,
+                                  self.LoginHistory.ip_address,
+                                  self.LoginHistory.port,
+                                  self.LoginHistory.date_time,
+                                  ).join(self.AllUsers)
+            # Если было указано имя пользователя, то фильтруем по этому имени
+            if username:
+                query = query.filter(self.AllUsers.name == username)
+            # Возвращаем список кортежей
+            return query.all()
+
+    @timed(DB_CALL_SECONDS)
     def get_contacts(self, username: str) -> list[str]:
         """ Метод возвращает список контактов пользователя.
         :param username: Имя пользователя, чьи контакты хотим получить.
         :return: Список с именами контактов. """
-        # Запрашиваем указанного пользователя.
-        user = self.session.query(self.AllUsers).filter_by(name=username).one()
-
-        # Запрашиваем его список контактов
-        query = self.session.query(self.UserContacts, self.AllUsers.name). \
-            filter_by(user_id=user.id). \
-            join(self.AllUsers, self.UserContacts.contact == self.AllUsers.id)
-
-        # Выбираем только имена пользователей и возвращаем их.
-        contact_names = [contact[1] for contact in query.all()]
-        return contact_names
+        # Берём список контактов из справочника.
+        return list(self.load_contacts(self.get_user(username)))
 
+    @timed(DB_CALL_SECONDS)
     def get_message_history(self) -> list[[tuple]]:
         """ Метод возвращает количество переданных и полученных сообщений.
+        Перед запросом дожидается записи накопленных счётчиков, чтобы
+        статистика была актуальной.
         :return: Список кортежей из имён пользователей, их времени входа,
                  кол-во отправленных и полученных сообщений. """
-        query = self.session.query(
-            self.AllUsers.name,
-            self.AllUsers.last_login,
-            self.UserHistory.sent,
-            self.UserHistory.accepted
-        ).join(self.AllUsers)
-
-        # Возвращаем список кортежей
-        return query.all()
-
+        self.flush_counters().result()
+        with self.Session() as session:
+            query = session.query(
+                self.AllUsers.name,
+                self.AllUsers.last_login,
+                self.UserHistory.sent,
+                self.UserHistory.accepted
+            ).join(self.AllUsers)
+
+            # Возвращаем список кортежей
+            return query.all()
 
 # Отладка
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class PendingWrites:
+    """ Незавершённые команды потока записи по именам. Поток записи
+    выполняет команды по порядку, поэтому для каждого имени достаточно
+    помнить последнюю команду: после неё завершены и все предыдущие. """
+
+    def __init__(self):
+        # Имя -> Future последней команды записи.
+        self.futures = dict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            return name in self.futures
+
+    def pin(self, name: str, future: Future) -> None:
+        """ Запоминает команду до её завершения.
+        :param name: Имя, к которому относятся изменения.
+        :param future: Future команды потока записи. """
+        with self.lock:
+            self.futures[name] = future
+        future.add_done_callback(lambda done: self.unpin(name, done))
+
+    def unpin(self, name: str, future: Future) -> None:
+        """ Забывает команду, если после неё команд по имени не было. """
+        with self.lock:
+            if self.futures.get(name) is future:
+                del self.futures[name]
+
+    def get(self, name: str) -> Future | None:
+        """ Незавершённая команда записи по имени, если она есть. """
+        with self.lock:
+            return self.futures.get(name)
+
+
+class CachedUser:
+    """ Запись справочника пользователей: данные из All_users
+    и, после первого запроса, список контактов. """
+    __slots__ = ('id', 'name', 'password_hash', 'pubkey', 'contacts')
+
+    def __init__(self, user_id: int, username: str, password_hash: bytes, pubkey: str):
+        """
+        :param user_id: Идентификатор пользователя в All_users.
+        :param username: Уникальный логин пользователя.
+        :param password_hash: Хэш-пароль пользователя.
+        :param pubkey: Публичный ключ пользователя.
+        """
+        self.id = user_id
+        self.name = username
+        self.password_hash = password_hash
+        self.pubkey = pubkey
+        # Контакты: имя -> идентификатор, None - ещё не загружены.
+        self.contacts = None
+
+
+class UserDirectory:
+    """ Справочник пользователей в памяти с вытеснением давно
+    не использованных записей (LRU). Хранит только существующих
+    пользователей, отсутствие записи означает, что её нужно загрузить
+    из базы. Методы вызываются из потока сервера и из GUI,
+    поэтому доступ защищён блокировкой.
+    Запись, изменения которой ещё не записаны в базу, закреплена
+    и не вытесняется: загруженная заново из базы, она потеряла бы их. """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: Максимальное количество записей.
+        """
+        self.capacity = capacity
+        self.users = OrderedDict()
+        # Закреплённые записи.
+        self.pending = PendingWrites()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def get(self, username: str) -> CachedUser | None:
+        """ Запись пользователя, если она есть в справочнике. """
+        with self.lock:
+            user = self.users.get(username)
+            if user is not None:
+                self.users.move_to_end(username)
+            return user
+
+    def put(self, user: CachedUser) -> None:
+        """ Добавляет запись, вытесняя самую давнюю при переполнении. """
+        with self.lock:
+            self.users[user.name] = user
+            self.users.move_to_end(user.name)
+            excess = len(self.users) - self.capacity
+            if excess > 0:
+                # Закреплённые записи пропускаются, пока их изменения
+                # не записаны; справочник может ненадолго превысить размер.
+                evicted = []
+                for name in self.users:
+                    if len(evicted) == excess:
+                        break
+                    if name not in self.pending:
+                        evicted.append(name)
+                for name in evicted:
+                    del self.users[name]
+
+    def pin(self, name: str, future: Future) -> None:
+        """ Закрепляет запись до завершения команды записи её изменений.
+        :param name: Имя записи.
+        :param future: Future команды потока записи. """
+        self.pending.pin(name, future)
+
+    def pending_write(self, name: str) -> Future | None:
+        """ Незавершённая команда записи изменений записи, если она есть. """
+        return self.pending.get(name)
+
+    def discard(self, username: str) -> None:
+        """ Удаляет запись пользователя, если она есть. """
+        with self.lock:
+            self.users.pop(username, None)
+
+    def forget_contact(self, username: str) -> None:
+        """ Удаляет пользователя из загруженных списков контактов. """
+        with self.lock:
+            for user in self.users.values():
+                if user.contacts is not None:
+                    user.contacts.pop(username, None)
+
+
+class CachedGroup:
+    """ Запись справочника групп: данные из Groups и участники. """
+    __slots__ = ('id', 'name', 'members')
+
+    def __init__(self, group_id: int, name: str, members: dict):
+        """
+        :param group_id: Идентификатор группы в Groups, None - группа ещё не записана в базу.
+        :param name: Уникальное имя группы.
+        :param members: Участники: имя -> идентификатор пользователя.
+        """
+        self.id = group_id
+        self.name = name
+        self.members = members
+
+
+class GroupDirectory(UserDirectory):
+    """ Справочник групп в памяти с вытеснением давно не использованных
+    записей (LRU). Участники группы нужны при каждом сообщении группе,
+    поэтому рассылка не обращается к базе. """
+
+    def forget_contact(self, username: str) -> None:
+        """ Удаляет пользователя из участников групп. """
+        with self.lock:
+            for group in self.users.values():
+                group.members.pop(username, None)
@@ -0,0 +1,310 @@
+import threading
+from time import perf_counter
+from bisect import bisect_left
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from common.settings import METRICS_AUTH_BUCKETS, METRICS_DB_BUCKETS
+from logs.config_server_log import create_server_logger
+
+# Загрузка логгера.
+logger = create_server_logger('metrics')
+
+# Тип содержимого текстового формата Prometheus.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value: float) -> str:
+    """ Число в записи формата Prometheus. """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    """ Метки в записи формата Prometheus: {name="value",...}. """
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class MetricsRegistry:
+    """ Реестр метрик процесса. Собирает значения всех метрик
+    в текстовый формат Prometheus при запросе. """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: 'Metric') -> None:
+        """ Добавляет метрику в реестр. """
+        self.metrics.append(metric)
+
+    def exposition(self) -> str:
+        """ Текущие значения метрик в текстовом формате Prometheus.
+        :return: Текст для ответа на GET /metrics. """
+        lines = []
+        for metric in self.metrics:
+            samples = metric.samples()
+            if samples is None:
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+# Реестр метрик сервера.
+REGISTRY = MetricsRegistry()
+
+
+class Metric:
+    """ Базовый класс метрики с раздельными значениями для каждого потока.
+    Поток изменяет только свой словарь значений, поэтому счётчики
+    не требуют блокировок: поток сервера, поток записи базы и GUI
+    не ждут друг друга. Значения потоков суммируются при чтении.
+    Блокировка берётся только при первом обращении нового потока. """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 registry: MetricsRegistry = REGISTRY):
+        """
+        :param name: Имя метрики.
+        :param documentation: Описание метрики для строки HELP.
+        :param labelnames: Имена меток.
+        :param registry: Реестр, в котором публикуется метрика.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.local = threading.local()
+        # Словари значений всех потоков, обращавшихся к метрике.
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        registry.register(self)
+
+    def shard(self) -> dict:
+        """ Создаёт словарь значений текущего потока: метки -> значение.
+        Методы записи вызывают его, только если у потока словаря ещё нет. """
+        values = self.local.values = dict()
+        with self.shards_lock:
+            self.shards.append(values)
+        return values
+
+    def collect(self) -> list[tuple]:
+        """ Значения потоков по меткам: список пар (метки, значения потока).
+        Копия словаря снимается целиком под GIL, поэтому её можно
+        делать, пока поток-владелец продолжает запись. """
+        with self.shards_lock:
+            shards = list(self.shards)
+        return [item for shard in shards for item in dict(shard).items()]
+
+    def samples(self) -> list[str] | None:
+        """ Строки значений метрики в формате Prometheus,
+        None - метрику не публиковать. """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """ Монотонно возрастающий счётчик. """
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: int = 1) -> None:
+        """ Увеличивает счётчик.
+        :param labels: Значения меток в порядке labelnames.
+        :param amount: Величина увеличения. """
+        try:
+            values = self.local.values
+        except AttributeError:
+            values = self.shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, labels: tuple = ()) -> int:
+        """ Сумма значений всех потоков для меток labels. """
+        return sum(value for key, value in self.collect() if key == labels)
+
+    def samples(self) -> list[str]:
+        totals = dict()
+        for labels, value in self.collect():
+            totals[labels] = totals.get(labels, 0) + value
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                for labels, value in sorted(totals.items())]
+
+
+class Histogram(Metric):
+    """ Гистограмма: количество наблюдений по корзинам и их сумма.
+    Значения потока для набора меток хранятся списком:
+    количество в каждой корзине, в корзине +Inf и сумма наблюдений. """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = METRICS_AUTH_BUCKETS, registry: MetricsRegistry = REGISTRY):
+        """
+        :param buckets: Верхние границы корзин по возрастанию, без +Inf.
+        """
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        """ Добавляет наблюдение.
+        :param value: Наблюдаемая величина.
+        :param labels: Значения меток в порядке labelnames. """
+        try:
+            values = self.local.values
+        except AttributeError:
+            values = self.shard()
+        cells = values.get(labels)
+        if cells is None:
+            cells = values[labels] = [0] * (len(self.buckets) + 2)
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def samples(self) -> list[str]:
+        totals = dict()
+        for labels, cells in self.collect():
+            total = totals.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for index, cell in enumerate(list(cells)):
+                total[index] += cell
+        lines = []
+        names = self.labelnames + ('le',)
+        for labels, cells in sorted(totals.items()):
+            count = 0
+            for bound, cell in zip(self.buckets + (float('inf'),), cells):
+                count += cell
+                lines.append(f'{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {count}')
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {format_value(cells[-1])}')
+            lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    """ Мгновенное значение, которое вычисляется функцией при запросе метрик.
+    Сервер при работе ничего не записывает: размеры очередей и количество
+    клиентов читаются из его структур только во время опроса. """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, registry: MetricsRegistry = REGISTRY):
+        super().__init__(name, documentation, (), registry)
+        self.function = None
+
+    def set_function(self, function) -> None:
+        """ Задаёт функцию без аргументов, возвращающую значение. """
+        self.function = function
+
+    def samples(self) -> list[str] | None:
+        if self.function is None:
+            return None
+        try:
+            value = self.function()
+        except Exception as err:
+            # Структуры сервера могли измениться во время чтения из другого потока.
+            logger.debug('Ошибка вычисления метрики %s', self.name, exc_info=err)
+            return None
+        return [f'{self.name} {format_value(value)}']
+
+
+def timed(histogram: Histogram):
+    """ Декоратор, записывающий длительность вызова функции
+    в гистограмму с меткой - именем функции.
+    :param histogram: Гистограмма с одной меткой. """
+    def decorator(func):
+        labels = (func.__name__,)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started, labels)
+
+        return wrapper
+
+    return decorator
+
+
+# Метрики сервера.
+MESSAGES = Counter('chat_messages_total', 'Сообщения клиентов по действиям JIM.', ('action',))
+BYTES_RECEIVED = Counter('chat_received_bytes_total', 'Байт принято от клиентов.')
+BYTES_SENT = Counter('chat_sent_bytes_total', 'Байт передано в сокеты клиентов.')
+AUTH_SECONDS = Histogram('chat_auth_duration_seconds',
+                         'Длительность авторизации от сообщения presence до ответа клиента, сек.',
+                         ('result',), METRICS_AUTH_BUCKETS)
+DB_CALL_SECONDS = Histogram('chat_db_call_duration_seconds',
+                            'Длительность вызовов ServerStorage, сек.',
+                            ('method',), METRICS_DB_BUCKETS)
+DB_TRANSACTION_SECONDS = Histogram('chat_db_transaction_duration_seconds',
+                                   'Длительность транзакций потока записи базы, сек.',
+                                   buckets=METRICS_DB_BUCKETS)
+DB_WRITER_QUEUE = Gauge('chat_db_writer_queue_length', 'Команды в очереди потока записи базы.')
+CONNECTED_CLIENTS = Gauge('chat_connected_clients', 'Подключённые клиенты.')
+AUTHORIZED_USERS = Gauge('chat_authorized_users', 'Авторизованные пользователи.')
+OUTBOUND_BYTES = Gauge('chat_outbound_pending_bytes', 'Неотправленные байты в исходящих буферах клиентов.')
+OUTBOUND_MAX_BYTES = Gauge('chat_outbound_max_pending_bytes',
+                           'Наибольший исходящий буфер клиента, байт.')
+CONGESTED_CLIENTS = Gauge('chat_congested_clients', 'Клиенты с исходящим буфером выше верхней границы.')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """ Обработчик HTTP-запросов: GET /metrics отдаёт метрики реестра сервера. """
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug('Запрос метрик %s: ' + format, self.address_string(), *args)
+
+
+class MetricsServer(threading.Thread):
+    """ Поток HTTP-сервера метрик. Опрос выполняется в своём потоке
+    и не задерживает обработку сообщений клиентов. """
+
+    def __init__(self, address: str, port: int, registry: MetricsRegistry = REGISTRY):
+        """
+        :param address: IP-адрес для прослушивания.
+        :param port: Порт для прослушивания, 0 - выбрать свободный.
+        :param registry: Реестр публикуемых метрик.
+        """
+        super().__init__(name='metrics-http', daemon=True)
+        self.httpd = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.port = self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self) -> None:
+        """ Останавливает HTTP-сервер и закрывает сокет. """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics_server(address: str, port: int) -> MetricsServer | None:
+    """ Запускает HTTP-сервер метрик. Если порт занят,
+    сервер чата продолжает работу без него.
+    :param address: IP-адрес для прослушивания.
+    :param port: Порт для прослушивания.
+    :return: Запущенный поток или None. """
+    try:
+        server = MetricsServer(address, port)
+    except OSError as err:
+        logger.error('Не удалось запустить сервер метрик на %s:%s: %s', address, port, err)
+        return None
+    server.start()
+    logger.info('Метрики сервера доступны по адресу http://%s:%s/metrics', address, server.port)
+    return server
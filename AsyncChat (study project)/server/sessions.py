@@ -0,0 +1,105 @@
+from datetime import datetime
+from collections.abc import MutableMapping
+
+
+class Session:
+    """ Сессия авторизованного пользователя: соединение
+    и сведения о подключении. """
+    __slots__ = ('username', 'client', 'ip_address', 'port', 'login_time')
+
+    def __init__(self, username: str, client):
+        """
+        :param username: Уникальный логин пользователя.
+        :param client: Сокет (или соединение asyncio) пользователя.
+        """
+        self.username = username
+        self.client = client
+        try:
+            self.ip_address, self.port = client.getpeername()[:2]
+        except (OSError, AttributeError, TypeError, ValueError):
+            self.ip_address, self.port = None, None
+        self.login_time = datetime.now()
+
+
+class PendingAuth:
+    """ Состояние соединения, которому отправлен запрос 511:
+    сервер ждёт ответ клиента, не блокируя обработку остальных. """
+    __slots__ = ('message', 'digest', 'started', 'deadline')
+
+    def __init__(self, message: dict, digest: bytes, started: float, deadline: float):
+        """
+        :param message: Сообщение о присутствии от клиента.
+        :param digest: Ожидаемый от клиента дайджест.
+        :param started: Момент (time.monotonic) получения сообщения о присутствии.
+        :param deadline: Момент (time.monotonic), после которого
+                         соединение без ответа закрывается.
+        """
+        self.message = message
+        self.digest = digest
+        self.started = started
+        self.deadline = deadline
+
+
+class SessionRegistry(MutableMapping):
+    """ Двунаправленный реестр сессий сервера.
+    Снаружи ведёт себя как словарь имя -> соединение (бывший
+    MessageProcessor.names), дополнительно хранит обратный индекс
+    соединение -> сессия, поэтому поиск пользователя по сокету при
+    проверке авторизации, отключении и маршрутизации выполняется за O(1). """
+
+    def __init__(self):
+        self.by_name = dict()
+        self.by_client = dict()
+
+    def __getitem__(self, username: str):
+        return self.by_name[username].client
+
+    def __setitem__(self, username: str, client) -> None:
+        # Имя, занятое другим соединением, не перерегистрируется: иначе
+        # первое соединение осталось бы открытым без сессии.
+        session = self.by_name.get(username)
+        if session is not None and session.client is not client:
+            raise ValueError(f'Имя {username} уже занято другим соединением.')
+        # Соединение, авторизованное под другим именем, теряет старую сессию.
+        self.unregister(client)
+        session = Session(username, client)
+        self.by_name[username] = session
+        self.by_client[client] = session
+
+    def __delitem__(self, username: str) -> None:
+        session = self.by_name.pop(username)
+        del self.by_client[session.client]
+
+    def __iter__(self):
+        return iter(self.by_name)
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+    def __contains__(self, username) -> bool:
+        return username in self.by_name
+
+    def name_of(self, client) -> str | None:
+        """ Имя пользователя, авторизованного на соединении.
+        :param client: Сокет (или соединение asyncio).
+        :return: Имя пользователя или None, если соединение не авторизовано. """
+        session = self.by_client.get(client)
+        return session.username if session is not None else None
+
+    def is_registered(self, client) -> bool:
+        """ Проверяет, авторизован ли пользователь на соединении. """
+        return client in self.by_client
+
+    def session(self, username: str) -> Session | None:
+        """ Сессия пользователя со сведениями о подключении. """
+        return self.by_name.get(username)
+
+    def unregister(self, client) -> str | None:
+        """ Удаляет сессию соединения.
+        :param client: Сокет (или соединение asyncio).
+        :return: Имя пользователя удалённой сессии или None. """
+        session = self.by_client.pop(client, None)
+        if session is None:
+            return None
+        del self.by_name[session.username]
+        return session.username
@@ -0,0 +1,90 @@
+import queue
+import threading
+from time import perf_counter
+from concurrent.futures import Future
+
+from common.settings import DB_WRITER_BATCH
+from logs.config_server_log import create_server_logger
+from server.metrics import DB_TRANSACTION_SECONDS
+
+# Загрузка логгера.
+logger = create_server_logger('writer')
+
+
+class DatabaseWriter(threading.Thread):
+    """ Поток записи в базу данных сервера. Все изменения базы
+    выполняются здесь, в собственной сессии потока. Команды ставятся
+    в очередь и не блокируют вызывающий поток. Накопившиеся в очереди
+    команды выполняются одной транзакцией с одним COMMIT (group commit). """
+
+    def __init__(self, session_factory, batch_size: int = DB_WRITER_BATCH):
+        """
+        :param session_factory: Фабрика сессий SQLAlchemy (sessionmaker).
+        :param batch_size: Максимальное количество команд в одной транзакции.
+        """
+        super().__init__(name='database-writer', daemon=True)
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        # Очередь команд: (Future, функция, аргументы), None - остановка.
+        self.commands = queue.Queue()
+
+    def submit(self, command, *args) -> Future:
+        """ Ставит команду в очередь записи.
+        :param command: Функция command(session, *args), выполняющая изменения.
+        :param args: Аргументы команды.
+        :return: Future, который завершается после COMMIT транзакции
+                 с результатом команды или её исключением. """
+        future = Future()
+        self.commands.put((future, command, args))
+        return future
+
+    def stop(self) -> None:
+        """ Выполняет уже поставленные команды и останавливает поток. """
+        self.commands.put(None)
+        self.join()
+
+    def run(self):
+        session = self.session_factory()
+        running = True
+        while running:
+            batch = [self.commands.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.commands.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if batch:
+                started = perf_counter()
+                self.execute(session, batch)
+                DB_TRANSACTION_SECONDS.observe(perf_counter() - started)
+        session.close()
+
+    def execute(self, session, batch: list) -> None:
+        """ Выполняет пачку команд одной транзакцией. Если одна из команд
+        завершилась ошибкой, транзакция откатывается и команды выполняются
+        по одной, чтобы ошибка не отменила изменения остальных.
+        :param session: Сессия потока записи.
+        :param batch: Список команд (Future, функция, аргументы). """
+        try:
+            results = [command(session, *args) for _, command, args in batch]
+            session.commit()
+        except Exception:
+            session.rollback()
+        else:
+            for (future, _, _), result in zip(batch, results):
+                future.set_result(result)
+            return
+
+        for future, command, args in batch:
+            try:
+                result = command(session, *args)
+                session.commit()
+            except Exception as err:
+                session.rollback()
+                logger.error('Ошибка записи в базу данных: %s%s', command.__name__, args, exc_info=err)
+                future.set_exception(err)
+            else:
+                future.set_result(result)
@@ -0,0 +1,11 @@
+"""Unit-тесты. Журналы тестов пишутся во временный каталог,
+а не в logs/ исходников."""
+
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.settings import LOG_DIR_ENV
+
+os.environ.setdefault(LOG_DIR_ENV, tempfile.mkdtemp(prefix='chat_logs_'))
@@ -0,0 +1,80 @@
+"""
+Unit-тесты шифрования сообщений клиента
+"""
+
+import os
+import sys
+import base64
+import unittest
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from client.database import ClientDatabase
+from client.crypto import MessageCipher
+
+
+class TestMessageCipher(unittest.TestCase):
+    '''
+    Unit-тесты MessageCipher. Классы таблиц отображаются в ORM один раз
+    на процесс, поэтому оба собеседника используют одну базу.
+    '''
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.database = ClientDatabase(f'test_crypto_{os.getpid()}')
+        cls.alice_keys = RSA.generate(1024)
+        cls.bob_keys = RSA.generate(1024)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.database.session.close()
+        cls.database.mapper_registry.dispose()
+        cls.database.database_engine.dispose()
+        os.remove(cls.database.database_engine.url.database)
+
+    def setUp(self) -> None:
+        self.alice = MessageCipher('alice', self.alice_keys, self.database)
+        self.bob = MessageCipher('bob', self.bob_keys, self.database)
+        self.bob_public = self.bob_keys.publickey().export_key().decode('ascii')
+
+    def test_key_sent_once(self):
+        """Ключ сессии передаётся только до подтверждения отправки"""
+        first = self.alice.encrypt('bob', self.bob_public, 'привет')
+        self.alice.confirm('bob')
+        second = self.alice.encrypt('bob', self.bob_public, 'привет')
+        self.assertLess(len(second), len(first))
+        self.assertEqual(self.bob.decrypt('alice', first), 'привет')
+        self.assertEqual(self.bob.decrypt('alice', second), 'привет')
+
+    def test_keys_persist(self):
+        """Ключи сохраняются в базе и доступны после перезапуска клиента"""
+        self.alice.encrypt('bob', self.bob_public, 'раз')
+        self.alice.confirm('bob')
+        self.bob.decrypt('alice', self.alice.encrypt('bob', self.bob_public, 'два'))
+        alice = MessageCipher('alice', self.alice_keys, self.database)
+        bob = MessageCipher('bob', self.bob_keys, self.database)
+        message = alice.encrypt('bob', self.bob_public, 'три')
+        self.assertEqual(bob.decrypt('alice', message), 'три')
+
+    def test_rotation_on_new_peer_key(self):
+        """Смена открытого ключа собеседника создаёт новый ключ сессии"""
+        self.alice.encrypt('bob', self.bob_public, 'текст')
+        key_id = self.alice.outbound['bob'].key_id
+        other = RSA.generate(1024).publickey().export_key().decode('ascii')
+        self.alice.encrypt('bob', other, 'текст')
+        self.assertNotEqual(self.alice.outbound['bob'].key_id, key_id)
+
+    def test_wrong_sender(self):
+        """Сообщение, выданное за сообщение другого отправителя, не расшифровывается"""
+        message = self.alice.encrypt('bob', self.bob_public, 'текст')
+        self.assertRaises(ValueError, self.bob.decrypt, 'mallory', message)
+
+    def test_legacy_message(self):
+        """Сообщение прежнего формата (RSA-OAEP) расшифровывается"""
+        legacy = base64.b64encode(PKCS1_OAEP.new(self.bob_keys.publickey()).encrypt('старое'.encode('utf8')))
+        self.assertEqual(self.bob.decrypt('alice', legacy.decode('ascii')), 'старое')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+"""
+Unit-тесты базы данных клиента
+"""
+
+import os
+import sys
+import sqlite3
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from client.database import ClientDatabase, SEARCH_MATCH_START, SEARCH_MATCH_END
+
+
+class TestClientDatabase(unittest.TestCase):
+    '''
+    Unit-тесты ClientDatabase. Классы таблиц отображаются в ORM один раз
+    на процесс, поэтому база создаётся одна на все тесты, а тесты
+    используют разных собеседников.
+    '''
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.database = ClientDatabase(f'test_database_{os.getpid()}')
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.database.session.close()
+        cls.database.mapper_registry.dispose()
+        cls.database.database_engine.dispose()
+        os.remove(cls.database.database_engine.url.database)
+
+    def stored(self, query, *args):
+        """Строки, уже записанные в файл базы"""
+        connection = sqlite3.connect(self.database.database_engine.url.database)
+        try:
+            return connection.execute(query, args).fetchall()
+        finally:
+            connection.close()
+
+    def count_commits(self):
+        """Подменяет commit сессии счётчиком вызовов"""
+        commits = []
+        commit = self.database.session.commit
+
+        def counted():
+            commits.append(1)
+            commit()
+        self.database.session.commit = counted
+        self.addCleanup(delattr, self.database.session, 'commit')
+        return commits
+
+    def paged_history(self, contact):
+        """История из 12 сообщений, у каждых четырёх одна дата;
+        порядок номеров не совпадает с порядком дат"""
+        start = datetime(2024, 1, 1)
+        for number in range(12):
+            row = self.database.MessageHistory(contact, 'in', f'text {number}')
+            row.date = start + timedelta(seconds=number % 3)
+            self.database.session.add(row)
+        self.database.commit()
+        history = self.database.get_history(contact)
+        self.assertEqual(len(history), 12)
+        self.assertEqual(history, sorted(history, key=lambda row: (row[3], row[4])))
+        return history
+
+    def require_search(self):
+        if not self.database.search_available:
+            self.skipTest('SQLite собран без FTS5')
+
+    def found(self, query):
+        """Номера сообщений, найденных поиском"""
+        return [row[4] for row in self.database.search_messages(query)]
+
+    def test_nested_batch(self):
+        """Вложенные группы фиксируются одной транзакцией при выходе из внешней"""
+        commits = self.count_commits()
+        with self.database.batch():
+            self.database.add_contacts(['nested'])
+            with self.database.batch():
+                self.database.save_messages([('nested', 'in', 'text')])
+            self.assertEqual(commits, [])
+            self.assertEqual(self.stored("SELECT username FROM Contacts WHERE username = 'nested'"), [])
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(self.database.batch_depth, 0)
+        self.assertEqual(self.stored("SELECT message FROM Message_history WHERE contact = 'nested'"),
+                         [('text',)])
+
+    def test_batch_rollback(self):
+        """Исключение внутри группы отменяет все её изменения"""
+        with self.assertRaises(ValueError):
+            with self.database.batch():
+                self.database.add_contacts(['rolled'])
+                with self.database.batch():
+                    self.database.save_messages([('rolled', 'in', 'text')])
+                    raise ValueError
+        self.assertEqual(self.database.batch_depth, 0)
+        self.assertFalse(self.database.check_contact('rolled'))
+        self.assertEqual(self.database.get_history('rolled'), [])
+        # После отмены запись снова фиксируется сразу.
+        self.database.add_contact('rolled')
+        self.assertEqual(self.stored("SELECT username FROM Contacts WHERE username = 'rolled'"),
+                         [('rolled',)])
+
+    def test_add_contacts_duplicates(self):
+        """Повторы и уже имеющиеся контакты не добавляются второй раз"""
+        self.database.add_contact('dup_a')
+        self.database.add_contacts(['dup_a', 'dup_b', 'dup_a'])
+        self.assertEqual(self.stored("SELECT username FROM Contacts WHERE username LIKE 'dup_%' "
+                                     "ORDER BY username"), [('dup_a',), ('dup_b',)])
+
+    def test_save_messages(self):
+        """Сохранённые одним запросом сообщения читаются через get_history"""
+        self.database.save_messages([('reader', 'in', 'один'), ('reader', 'out', 'два')])
+        history = self.database.get_history('reader')
+        self.assertEqual([row[:3] for row in history], [('reader', 'in', 'один'), ('reader', 'out', 'два')])
+        self.assertLess(history[0][4], history[1][4])
+        self.assertIsNotNone(history[0][3])
+
+    def test_history_pages_backward(self):
+        """Страницы к началу переписки не пропускают и не повторяют сообщения с одной датой"""
+        history = self.paged_history('backward')
+        page = self.database.get_history('backward', limit=5)
+        loaded = page
+        # Число страниц ограничено: повтор страницы не зацикливает тест.
+        for _ in range(len(history)):
+            if not page:
+                break
+            page = self.database.get_history('backward', limit=5, before=(page[0][3], page[0][4]))
+            loaded = page + loaded
+        self.assertEqual(loaded, history)
+
+    def test_history_pages_forward(self):
+        """Страницы к концу переписки не пропускают и не повторяют сообщения с одной датой"""
+        history = self.paged_history('forward')
+        page = loaded = history[:1]
+        for _ in range(len(history)):
+            if not page:
+                break
+            page = self.database.get_history('forward', limit=5, after=(page[-1][3], page[-1][4]))
+            loaded = loaded + page
+        self.assertEqual(loaded, history)
+
+    def test_history_after_limit(self):
+        """after с limit - первая страница после ключа"""
+        history = self.paged_history('after')
+        key = history[4][3], history[4][4]
+        self.assertEqual(self.database.get_history('after', limit=3, after=key), history[5:8])
+
+    def test_history_before_limit(self):
+        """before с limit - последняя страница до ключа по возрастанию"""
+        history = self.paged_history('before')
+        key = history[7][3], history[7][4]
+        self.assertEqual(self.database.get_history('before', limit=3, before=key), history[4:7])
+
+    def test_search_new_message(self):
+        """Триггер добавляет новое сообщение в поисковый индекс"""
+        self.require_search()
+        self.database.save_message('finder', 'in', 'Встреча в понедельник')
+        results = self.database.search_messages('понед')
+        self.assertEqual([row[:2] for row in results], [('finder', 'in')])
+        self.assertIn(f'{SEARCH_MATCH_START}понедельник{SEARCH_MATCH_END}', results[0][2])
+
+    def test_search_backfill(self):
+        """Сообщения, сохранённые до создания индекса, индексируются порциями с продолжением"""
+        self.require_search()
+        # База прежней версии: индекса нет, сообщения уже сохранены.
+        with self.database.database_engine.begin() as connection:
+            connection.execute(text('DROP TRIGGER message_history_search'))
+            connection.execute(text('DROP TABLE Message_search'))
+            connection.execute(text('DROP TABLE Search_backfill'))
+        self.database.save_messages([('archive', 'in', 'старинное первое'),
+                                     ('archive', 'in', 'старинное второе')])
+        first, second = [row[4] for row in self.database.get_history('archive')]
+        self.assertTrue(self.database.create_search_index())
+        self.assertEqual(self.database.search_backfill_progress(), (0, second))
+        self.assertEqual(self.found('старинное'), [])
+
+        self.assertTrue(self.database.backfill_search(batch=first))
+        self.assertEqual(self.database.search_backfill_progress(), (first, second))
+        self.assertEqual(self.found('старинное'), [first])
+        # Следующая порция продолжается с сохранённого места.
+        self.assertFalse(self.database.backfill_search())
+        self.assertEqual(self.found('старинное'), [second, first])
+        self.assertFalse(self.database.backfill_search())
+        # Новые сообщения по-прежнему индексирует триггер.
+        self.database.save_message('archive', 'out', 'старинное третье')
+        self.assertEqual(len(self.found('старинное')), 3)
+
+    def test_search_operators(self):
+        """Синтаксис FTS5 во вводе ищется как обычный текст"""
+        self.require_search()
+        self.database.save_message('syntax', 'in', 'alpha OR beta NEAR gamma "quoted" star')
+        message_id = self.database.get_history('syntax')[-1][4]
+        for query in ('OR', 'NEAR(', 'NEAR(gamma', '"quoted', 'star*', 'alpha OR beta', '" OR *'):
+            with self.subTest(query=query):
+                self.assertIn(message_id, self.found(query))
+        # AND и NOT - обычные слова, которых в сообщении нет.
+        for query in ('"', '*', '(', 'NOT', 'beta AND'):
+            with self.subTest(query=query):
+                self.assertNotIn(message_id, self.found(query))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Unit-тесты обработчика многопроцессного режима
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from common.utils import MessageReader
+from server.cluster import ClusterMessageProcessor
+from server.directory import CachedGroup
+
+
+class FakeClient:
+    """Заглушка соединения клиента"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def getpeername(self):
+        return '127.0.0.1', self.port
+
+
+class FakeWriter:
+    """Заглушка исходящего соединения шины, разбирающая отправленные кадры"""
+
+    def __init__(self):
+        self.reader = MessageReader()
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.reader.feed(data)
+
+    def messages(self):
+        return list(self.reader.messages)
+
+
+class FakeDatabase:
+    """Заглушка базы сервера"""
+
+    def __init__(self):
+        self.stored = {}
+        self.group_write = None
+
+    def check_user(self, name):
+        return name != 'nobody'
+
+    def store_message(self, recipient, message):
+        self.stored.setdefault(recipient, []).append(message)
+        return True
+
+    def store_group_message(self, recipients, message):
+        for recipient in recipients:
+            self.stored.setdefault(recipient, []).append(message)
+
+    def get_group(self, name):
+        return CachedGroup(1, name, {'first': 1, 'remote': 2})
+
+    def process_message(self, sender, recipient):
+        pass
+
+    def process_group_message(self, sender, recipients):
+        pass
+
+    def forget_user(self, name):
+        pass
+
+    def pending_group_write(self, name):
+        if self.group_write is not None and not self.group_write.done():
+            return self.group_write
+        return None
+
+
+class RepliesRecorded(ClusterMessageProcessor):
+    """Обработчик, запоминающий ответы клиентам"""
+
+    def reply(self, client, response):
+        self.sent.append((client, dict(response)))
+
+
+class TestHeldMessages(unittest.TestCase):
+    '''
+    Unit-тесты сообщений, придержанных до синхронизации шины
+    '''
+
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.database = FakeDatabase()
+        self.processor = RepliesRecorded('127.0.0.1', 7777, self.database, 0, 2, tempfile.gettempdir())
+        self.processor.loop = self.loop
+        self.processor.sent = []
+        self.client = FakeClient(1)
+        self.processor.names['first'] = self.client
+        self.writer = FakeWriter()
+        self.message = {ACTION: MESSAGE, TIME: 1, SENDER: 'first', DESTINATION: 'remote',
+                        MESSAGE_TEXT: 'text'}
+
+    def sync(self):
+        """Сосед подключился и прислал своих пользователей"""
+        self.processor.bus.peers[1] = self.writer
+        self.processor.handle_bus_message({BUS_EVENT: BUS_SYNC, WORKER_ID: 1, LIST_INFO: ['remote']})
+
+    def test_forwarded_after_sync(self):
+        """Сообщение пользователю соседа до синхронизации не сохраняется, а передаётся после неё"""
+        self.processor.process_client_message(self.message, self.client)
+        self.assertEqual(self.processor.sent, [(self.client, RESPONSE_200)])
+        self.assertEqual(self.database.stored, {})
+        self.sync()
+        routed = self.writer.messages()[-1]
+        self.assertEqual(routed[BUS_EVENT], BUS_ROUTE)
+        self.assertEqual(routed[MESSAGE][MESSAGE_TEXT], 'text')
+        self.assertEqual(self.processor.held, [])
+        self.assertEqual(self.database.stored, {})
+
+    def test_group_forwarded_after_sync(self):
+        """Сообщение группе участнику соседа передаётся после синхронизации"""
+        self.processor.process_client_message({ACTION: GROUP_MESSAGE, TIME: 1, SENDER: 'first',
+                                               GROUP: 'room', MESSAGE_TEXT: 'text'}, self.client)
+        self.assertEqual(self.database.stored, {})
+        self.sync()
+        routed = self.writer.messages()[-1]
+        self.assertEqual((routed[BUS_EVENT], routed[LIST_INFO]), (BUS_GROUP_ROUTE, ['remote']))
+
+    def test_stored_after_timeout(self):
+        """Получатель, не найденный за CLUSTER_SYNC_TIMEOUT, получит сообщение после подключения"""
+        self.processor.process_client_message(self.message, self.client)
+        self.processor.held[0] = (0,) + self.processor.held[0][1:]
+        self.processor.release_held()
+        self.assertEqual([message[MESSAGE_TEXT] for message in self.database.stored['remote']], ['text'])
+
+    def test_unknown_user(self):
+        """Незарегистрированному пользователю - ответ 400, сообщение не придерживается"""
+        self.processor.process_client_message(dict(self.message, **{DESTINATION: 'nobody'}), self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+        self.assertEqual(self.processor.held, [])
+
+    def test_stored_on_shutdown(self):
+        """При остановке придержанные сообщения сохраняются"""
+        self.processor.process_client_message(self.message, self.client)
+        self.processor.store_held()
+        self.assertIn('remote', self.database.stored)
+
+
+class TestGroupUpdate(unittest.TestCase):
+    '''
+    Unit-тесты оповещения соседей об изменении группы
+    '''
+
+    def setUp(self) -> None:
+        self.database = FakeDatabase()
+        self.processor = ClusterMessageProcessor('127.0.0.1', 7777, self.database, 0, 2, tempfile.gettempdir())
+        self.writer = FakeWriter()
+        self.processor.bus.peers[1] = self.writer
+
+    def test_sent_after_write(self):
+        """Соседи узнают об изменении группы только после записи в базу"""
+        self.database.group_write = Future()
+        self.processor.group_changed('room')
+        self.assertEqual(self.writer.messages(), [])
+        self.database.group_write.set_result(None)
+        update = self.writer.messages()[-1]
+        self.assertEqual((update[BUS_EVENT], update[GROUP]), (BUS_GROUP_UPDATE, 'room'))
+
+    def test_sent_at_once(self):
+        """Без незаписанных изменений соседи оповещаются сразу"""
+        self.processor.group_changed('room')
+        self.assertEqual(len(self.writer.messages()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,387 @@
+"""
+Unit-тесты таблицы обработчиков действий сервера
+"""
+
+import os
+import sys
+import hmac
+import binascii
+import threading
+import unittest
+from concurrent.futures import Future
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from server.core import MessageProcessor
+from server.directory import CachedGroup
+
+
+class FakeClient:
+    """Заглушка сокета клиента"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def getpeername(self):
+        return '127.0.0.1', self.port
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    """Заглушка базы сервера с одним пользователем"""
+
+    def __init__(self):
+        self.logged_in = []
+        self.stored = {}
+        self.acked = []
+
+    def check_user(self, name):
+        return name == 'third'
+
+    def process_message(self, sender, recipient):
+        pass
+
+    def store_message(self, recipient, message):
+        if not self.check_user(recipient):
+            return False
+        self.stored.setdefault(recipient, []).append(message)
+        return True
+
+    def ack_offline_messages(self, name, last_id):
+        self.acked.append((name, last_id))
+
+    def get_offline_messages(self, name, after_id, limit):
+        future = Future()
+        future.set_result([])
+        return future
+
+    def get_group(self, name):
+        if name == 'room':
+            return CachedGroup(1, 'room', {'first': 1, 'second': 2, 'third': 3, 'fourth': 4})
+
+    def store_group_message(self, recipients, message):
+        for recipient in recipients:
+            self.stored.setdefault(recipient, []).append(message)
+
+    def process_group_message(self, sender, recipients):
+        pass
+
+    def get_users_changes(self, version):
+        if version is None:
+            return 5, ['first', 'second'], None, None
+        return 5, None, ['second'], ['old']
+
+    def get_hash(self, name):
+        return b'hash'
+
+    def user_login(self, name, ip_address, port, key):
+        self.logged_in.append(name)
+
+    def user_logout(self, name):
+        pass
+
+
+class RecordingProcessor(MessageProcessor):
+    """Обработчик, запоминающий ответы вместо отправки в сокет"""
+
+    def send_to(self, client, message):
+        self.sent.append((client, dict(message)))
+
+
+class FanOutProcessor(RecordingProcessor):
+    """Обработчик, запоминающий байты, поставленные в исходящие буферы"""
+
+    def enqueue(self, client, data):
+        self.enqueued.append((client, data))
+
+
+class StalledClient(FakeClient):
+    """Заглушка сокета клиента, который не забирает данные"""
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        raise BlockingIOError
+
+
+class RepliesRecorded(MessageProcessor):
+    """Обработчик с настоящими исходящими буферами, запоминающий ответы отправителю"""
+
+    def reply(self, client, response):
+        self.sent.append((client, dict(response)))
+
+
+def typing_handler(processor, message, client):
+    processor.sent.append((client, {ACTION: 'typing', SENDER: message[SENDER]}))
+
+
+RecordingProcessor.register_action('typing', typing_handler, (TIME,), owner=SENDER)
+
+
+class TestDispatch(unittest.TestCase):
+    '''
+    Unit-тесты выбора обработчика по полю ACTION
+    '''
+
+    def setUp(self) -> None:
+        self.processor = RecordingProcessor('127.0.0.1', 7777, None)
+        self.processor.sent = []
+        self.client = FakeClient(1)
+        self.processor.names['first'] = self.client
+        self.processor.names['second'] = FakeClient(2)
+
+    def test_plugin_action(self):
+        """Действие, зарегистрированное в подклассе, вызывается"""
+        self.processor.process_client_message({ACTION: 'typing', TIME: 1, SENDER: 'first'}, self.client)
+        self.assertEqual(self.processor.sent, [(self.client, {ACTION: 'typing', SENDER: 'first'})])
+
+    def test_registration_isolated(self):
+        """Регистрация в подклассе не меняет таблицу MessageProcessor"""
+        self.assertIn('typing', RecordingProcessor.actions)
+        self.assertNotIn('typing', MessageProcessor.actions)
+        self.assertIn(MESSAGE, RecordingProcessor.actions)
+
+    def test_missing_field(self):
+        """Сообщение без обязательного поля - ответ 400"""
+        self.processor.process_client_message({ACTION: 'typing', SENDER: 'first'}, self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+
+    def test_foreign_owner(self):
+        """Запрос от имени другого пользователя - ответ 400"""
+        self.processor.process_client_message({ACTION: 'typing', TIME: 1, SENDER: 'second'}, self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+
+    def test_unknown_action(self):
+        """Неизвестное действие - ответ 400"""
+        self.processor.process_client_message({ACTION: 'unknown', TIME: 1}, self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+
+    def test_offline_destination(self):
+        """Сообщение пользователю не в сети сохраняется, отправитель получает 200"""
+        self.processor.database = FakeDatabase()
+        self.processor.process_client_message({ACTION: MESSAGE, TIME: 1, SENDER: 'first',
+                                               DESTINATION: 'third', MESSAGE_TEXT: 'text'}, self.client)
+        self.assertEqual(self.processor.sent, [(self.client, RESPONSE_200)])
+        self.assertEqual([message[MESSAGE_TEXT] for message in self.processor.database.stored['third']],
+                         ['text'])
+
+    def test_offline_unknown_destination(self):
+        """Сообщение незарегистрированному пользователю - ответ 400"""
+        self.processor.database = FakeDatabase()
+        self.processor.process_client_message({ACTION: MESSAGE, TIME: 1, SENDER: 'first',
+                                               DESTINATION: 'nobody', MESSAGE_TEXT: 'text'}, self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+
+    def test_get_offline(self):
+        """Запрос сообщений не в сети подтверждает прежние и отдаёт следующую страницу"""
+        self.processor.database = FakeDatabase()
+        self.processor.clients.add(self.client)
+        self.processor.process_client_message({ACTION: GET_OFFLINE, TIME: 1, ACCOUNT_NAME: 'first',
+                                               OFFLINE_ACK: 3}, self.client)
+        self.assertEqual(self.processor.database.acked, [('first', 3)])
+        self.processor.run_completions()
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 202)
+        self.processor.process_client_message({ACTION: GET_OFFLINE, TIME: 1, ACCOUNT_NAME: 'first',
+                                               OFFLINE_ACK: 'all'}, self.client)
+        self.assertEqual(self.processor.sent[1][1][RESPONSE], 400)
+
+    def test_get_offline_not_blocking(self):
+        """Запрос сообщений не в сети не ждёт потока записи, ответ - по готовности страницы"""
+        page = Future()
+        self.processor.database = FakeDatabase()
+        self.processor.clients.add(self.client)
+        self.processor.database.get_offline_messages = lambda name, after_id, limit: page
+        self.processor.process_client_message({ACTION: GET_OFFLINE, TIME: 1, ACCOUNT_NAME: 'first',
+                                               OFFLINE_ACK: 0, REQUEST_ID: 7}, self.client)
+        self.processor.run_completions()
+        self.assertEqual(self.processor.sent, [])
+        writer = threading.Thread(target=page.set_result, args=([{MESSAGE_TEXT: 'text'}],))
+        writer.start()
+        writer.join()
+        self.processor.run_completions()
+        self.assertEqual(self.processor.sent, [(self.client, {RESPONSE: 202, LIST_INFO: [{MESSAGE_TEXT: 'text'}],
+                                                              REQUEST_ID: 7})])
+
+    def test_users_changes(self):
+        """Клиент с версией получает изменения, без версии - полный список"""
+        self.processor.database = FakeDatabase()
+        request = {ACTION: USERS_REQUEST, TIME: 1, ACCOUNT_NAME: 'first'}
+        self.processor.process_client_message(dict(request, **{VERSION: 3}), self.client)
+        self.assertEqual(self.processor.sent[0][1], {RESPONSE: 202, LIST_INFO: None, VERSION: 5,
+                                                     ADDED: ['second'], REMOVED: ['old']})
+        self.processor.process_client_message(dict(request, **{VERSION: 'three'}), self.client)
+        self.assertEqual(self.processor.sent[1][1][LIST_INFO], ['first', 'second'])
+        self.assertEqual(self.processor.sent[1][1][VERSION], 5)
+
+    def test_request_id(self):
+        """Номер запроса возвращается в ответе, в том числе в ответе 400"""
+        self.processor.process_client_message({ACTION: 'typing', TIME: 1, SENDER: 'first',
+                                               REQUEST_ID: 7}, self.client)
+        self.processor.process_client_message({ACTION: 'unknown', REQUEST_ID: 8}, self.client)
+        self.processor.reply(self.client, RESPONSE_200)
+        self.assertEqual(self.processor.sent[1][1][REQUEST_ID], 8)
+        self.assertNotIn(REQUEST_ID, self.processor.sent[2][1])
+        self.assertNotIn(REQUEST_ID, RESPONSE_400)
+
+    def test_request_id_not_forwarded(self):
+        """Номер запроса не пересылается получателю сообщения"""
+        self.processor.database = FakeDatabase()
+        self.processor.process_client_message({ACTION: MESSAGE, TIME: 1, SENDER: 'first', DESTINATION: 'second',
+                                               MESSAGE_TEXT: 'text', REQUEST_ID: 3}, self.client)
+        self.assertNotIn(REQUEST_ID, self.processor.sent[0][1])
+        self.assertEqual(self.processor.sent[1], (self.client, dict(RESPONSE_200, **{REQUEST_ID: 3})))
+
+    def test_not_authorized(self):
+        """Неавторизованный клиент может отправить только presence"""
+        self.assertRaises(TypeError, self.processor.process_client_message,
+                          {ACTION: 'typing', TIME: 1, SENDER: 'first'}, FakeClient(3))
+
+
+class TestGroupFanOut(unittest.TestCase):
+    '''
+    Unit-тесты рассылки сообщений группе
+    '''
+
+    def setUp(self) -> None:
+        self.database = FakeDatabase()
+        self.processor = FanOutProcessor('127.0.0.1', 7777, self.database)
+        self.processor.sent = []
+        self.processor.enqueued = []
+        self.client = FakeClient(1)
+        self.processor.names['first'] = self.client
+        self.processor.names['second'] = FakeClient(2)
+        self.processor.names['third'] = FakeClient(3)
+        self.message = {ACTION: GROUP_MESSAGE, TIME: 1, SENDER: 'first', GROUP: 'room', MESSAGE_TEXT: 'text'}
+
+    def test_serialized_once(self):
+        """Все участники получают одни и те же байты, отправитель - только ответ"""
+        self.processor.process_client_message(self.message, self.client)
+        self.assertEqual(self.processor.sent, [(self.client, RESPONSE_200)])
+        recipients = [client.port for client, _ in self.processor.enqueued]
+        self.assertEqual(recipients, [2, 3])
+        self.assertIs(self.processor.enqueued[0][1], self.processor.enqueued[1][1])
+
+    def test_offline_members_stored(self):
+        """Участникам не в сети сообщение сохраняется"""
+        self.processor.process_client_message(self.message, self.client)
+        self.assertEqual(list(self.database.stored), ['fourth'])
+
+    def test_not_member(self):
+        """Сообщение в чужую или несуществующую группу - ответ 400"""
+        self.processor.process_client_message(dict(self.message, **{GROUP: 'other'}), self.client)
+        self.assertEqual(self.processor.sent[0][1][RESPONSE], 400)
+        self.assertEqual(self.processor.enqueued, [])
+
+
+class TestOutboundOverflow(unittest.TestCase):
+    '''
+    Unit-тесты переполнения исходящего буфера получателя
+    '''
+
+    def setUp(self) -> None:
+        self.database = FakeDatabase()
+        self.processor = RepliesRecorded('127.0.0.1', 7777, self.database)
+        self.processor.sent = []
+        self.client = FakeClient(1)
+        self.stalled = StalledClient(3)
+        self.processor.names['first'] = self.client
+        self.processor.names['third'] = self.stalled
+        self.processor.clients.update((self.client, self.stalled))
+        self.processor.outbound[self.stalled] = bytearray(OUTBOUND_MAX_BUFFER)
+
+    def test_message_stored(self):
+        """Получатель отключается, сообщение сохраняется до подключения"""
+        self.processor.process_client_message({ACTION: MESSAGE, TIME: 1, SENDER: 'first',
+                                               DESTINATION: 'third', MESSAGE_TEXT: 'text'}, self.client)
+        self.assertEqual(self.processor.sent, [(self.client, RESPONSE_200)])
+        self.assertNotIn('third', self.processor.names)
+        self.assertNotIn(self.stalled, self.processor.clients)
+        self.assertTrue(self.stalled.closed)
+        self.assertEqual([message[MESSAGE_TEXT] for message in self.database.stored['third']], ['text'])
+
+    def test_group_message_stored(self):
+        """Участник группы с переполненным буфером получает сообщение после подключения"""
+        self.processor.process_client_message({ACTION: GROUP_MESSAGE, TIME: 1, SENDER: 'first',
+                                               GROUP: 'room', MESSAGE_TEXT: 'text'}, self.client)
+        self.assertNotIn('third', self.processor.names)
+        self.assertIn('third', self.database.stored)
+
+
+class TestPendingAuth(unittest.TestCase):
+    '''
+    Unit-тесты авторизации без ожидания ответа клиента
+    '''
+
+    def setUp(self) -> None:
+        self.database = FakeDatabase()
+        self.processor = RecordingProcessor('127.0.0.1', 7777, self.database)
+        self.processor.sent = []
+        self.client = FakeClient(3)
+        self.processor.clients.add(self.client)
+        presence = {ACTION: PRESENCE, TIME: 1, USER: {ACCOUNT_NAME: 'third', PUBLIC_KEY: 'key'}}
+        self.processor.process_client_message(presence, self.client)
+        self.challenge = self.processor.sent[0][1]
+
+    def answer(self, password_hash):
+        digest = hmac.new(password_hash, self.challenge[DATA].encode('ascii'), 'MD5').digest()
+        return {RESPONSE: 511, DATA: binascii.b2a_base64(digest).decode('ascii')}
+
+    def test_challenge_not_blocking(self):
+        """После запроса 511 клиент ждёт ответа, но ещё не авторизован"""
+        self.assertEqual(self.challenge[RESPONSE], 511)
+        self.assertIn(self.client, self.processor.pending_auth)
+        self.assertNotIn('third', self.processor.names)
+
+    def test_correct_answer(self):
+        """Верный ответ завершает авторизацию"""
+        self.processor.handle_client_message(self.answer(b'hash'), self.client)
+        self.assertIs(self.processor.names['third'], self.client)
+        self.assertEqual(self.processor.sent[-1][1], RESPONSE_200)
+        self.assertEqual(self.database.logged_in, ['third'])
+        self.assertNotIn(self.client, self.processor.pending_auth)
+
+    def test_wrong_answer(self):
+        """Неверный или неполный ответ - 400 и отключение"""
+        self.processor.handle_client_message({RESPONSE: 511}, self.client)
+        self.assertEqual(self.processor.sent[-1][1][RESPONSE], 400)
+        self.assertNotIn(self.client, self.processor.clients)
+        self.assertNotIn('third', self.processor.names)
+
+    def test_expired(self):
+        """Клиент без ответа отключается после AUTH_TIMEOUT"""
+        self.processor.pending_auth[self.client].deadline = 0
+        self.processor.expire_auth()
+        self.assertNotIn(self.client, self.processor.clients)
+        self.assertFalse(self.processor.pending_auth)
+
+    def test_concurrent_login(self):
+        """Второе соединение с тем же именем отклоняется, пока идёт авторизация"""
+        second = FakeClient(4)
+        self.processor.clients.add(second)
+        presence = {ACTION: PRESENCE, TIME: 1, USER: {ACCOUNT_NAME: 'third', PUBLIC_KEY: 'key'}}
+        self.processor.process_client_message(presence, second)
+        self.assertEqual(self.processor.sent[-1], (second, RESPONSE_400))
+        self.assertNotIn(second, self.processor.clients)
+        self.assertNotIn(second, self.processor.pending_auth)
+        self.processor.handle_client_message(self.answer(b'hash'), self.client)
+        self.assertIs(self.processor.names['third'], self.client)
+
+    def test_send_failed(self):
+        """Если ответ 200 не отправлен, вход пользователя не записывается"""
+        def send_to(client, message):
+            raise OSError
+        self.processor.send_to = send_to
+        self.processor.handle_client_message(self.answer(b'hash'), self.client)
+        self.assertNotIn(self.client, self.processor.clients)
+        self.assertNotIn('third', self.processor.names)
+        self.assertEqual(self.database.logged_in, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
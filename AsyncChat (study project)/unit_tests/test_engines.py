@@ -0,0 +1,134 @@
+"""
+Unit-тесты движков сервера на настоящих сокетах
+"""
+
+import os
+import sys
+import hmac
+import time
+import socket
+import binascii
+import threading
+import unittest
+from concurrent.futures import Future
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from server.core import MessageProcessor
+from server.async_core import AsyncMessageProcessor
+from common.utils import encode_message, decode_message, FRAME_HEADER
+
+
+class FakeDatabase:
+    """Заглушка базы сервера с одним пользователем"""
+
+    def check_user(self, name):
+        return name == 'user'
+
+    def get_hash(self, name):
+        return b'hash'
+
+    def flush_counters_if_due(self):
+        pass
+
+    def user_login(self, name, ip_address, port, key):
+        pass
+
+    def user_logout(self, name):
+        pass
+
+    def ack_offline_messages(self, name, last_id):
+        pass
+
+    def get_offline_messages(self, name, after_id, limit):
+        # Страница готовится в другом потоке, как в потоке записи базы.
+        future = Future()
+        threading.Timer(0.1, future.set_result, args=([{MESSAGE_TEXT: 'text'}],)).start()
+        return future
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestAsyncEngine(unittest.TestCase):
+    '''
+    Unit-тесты движка asyncio
+    '''
+    engine = AsyncMessageProcessor
+
+    def setUp(self) -> None:
+        self.port = free_port()
+        self.processor = self.engine('127.0.0.1', self.port, FakeDatabase())
+        self.processor.daemon = True
+        self.processor.start()
+
+    def tearDown(self) -> None:
+        self.processor.running = False
+        self.processor.join(SHUTDOWN_TIMEOUT)
+
+    def connect(self):
+        # Сервер начинает слушать порт после запуска потока.
+        for _ in range(50):
+            try:
+                sock = socket.create_connection(('127.0.0.1', self.port), timeout=SHUTDOWN_TIMEOUT)
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        self.addCleanup(sock.close)
+        return sock
+
+    def assertServing(self):
+        """Сервер продолжает принимать клиентов"""
+        self.assertTrue(self.processor.is_alive())
+        sock = self.connect()
+        sock.sendall(b'[]')
+        self.assertEqual(sock.recv(MAX_PACKAGE_LENGTH), b'')
+
+    def test_invalid_encoding(self):
+        """Сообщение не в UTF-8 отключает клиента, сервер продолжает работу"""
+        sock = self.connect()
+        sock.sendall(b'{"action": "\xff"}')
+        self.assertEqual(sock.recv(MAX_PACKAGE_LENGTH), b'')
+        self.assertFalse(self.processor.clients)
+        self.assertServing()
+
+    def test_invalid_encoding_framed(self):
+        """Кадр не в UTF-8 отключает клиента, сервер продолжает работу"""
+        sock = self.connect()
+        sock.sendall(encode_message({ACTION: PRESENCE, TIME: 1, FRAMING: FRAMING_LENGTH,
+                                     USER: {ACCOUNT_NAME: 'user', PUBLIC_KEY: 'key'}}))
+        self.assertIn(b'511', sock.recv(MAX_PACKAGE_LENGTH))
+        sock.sendall(FRAME_HEADER.pack(3) + b'"\xff"')
+        self.assertEqual(sock.recv(MAX_PACKAGE_LENGTH), b'')
+        self.assertServing()
+
+    def test_get_offline(self):
+        """Ответ на GET_OFFLINE отправляется, когда страницу подготовил другой поток"""
+        sock = self.connect()
+        sock.sendall(encode_message({ACTION: PRESENCE, TIME: 1,
+                                     USER: {ACCOUNT_NAME: 'user', PUBLIC_KEY: 'key'}}))
+        challenge = decode_message(sock.recv(MAX_PACKAGE_LENGTH))
+        digest = hmac.new(b'hash', challenge[DATA].encode('ascii'), 'MD5').digest()
+        sock.sendall(encode_message({RESPONSE: 511, DATA: binascii.b2a_base64(digest).decode('ascii')}))
+        self.assertEqual(decode_message(sock.recv(MAX_PACKAGE_LENGTH)), RESPONSE_200)
+        sock.sendall(encode_message({ACTION: GET_OFFLINE, TIME: 1, ACCOUNT_NAME: 'user',
+                                     OFFLINE_ACK: 0, REQUEST_ID: 5}))
+        started = time.monotonic()
+        response = decode_message(sock.recv(MAX_PACKAGE_LENGTH))
+        self.assertEqual(response, {RESPONSE: 202, LIST_INFO: [{MESSAGE_TEXT: 'text'}], REQUEST_ID: 5})
+        # Поток сервера пробуждается сразу, а не через SERVER_POLL_INTERVAL.
+        self.assertLess(time.monotonic() - started, SERVER_POLL_INTERVAL)
+
+
+class TestSelectEngine(TestAsyncEngine):
+    '''
+    Unit-тесты движка на select
+    '''
+    engine = MessageProcessor
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Unit-тесты модели окна истории клиента
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from PyQt5.QtCore import Qt
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from client.history_model import HistoryModel
+from client.database import ClientDatabase
+
+
+class FakeHistory:
+    """Заглушка базы клиента: история одного собеседника в списке"""
+
+    def __init__(self, count):
+        start = datetime(2024, 1, 1)
+        # Несколько сообщений с одинаковой датой: порядок задаёт номер.
+        self.rows = [('bob', 'in' if number % 2 else 'out', f'text {number}',
+                      start + timedelta(seconds=number // 3), number + 1) for number in range(count)]
+
+    def add(self, text):
+        last = self.rows[-1]
+        self.rows.append(('bob', 'in', text, last[3], last[4] + 1))
+
+    def get_history(self, contact, limit=None, before=None, after=None):
+        rows = [row for row in self.rows if row[0] == contact]
+        if before is not None:
+            rows = [row for row in rows if (row[3], row[4]) < before]
+        if after is not None:
+            rows = [row for row in rows if (row[3], row[4]) > after]
+            return rows if limit is None else rows[:limit]
+        return rows if limit is None else rows[-limit:]
+
+
+class TestHistoryModel(unittest.TestCase):
+    '''
+    Unit-тесты HistoryModel
+    '''
+
+    def setUp(self) -> None:
+        self.history = FakeHistory(100)
+        self.model = HistoryModel(self.history, page_size=10, window_size=30)
+        self.model.set_contact('bob')
+
+    def texts(self):
+        return [self.model.data(self.model.index(row, 0)).split('\n')[2]
+                for row in range(self.model.rowCount())]
+
+    def test_last_page(self):
+        """При открытии чата загружается последняя страница"""
+        self.assertEqual(self.texts(), [f'text {number}' for number in range(90, 100)])
+        self.assertTrue(self.model.at_end)
+        self.assertFalse(self.model.at_start)
+        self.assertEqual(self.model.data(self.model.index(0, 0), Qt.TextAlignmentRole), Qt.AlignRight)
+
+    def test_window_bounded(self):
+        """Прокрутка назад не увеличивает окно сверх window_size"""
+        while self.model.fetch_older():
+            self.assertLessEqual(self.model.rowCount(), 30)
+        self.assertTrue(self.model.at_start)
+        self.assertFalse(self.model.at_end)
+        self.assertEqual(self.texts(), [f'text {number}' for number in range(30)])
+        while not self.model.at_end:
+            self.model.fetch_newer()
+        self.assertEqual(self.texts(), [f'text {number}' for number in range(70, 100)])
+
+    def test_new_messages(self):
+        """Новые сообщения добавляются в конец, если окно доходит до него"""
+        self.history.add('new')
+        self.model.fetch_newer()
+        self.assertEqual(self.texts()[-2:], ['text 99', 'new'])
+        self.model.fetch_older()
+        self.model.fetch_older()
+        self.model.fetch_older()
+        self.assertFalse(self.model.at_end)
+        self.history.add('unseen')
+        self.assertNotIn('unseen', self.texts())
+
+    def test_around_message(self):
+        """Окно открывается на найденном сообщении со страницами до и после него"""
+        found = self.history.rows[50]
+        self.model.set_contact('bob', (found[3], found[4]))
+        row = self.model.row_of((found[3], found[4]))
+        self.assertEqual(self.texts()[row], 'text 50')
+        self.assertEqual(self.texts()[0], 'text 41')
+        self.assertEqual(self.texts()[-1], 'text 60')
+        self.assertFalse(self.model.at_end)
+        self.model.fetch_newer()
+        self.assertEqual(self.texts()[-1], 'text 70')
+
+    def test_search_query(self):
+        """Строка поиска превращается в запрос FTS5 без его синтаксиса"""
+        self.assertEqual(ClientDatabase.search_query('Привет,  мир'), '"Привет"* "мир"*')
+        self.assertEqual(ClientDatabase.search_query('a OR "b'), '"a"* "OR"* "b"*')
+        self.assertIsNone(ClientDatabase.search_query(' *" '))
+
+    def test_clear(self):
+        """Окно без собеседника пустое"""
+        self.model.set_contact(None)
+        self.assertEqual(self.model.rowCount(), 0)
+        self.assertEqual(self.model.fetch_older(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
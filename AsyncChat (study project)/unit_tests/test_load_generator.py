@@ -0,0 +1,63 @@
+"""
+Unit-тесты нагрузочного клиента
+"""
+
+import os
+import sys
+import hmac
+import binascii
+import unittest
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from client.transport import password_hash, presence_message, auth_answer
+from benchmarks.load_generator import percentile, prepare_users, run_load
+
+
+class TestAuthMessages(unittest.TestCase):
+    '''
+    Unit-тесты сообщений авторизации клиента
+    '''
+
+    def test_presence(self):
+        """Presence содержит имя, ключ и запрос передачи кадрами"""
+        message = presence_message('test', 'key')
+        self.assertEqual(message[ACTION], PRESENCE)
+        self.assertEqual(message[USER], {ACCOUNT_NAME: 'test', PUBLIC_KEY: 'key'})
+        self.assertEqual(message[FRAMING], FRAMING_LENGTH)
+
+    def test_auth_answer(self):
+        """Ответ на 511 - HMAC случайной строки сервера по хэшу пароля"""
+        passwd_hash = password_hash('Test', '123456')
+        self.assertEqual(passwd_hash, password_hash('test', '123456'))
+        answer = auth_answer(passwd_hash, {RESPONSE: 511, DATA: 'challenge'})
+        digest = hmac.new(passwd_hash, b'challenge', 'MD5').digest()
+        self.assertEqual(answer[RESPONSE], 511)
+        self.assertEqual(answer[DATA], binascii.b2a_base64(digest).decode('ascii'))
+
+
+class TestLoadGenerator(unittest.TestCase):
+    '''
+    Unit-тесты нагрузочного клиента
+    '''
+
+    def test_percentile(self):
+        """Процентиль методом ближайшего ранга"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_run_load(self):
+        """Короткий прогон против локального сервера доставляет все сообщения"""
+        result = run_load(prepare_users(4, 1), rate=20, duration=1, contacts=1)
+        self.assertEqual(result['connected'], 4)
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['sent'], 0)
+        self.assertEqual(result['lost'], 0)
+        self.assertIsNotNone(result['delivery_p99'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Unit-тесты асинхронной записи журналов и декоратора Log
+"""
+
+import io
+import os
+import sys
+import json
+import logging
+import unittest
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from logs.log_pipeline import create_pipeline, pipelines, parse_levels, configure_logging
+from common.decorators import Log
+
+
+class TestLogPipeline(unittest.TestCase):
+    '''
+    Unit-тесты конвейера журнала: очередь, фоновый поток, формат JSON
+    '''
+
+    def setUp(self) -> None:
+        self.output = io.StringIO()
+        self.logger = create_pipeline('test_pipeline', lambda: logging.StreamHandler(self.output))
+
+    def tearDown(self) -> None:
+        logging.getLogger('common').removeHandler(self.logger.handlers[0])
+        listener, _ = pipelines.pop('test_pipeline')
+        listener.stop()
+        self.logger.handlers.clear()
+        configure_logging(json_format=False)
+
+    def lines(self) -> list[str]:
+        # Останавливаем поток записи: он дописывает очередь до конца.
+        pipelines['test_pipeline'][0].stop()
+        pipelines['test_pipeline'][0].start()
+        return self.output.getvalue().splitlines()
+
+    def test_single_handler(self):
+        """Повторное создание логгера не добавляет обработчиков"""
+        create_pipeline('test_pipeline', lambda: logging.StreamHandler(self.output))
+        self.logger.getChild('core').warning('текст')
+        self.assertEqual(len(self.logger.handlers), 1)
+        self.assertEqual(len(self.lines()), 1)
+
+    def test_arguments_captured(self):
+        """Аргументы подставляются при вызове: изменения после вызова не попадают в журнал"""
+        message = {'text': 'было'}
+        self.logger.warning('Сообщение %s', message)
+        message['text'] = 'стало'
+        self.assertIn("'было'", self.lines()[0])
+
+    def test_json(self):
+        """Запись в JSON содержит подсистему, сообщение и трассировку"""
+        configure_logging(json_format=True)
+        try:
+            raise ValueError('ошибка')
+        except ValueError as err:
+            self.logger.getChild('core').error('Сбой %s', 1, exc_info=err)
+        entry = json.loads(self.lines()[0])
+        self.assertEqual(entry['logger'], 'test_pipeline.core')
+        self.assertEqual(entry['message'], 'Сбой 1')
+        self.assertIn('ValueError: ошибка', entry['exc'])
+
+    def test_levels(self):
+        """Уровень подсистемы задаётся отдельно от уровня логгера"""
+        self.assertEqual(parse_levels('info, server.core=debug'),
+                         {'': logging.INFO, 'server.core': logging.DEBUG})
+        self.assertRaises(ValueError, parse_levels, 'server.core=verbose')
+        configure_logging('test_pipeline=WARNING,test_pipeline.core=DEBUG')
+        self.logger.getChild('core').debug('подсистема')
+        self.logger.getChild('writer').info('другая подсистема')
+        self.assertEqual(len(self.lines()), 1)
+
+
+class ListHandler(logging.Handler):
+    """Обработчик, запоминающий записи в списке"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogDecorator(unittest.TestCase):
+    '''
+    Unit-тесты декоратора Log
+    '''
+
+    def setUp(self) -> None:
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('test_decorator')
+        self.logger.handlers[:] = [self.handler]
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def test_debug_off(self):
+        """С выключенным отладочным журналом функция не оборачивается"""
+        self.logger.setLevel(logging.INFO)
+        self.assertIs(Log(self.logger)(len), len)
+
+    def test_sampled(self):
+        """Записывается каждый sample-й вызов, начиная с первого"""
+        double = Log(self.logger, sample=3)(lambda value: value * 2)
+        for number in range(7):
+            self.assertEqual(double(number), number * 2)
+        self.assertEqual([record.args[3] for record in self.handler.records], [(0,), (3,), (6,)])
+        self.assertEqual(self.handler.records[0].args[1], 'test_sampled')
+
+    def test_level_lowered(self):
+        """Обёрнутая функция не пишет журнал после повышения уровня"""
+        double = Log(self.logger)(lambda value: value * 2)
+        self.logger.setLevel(logging.INFO)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.handler.records, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Unit-тесты метрик сервера
+"""
+
+import os
+import sys
+import unittest
+import threading
+import urllib.request
+import urllib.error
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from server.core import MessageProcessor
+from server.metrics import MetricsRegistry, Counter, Histogram, Gauge, MetricsServer, timed, \
+    MESSAGES, CONNECTED_CLIENTS
+
+
+class RepliesDropped(MessageProcessor):
+    """Обработчик, отбрасывающий исходящие сообщения"""
+
+    def send_to(self, client, message):
+        pass
+
+
+class TestMetrics(unittest.TestCase):
+    '''
+    Unit-тесты реестра метрик и формата Prometheus
+    '''
+
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry()
+
+    def test_counter_threads(self):
+        """Значения потоков складываются при чтении"""
+        counter = Counter('test_total', 'Тест.', ('kind',), registry=self.registry)
+
+        def work():
+            for _ in range(10000):
+                counter.inc(('a',))
+            counter.inc(('b',), 5)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value(('a',)), 40000)
+        self.assertEqual(self.registry.exposition(),
+                         '# HELP test_total Тест.\n# TYPE test_total counter\n'
+                         'test_total{kind="a"} 40000\ntest_total{kind="b"} 20\n')
+
+    def test_histogram(self):
+        """Корзины гистограммы накопительные, с суммой и количеством"""
+        histogram = Histogram('test_seconds', 'Тест.', ('method',), (0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ('get"x',))
+        self.assertEqual(histogram.samples(), [
+            'test_seconds_bucket{method="get\\"x",le="0.1"} 2',
+            'test_seconds_bucket{method="get\\"x",le="1"} 3',
+            'test_seconds_bucket{method="get\\"x",le="+Inf"} 4',
+            'test_seconds_sum{method="get\\"x"} 3.65',
+            'test_seconds_count{method="get\\"x"} 4',
+        ])
+
+    def test_gauge_and_timed(self):
+        """Показатель вычисляется при опросе, timed подписывает вызов именем функции"""
+        gauge = Gauge('test_clients', 'Тест.', registry=self.registry)
+        self.assertEqual(self.registry.exposition(), '\n')
+        gauge.set_function(lambda: 3)
+        self.assertIn('test_clients 3\n', self.registry.exposition())
+        histogram = Histogram('test_call_seconds', 'Тест.', ('method',), registry=self.registry)
+        square = timed(histogram)(lambda value: value * value)
+        self.assertEqual(square(3), 9)
+        self.assertIn('test_call_seconds_count{method="<lambda>"} 1', histogram.samples())
+
+    def test_processor(self):
+        """Обработчик считает сообщения по действиям и отдаёт число клиентов"""
+        processor = RepliesDropped('127.0.0.1', 7777, None)
+        processor.bind_metrics()
+        processor.clients.update(('first', 'second'))
+        processor.names['user'] = 'first'
+        before = MESSAGES.value(('unknown',))
+        processor.process_client_message({ACTION: PRESENCE + 'x'}, 'first')
+        self.assertEqual(MESSAGES.value(('unknown',)), before + 1)
+        self.assertEqual(CONNECTED_CLIENTS.samples(), ['chat_connected_clients 2'])
+
+
+class TestMetricsServer(unittest.TestCase):
+    '''
+    Unit-тесты HTTP-сервера метрик
+    '''
+
+    def setUp(self) -> None:
+        registry = MetricsRegistry()
+        Counter('test_total', 'Тест.', registry=registry).inc()
+        self.server = MetricsServer('127.0.0.1', 0, registry)
+        self.server.start()
+        self.url = f'http://127.0.0.1:{self.server.port}'
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def test_metrics(self):
+        """GET /metrics отдаёт метрики в текстовом формате Prometheus"""
+        with urllib.request.urlopen(self.url + '/metrics') as response:
+            self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+            self.assertIn('test_total 1\n', response.read().decode('utf-8'))
+
+    def test_not_found(self):
+        """Остальные пути - 404"""
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(self.url + '/')
+        self.assertEqual(error.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
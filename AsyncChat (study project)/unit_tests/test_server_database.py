@@ -0,0 +1,385 @@
+"""
+Unit-тесты базы данных сервера
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from server.database import ServerStorage
+from server.writer import DatabaseWriter
+
+
+class FakeSession:
+    """Заглушка сессии: изменения применяются к списку при commit"""
+
+    def __init__(self):
+        self.rows = []
+        self.pending = []
+        self.commits = 0
+
+    def commit(self):
+        self.rows.extend(self.pending)
+        self.pending = []
+        self.commits += 1
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+def write_row(session, value):
+    session.pending.append(value)
+    return value
+
+
+def write_error(session):
+    session.pending.append('broken')
+    raise ValueError
+
+
+class TestServerStorage(unittest.TestCase):
+    '''
+    Unit-тесты ServerStorage. Классы таблиц отображаются в ORM один раз
+    на процесс, поэтому база создаётся одна на все тесты.
+    '''
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.path = os.path.join(tempfile.mkdtemp(), 'test_server.db3')
+        cls.database = ServerStorage(cls.path, flush_interval=3600, flush_size=3)
+        for username in ('first', 'second', 'third'):
+            cls.database.add_user(username, b'hash')
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.database.close()
+        cls.database.mapper_registry.dispose()
+
+    def stored_counters(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return dict((name, (sent, accepted)) for name, sent, accepted in connection.execute(
+                'SELECT name, sent, accepted FROM User_history '
+                'JOIN All_users ON All_users.id = User_history.user_id'))
+        finally:
+            connection.close()
+
+    def wait_writer(self):
+        self.database.writer.submit(lambda session: None).result()
+
+    def hold_writer(self):
+        """Останавливает поток записи до установки события"""
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        self.database.writer.submit(lambda session: gate.wait())
+        return gate
+
+    def setUp(self) -> None:
+        self.database.flush_counters().result()
+        self.before = self.stored_counters()
+
+    def test_counters_write_behind(self):
+        """Счётчики копятся в памяти и записываются пакетом по размеру"""
+        self.database.process_message('first', 'second')
+        self.database.process_message('first', 'third')
+        self.assertEqual(self.stored_counters(), self.before)
+        self.database.process_message('second', 'first')
+        self.wait_writer()
+        after = self.stored_counters()
+        self.assertEqual(after['first'][0] - self.before['first'][0], 2)
+        self.assertEqual(after['first'][1] - self.before['first'][1], 1)
+        self.assertEqual(after['third'][1] - self.before['third'][1], 1)
+
+    def test_statistics_include_pending(self):
+        """Статистика учитывает ещё не записанные счётчики"""
+        self.database.process_message('third', 'second')
+        history = dict((row[0], row[2:]) for row in self.database.get_message_history())
+        self.assertEqual(history['third'][0] - self.before['third'][0], 1)
+        self.assertEqual(history['second'][1] - self.before['second'][1], 1)
+
+    def test_directory_hit_without_query(self):
+        """Повторные запросы пользователя обслуживаются из справочника"""
+        self.database.get_hash('first')
+        session_factory = self.database.Session
+        self.database.Session = None
+        try:
+            self.assertEqual(self.database.get_hash('first'), b'hash')
+            self.assertTrue(self.database.check_user('first'))
+        finally:
+            self.database.Session = session_factory
+
+    def test_contacts_cached(self):
+        """Изменения контактов видны в справочнике и в базе"""
+        self.database.add_contact('second', 'third')
+        self.database.add_contact('second', 'third')
+        self.assertEqual(self.database.get_contacts('second'), ['third'])
+        self.wait_writer()
+        self.database.forget_user('second')
+        self.assertEqual(self.database.get_contacts('second'), ['third'])
+        self.database.remove_contact('second', 'third')
+        self.assertEqual(self.database.get_contacts('second'), [])
+
+    def test_login_updates_pubkey(self):
+        """Новый ключ при входе сохраняется в справочнике и в базе"""
+        self.database.user_login('third', '127.0.0.1', 7777, 'new key')
+        self.assertEqual(self.database.get_pubkey('third'), 'new key')
+        self.wait_writer()
+        self.database.forget_user('third')
+        self.assertEqual(self.database.get_pubkey('third'), 'new key')
+        self.database.user_logout('third')
+
+    def test_active_users(self):
+        """Вход и выход пользователя видны в списке активных после записи"""
+        self.database.user_login('second', '127.0.0.1', 7777, 'key')
+        self.wait_writer()
+        self.assertEqual([row[0] for row in self.database.get_active_users_list()], ['second'])
+        self.database.user_logout('second')
+        self.wait_writer()
+        self.assertEqual(self.database.get_active_users_list(), [])
+
+    def test_directory_eviction(self):
+        """Справочник не превышает заданный размер"""
+        capacity = self.database.directory.capacity
+        self.database.directory.capacity = 2
+        try:
+            for username in ('first', 'second', 'third'):
+                self.database.forget_user(username)
+            for username in ('first', 'second', 'third'):
+                self.database.get_user(username)
+            self.assertEqual(len(self.database.directory), 2)
+            self.assertIsNone(self.database.directory.get('first'))
+            self.assertTrue(self.database.check_user('first'))
+        finally:
+            self.database.directory.capacity = capacity
+
+    def test_dirty_entry_pinned(self):
+        """Запись с незаписанными контактами не вытесняется до COMMIT"""
+        capacity = self.database.directory.capacity
+        self.addCleanup(setattr, self.database.directory, 'capacity', capacity)
+        self.addCleanup(self.database.remove_contact, 'first', 'second')
+        gate = self.hold_writer()
+        self.database.add_contact('first', 'second')
+        self.database.directory.capacity = 1
+        for username in ('second', 'third'):
+            self.database.forget_user(username)
+            self.database.get_user(username)
+        self.assertIsNotNone(self.database.directory.get('first'))
+        gate.set()
+        self.wait_writer()
+        self.database.forget_user('third')
+        self.database.get_user('third')
+        self.assertIsNone(self.database.directory.get('first'))
+        self.assertEqual(self.database.get_contacts('first'), ['second'])
+
+    def test_reload_waits_for_write(self):
+        """Запись, удалённая из справочника до COMMIT, загружается после записи"""
+        self.addCleanup(self.database.remove_contact, 'third', 'first')
+        gate = self.hold_writer()
+        self.database.add_contact('third', 'first')
+        self.database.forget_user('third')
+        threading.Timer(0.1, gate.set).start()
+        self.assertEqual(self.database.get_contacts('third'), ['first'])
+
+    def test_offline_messages_paged(self):
+        """Сообщения не в сети отдаются страницами по порядку и удаляются после подтверждения"""
+        for number in range(5):
+            self.assertTrue(self.database.store_message('third', {'text': number}))
+        self.assertFalse(self.database.store_message('nobody', {'text': 0}))
+        self.wait_writer()
+        page = self.database.get_offline_messages('third', 0, 2).result()
+        self.assertEqual([message['text'] for message in page], [0, 1])
+        last_id = page[-1]['offline_id']
+        self.database.ack_offline_messages('third', last_id)
+        self.wait_writer()
+        self.assertEqual([message['text'] for message in self.database.get_offline_messages('third', 0, 10).result()],
+                         [2, 3, 4])
+        page = self.database.get_offline_messages('third', last_id, 10).result()
+        self.database.ack_offline_messages('third', page[-1]['offline_id'])
+        self.wait_writer()
+        self.assertEqual(self.database.get_offline_messages('third', 0, 10).result(), [])
+
+    def test_offline_read_after_store(self):
+        """Выборка не ждёт потока записи и видит сообщения, сохранённые перед ней"""
+        gate = self.hold_writer()
+        self.database.store_message('first', {'text': 'direct'})
+        self.database.store_group_message(['first'], {'text': 'group'})
+        future = self.database.get_offline_messages('first', 0, 10)
+        self.assertFalse(future.done())
+        gate.set()
+        page = future.result()
+        self.assertEqual([message['text'] for message in page], ['direct', 'group'])
+        self.database.ack_offline_messages('first', page[-1]['offline_id'])
+        self.wait_writer()
+
+    def test_directory_changes(self):
+        """Клиент с версией получает изменения списков, с неизвестной версией - полный список"""
+        version, names, _, _ = self.database.get_users_changes(None)
+        self.assertIn('first', names)
+        self.database.add_user('fifth', b'hash')
+        self.database.add_contact('first', 'fifth')
+        self.wait_writer()
+        self.assertEqual(self.database.get_users_changes(version)[1:], (None, ['fifth'], []))
+        self.assertEqual(self.database.get_contacts_changes('first', version)[1:], (None, ['fifth'], []))
+        self.assertEqual(self.database.get_contacts_changes('second', version)[1:], (None, [], []))
+        self.database.remove_user('fifth')
+        current = self.database.get_directory_version()
+        self.assertEqual(self.database.get_users_changes(version), (current, None, [], ['fifth']))
+        self.assertEqual(self.database.get_contacts_changes('first', version)[1:], (None, [], ['fifth']))
+        self.assertEqual(self.database.get_users_changes(current)[1:], (None, [], []))
+        self.assertIsNotNone(self.database.get_users_changes(current + 1)[1])
+
+    def test_groups(self):
+        """Создание группы, вход и выход участников сохраняются в базе"""
+        self.assertTrue(self.database.create_group('room', 'first'))
+        self.assertFalse(self.database.create_group('room', 'second'))
+        self.assertTrue(self.database.join_group('room', 'second'))
+        self.assertFalse(self.database.join_group('nowhere', 'second'))
+        self.database.forget_group('room')
+        self.assertEqual(set(self.database.get_group('room').members), {'first', 'second'})
+        self.assertEqual(self.database.get_user_groups('second'), ['room'])
+        self.assertTrue(self.database.leave_group('room', 'second'))
+        self.assertFalse(self.database.leave_group('room', 'second'))
+        self.database.forget_group('room')
+        self.assertEqual(list(self.database.get_group('room').members), ['first'])
+
+    def test_groups_not_blocking(self):
+        """Изменения групп не ждут потока записи и видны после записи"""
+        gate = self.hold_writer()
+        self.assertTrue(self.database.create_group('hall', 'first'))
+        self.assertTrue(self.database.join_group('hall', 'second'))
+        self.assertTrue(self.database.join_group('hall', 'third'))
+        self.assertTrue(self.database.leave_group('hall', 'third'))
+        self.assertIsNotNone(self.database.pending_group_write('hall'))
+        self.assertEqual(set(self.database.get_group('hall').members), {'first', 'second'})
+        self.database.forget_group('hall')
+        threading.Timer(0.1, gate.set).start()
+        group = self.database.get_group('hall')
+        self.assertEqual(set(group.members), {'first', 'second'})
+        self.assertIsNotNone(group.id)
+        self.assertIsNone(self.database.pending_group_write('hall'))
+
+    def test_group_offline(self):
+        """Сообщение группе сохраняется для каждого участника не в сети"""
+        self.database.store_group_message(['first', 'second', 'nobody'], {'text': 'group'})
+        self.wait_writer()
+        for username in ('first', 'second'):
+            page = self.database.get_offline_messages(username, 0, 10).result()
+            self.assertEqual([message['text'] for message in page], ['group'])
+            self.database.ack_offline_messages(username, page[-1]['offline_id'])
+        self.wait_writer()
+
+
+# Схема базы до появления миграций: таблицы без индексов.
+BASELINE_SCHEMA = """
+CREATE TABLE All_users (id INTEGER NOT NULL, name VARCHAR, last_login DATETIME,
+    password_hash VARCHAR, pubkey TEXT, PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE Active_users (id INTEGER NOT NULL, user_id INTEGER, ip_address VARCHAR,
+    port INTEGER, login_time DATETIME, PRIMARY KEY (id), UNIQUE (user_id),
+    FOREIGN KEY(user_id) REFERENCES All_users (id));
+CREATE TABLE Login_history (id INTEGER NOT NULL, user_id INTEGER, ip_address VARCHAR,
+    port INTEGER, date_time DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES All_users (id));
+CREATE TABLE User_contacts (id INTEGER NOT NULL, user_id INTEGER, contact INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES All_users (id),
+    FOREIGN KEY(contact) REFERENCES All_users (id));
+CREATE TABLE User_history (id INTEGER NOT NULL, user_id INTEGER, sent INTEGER,
+    accepted INTEGER, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES All_users (id));
+INSERT INTO All_users (id, name) VALUES (1, 'first'), (2, 'second'), (3, 'third');
+INSERT INTO User_contacts (id, user_id, contact) VALUES (1, 1, 2), (2, 1, 3), (3, 1, 2), (4, 2, 1);
+"""
+
+
+class TestMigration(unittest.TestCase):
+    '''
+    Unit-тесты обновления схемы базы, созданной до появления миграций
+    '''
+
+    def setUp(self) -> None:
+        self.path = os.path.join(tempfile.mkdtemp(), 'baseline.db3')
+        connection = sqlite3.connect(self.path)
+        connection.executescript(BASELINE_SCHEMA)
+        connection.close()
+
+    def stored(self, query):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(query).fetchall()
+        finally:
+            connection.close()
+
+    def snapshot(self):
+        """Схема, контакты и версия базы"""
+        return (self.stored('SELECT type, name, sql FROM sqlite_master ORDER BY name'),
+                self.stored('SELECT id, user_id, contact FROM User_contacts ORDER BY id'),
+                self.stored('PRAGMA user_version'))
+
+    def open(self):
+        """Открывает и закрывает базу, возвращает имена индексов модели"""
+        database = ServerStorage(self.path, flush_interval=3600, flush_size=3)
+        indexes = {index.name for table in database.mapper_registry.metadata.sorted_tables
+                   for index in table.indexes}
+        database.close()
+        database.mapper_registry.dispose()
+        return indexes
+
+    def test_migrate_baseline(self):
+        """Повтор контакта удаляется, остаётся самая ранняя запись;
+        индексы создаются, версия схемы записывается"""
+        indexes = self.open()
+        self.assertEqual(self.stored('SELECT id, user_id, contact FROM User_contacts ORDER BY id'),
+                         [(1, 1, 2), (2, 1, 3), (4, 2, 1)])
+        created = {row[0] for row in self.stored("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('ix_user_contacts_user_contact', indexes)
+        self.assertLessEqual(indexes, created)
+        self.assertIn('UNIQUE', self.stored("SELECT sql FROM sqlite_master "
+                                            "WHERE name = 'ix_user_contacts_user_contact'")[0][0])
+        self.assertEqual(self.stored('PRAGMA user_version'), [(4,)])
+
+    def test_migrate_once(self):
+        """Повторное открытие обновлённой базы ничего не меняет"""
+        self.open()
+        migrated = self.snapshot()
+        self.open()
+        self.assertEqual(self.snapshot(), migrated)
+
+
+class TestDatabaseWriter(unittest.TestCase):
+    '''
+    Unit-тесты потока записи
+    '''
+
+    def setUp(self) -> None:
+        self.session = FakeSession()
+        self.writer = DatabaseWriter(lambda: self.session)
+
+    def test_group_commit(self):
+        """Накопившиеся команды записываются одним COMMIT"""
+        futures = [self.writer.submit(write_row, number) for number in range(5)]
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual([future.result() for future in futures], list(range(5)))
+        self.assertEqual(self.session.rows, list(range(5)))
+        self.assertEqual(self.session.commits, 1)
+
+    def test_error_isolated(self):
+        """Ошибка одной команды не отменяет остальные"""
+        first = self.writer.submit(write_row, 1)
+        broken = self.writer.submit(write_error)
+        last = self.writer.submit(write_row, 2)
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual(self.session.rows, [1, 2])
+        self.assertEqual(first.result(), 1)
+        self.assertEqual(last.result(), 2)
+        self.assertRaises(ValueError, broken.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Unit-тесты реестра сессий сервера
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from server.sessions import SessionRegistry
+
+
+class FakeClient:
+    """Заглушка сокета клиента"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def getpeername(self):
+        return '127.0.0.1', self.port
+
+
+class TestSessionRegistry(unittest.TestCase):
+    '''
+    Unit-тесты двунаправленного реестра сессий
+    '''
+
+    def setUp(self) -> None:
+        self.registry = SessionRegistry()
+        self.first = FakeClient(1)
+        self.second = FakeClient(2)
+        self.registry['first'] = self.first
+        self.registry['second'] = self.second
+
+    def test_lookup_both_ways(self):
+        """Поиск сокета по имени и имени по сокету"""
+        self.assertIs(self.registry['first'], self.first)
+        self.assertEqual(self.registry.name_of(self.second), 'second')
+        self.assertTrue(self.registry.is_registered(self.first))
+        self.assertIsNone(self.registry.name_of(FakeClient(3)))
+
+    def test_session_metadata(self):
+        """Сессия хранит адрес подключения"""
+        session = self.registry.session('first')
+        self.assertEqual((session.ip_address, session.port), ('127.0.0.1', 1))
+
+    def test_unregister(self):
+        """Удаление по сокету очищает оба индекса"""
+        self.assertEqual(self.registry.unregister(self.first), 'first')
+        self.assertNotIn('first', self.registry)
+        self.assertFalse(self.registry.is_registered(self.first))
+        self.assertIsNone(self.registry.unregister(self.first))
+
+    def test_delete_by_name(self):
+        """Удаление по имени, как в словаре"""
+        del self.registry['second']
+        self.assertFalse(self.registry.is_registered(self.second))
+        self.assertEqual(list(self.registry), ['first'])
+
+    def test_reregister_name(self):
+        """Имя, занятое другим сокетом, не перерегистрируется"""
+        third = FakeClient(3)
+        self.assertRaises(ValueError, self.registry.__setitem__, 'first', third)
+        self.assertIs(self.registry['first'], self.first)
+        self.assertFalse(self.registry.is_registered(third))
+        self.registry['first'] = self.first
+        self.assertEqual(len(self.registry), 2)
+
+    def test_rename_client(self):
+        """Сокет, зарегистрированный под другим именем, теряет старую сессию"""
+        self.registry['third'] = self.first
+        self.assertNotIn('first', self.registry)
+        self.assertEqual(self.registry.name_of(self.first), 'third')
+
+
+if __name__ == '__main__':
+    unittest.main()
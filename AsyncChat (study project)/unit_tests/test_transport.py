@@ -0,0 +1,137 @@
+"""
+Unit-тесты транспорта клиента на паре сокетов
+"""
+
+import os
+import sys
+import socket
+import unittest
+from unittest import mock
+from PyQt5.QtCore import Qt
+
+sys.path.append(os.path.join(os.getcwd(), '..'))
+from common.settings import *
+from common.utils import get_message, send_message, MessageReader
+from client.transport import ClientTransport
+
+
+class SocketTransport(ClientTransport):
+    """Транспорт, подключённый к одному концу пары сокетов.
+    Авторизация, обновление списков и запрос сообщений, полученных
+    не в сети, пропускаются: тесты проверяют только приём ответов."""
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        super().__init__('user', '', 0, None, 'password', None)
+
+    def connection_init(self, ip_address: str, port: int) -> None:
+        self.transport = self.connection
+        self.reader = MessageReader()
+        self.framed = True
+
+    def lists_update(self) -> None:
+        pass
+
+    def offline_messages_receive(self) -> None:
+        pass
+
+
+class TestClientTransport(unittest.TestCase):
+    '''
+    Unit-тесты потока приёма ClientTransport: сервер - второй конец
+    пары сокетов, запросы и ответы передаются кадрами.
+    '''
+
+    def setUp(self) -> None:
+        client, self.server = socket.socketpair()
+        self.server.settimeout(5)
+        self.server_reader = MessageReader()
+        self.transport = SocketTransport(client)
+        self.pushes = []
+        self.transport.message_205.connect(lambda: self.pushes.append(205), Qt.DirectConnection)
+        self.lost = []
+        self.transport.connection_lost.connect(lambda: self.lost.append(1), Qt.DirectConnection)
+        self.transport.start()
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        self.transport.running = False
+        self.transport.join(5)
+        self.transport.transport.close()
+        self.server.close()
+
+    def received(self):
+        """Следующий запрос, принятый сервером"""
+        return get_message(self.server, self.server_reader)
+
+    def reply(self, request_id=None, **fields):
+        """Ответ сервера, с номером запроса или без него"""
+        message = {RESPONSE: 200, **fields}
+        if request_id is not None:
+            message[REQUEST_ID] = request_id
+        send_message(self.server, message, True)
+
+    def submit(self, name):
+        """Отправка запроса; возвращает Future и номер, принятый сервером"""
+        future = self.transport.submit({ACTION: name})
+        request = self.received()
+        self.assertEqual(request[ACTION], name)
+        return future, request[REQUEST_ID]
+
+    def test_205_push(self):
+        """Ответ 205 передаётся сигналом и не принимается за ответ на запрос"""
+        future, request_id = self.submit('first')
+        send_message(self.server, {RESPONSE: 205}, True)
+        self.reply(request_id, answer='first')
+        self.assertEqual(self.transport.wait(future), {RESPONSE: 200, 'answer': 'first'})
+        self.assertEqual(self.pushes, [205])
+
+    def test_out_of_order(self):
+        """Ответы не по порядку доходят до своих запросов по REQUEST_ID"""
+        requests = [self.submit(name) for name in ('first', 'second', 'third')]
+        self.reply(requests[2][1], answer='third')
+        self.reply(requests[0][1], answer='first')
+        self.reply(requests[1][1], answer='second')
+        answers = [self.transport.wait(future)['answer'] for future, _ in requests]
+        self.assertEqual(answers, ['first', 'second', 'third'])
+
+    def test_reply_without_id(self):
+        """Ответ без номера запроса достаётся самому раннему ожидающему запросу"""
+        first, _ = self.submit('first')
+        second, _ = self.submit('second')
+        self.reply(answer='first')
+        self.assertEqual(self.transport.wait(first)['answer'], 'first')
+        self.assertFalse(second.done())
+        self.reply(answer='second')
+        self.assertEqual(self.transport.wait(second)['answer'], 'second')
+
+    def test_timeout_does_not_shift(self):
+        """Запрос, не дождавшийся ответа, не сдвигает ответы на следующие"""
+        first, first_id = self.submit('first')
+        with mock.patch('client.transport.CLIENT_REQUEST_TIMEOUT', 0.1):
+            with self.assertRaises(socket.timeout):
+                self.transport.wait(first)
+        second, _ = self.submit('second')
+        self.reply(answer='second')
+        self.assertEqual(self.transport.wait(second)['answer'], 'second')
+        # Поздний ответ на первый запрос отбрасывается.
+        self.reply(first_id, answer='late')
+        third, _ = self.submit('third')
+        self.reply(answer='third')
+        self.assertEqual(self.transport.wait(third)['answer'], 'third')
+        self.assertFalse(first.done())
+
+    def test_connection_lost(self):
+        """При потере соединения завершаются все ожидающие запросы"""
+        futures = [self.submit(name)[0] for name in ('first', 'second')]
+        self.server.close()
+        for future in futures:
+            with self.assertRaises(ConnectionResetError):
+                self.transport.wait(future)
+        self.transport.join(5)
+        self.assertEqual(self.lost, [1])
+        self.assertEqual(self.transport.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,8 @@ from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
 
 sys.path.append(os.path.join(os.getcwd(), '..'))
 from common.settings import *
-from common.utils import get_message, send_message
-from common.exceptions import NonDictInputError
+from common.utils import get_message, send_message, encode_message, MessageReader
+from common.exceptions import NonDictInputError, IncorrectDataRecivedError
 
 
 class TestUtils(unittest.TestCase):
@@ -127,6 +127,58 @@ class TestUtils(unittest.TestCase):
 
         self.assertIsInstance(get_message(self.client_socket), dict)
 
+    def test_framed_send_get(self):
+        """
+        Проверяем отправку и приём сообщения кадром
+        """
+        send_message(self.client_socket, self.test_message, True)
+        self.assertEqual(get_message(self.client, MessageReader()), self.test_message)
+
+    def test_framed_large_message(self):
+        """
+        Сообщение больше MAX_PACKAGE_LENGTH принимается целиком
+        """
+        message = dict(self.test_correct_response, alert='x' * (MAX_PACKAGE_LENGTH * 100))
+        send_message(self.client, message, True)
+        self.assertEqual(get_message(self.client_socket, MessageReader()), message)
+
+
+class TestMessageReader(unittest.TestCase):
+    '''
+    Unit-тесты буферизованного разборщика кадров
+    '''
+
+    messages = [{'response': 200, 'time': i} for i in range(3)]
+
+    def test_many_frames_one_chunk(self):
+        """Несколько кадров в одном блоке данных"""
+        reader = MessageReader()
+        reader.feed(b''.join(encode_message(message, True) for message in self.messages))
+        self.assertEqual([reader.pop() for _ in range(3)], self.messages)
+        self.assertFalse(reader.has_message())
+
+    def test_split_frame(self):
+        """Кадр, пришедший по одному байту"""
+        reader = MessageReader()
+        frame = encode_message(self.messages[0], True)
+        for i in range(len(frame) - 1):
+            reader.feed(frame[i:i + 1])
+            self.assertFalse(reader.has_message())
+        reader.feed(frame[-1:])
+        self.assertEqual(reader.pop(), self.messages[0])
+
+    def test_frame_too_long(self):
+        """Кадр длиннее допустимого"""
+        reader = MessageReader(max_length=10)
+        self.assertRaises(IncorrectDataRecivedError, reader.feed, encode_message(self.messages[0], True))
+
+    def test_not_dict_frame(self):
+        """Кадр, содержащий не словарь"""
+        reader = MessageReader()
+        payload = json.dumps('not dict').encode(ENCODING)
+        self.assertRaises(IncorrectDataRecivedError, reader.feed,
+                          len(payload).to_bytes(4, 'big') + payload)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file